@@ -1,10 +1,15 @@
 import os
 import io
+import time
 import pandas as pd
 import numpy as np
 from dotenv import load_dotenv
 import requests
 
+# Responses of the catalog routes, by url: (ETag, data). It's kept at module level
+# so that it survives the reruns of the Streamlit scripts
+_revalidation_cache = {}
+
 class Client:
     def __init__(self, st):
         load_dotenv()
@@ -14,6 +19,25 @@ class Client:
 
         self.st = st
     
+    def wait_ready(self, timeout=600, poll_interval=0.5):
+        """ Waits for the backend to complete its warm-up (dataset loading, indexes, ...).
+        Returns True if the backend is ready, False if the warm-up failed or the timeout expired"""
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            try:
+                response = requests.get(self.api_address + "/ready", timeout=5)
+                data = response.json()
+                if data["ready"]:
+                    return True
+                if data["failed"]:
+                    print(f"FLASK warm-up failed: {data['stages']}")
+                    return False
+            except requests.exceptions.RequestException:
+                # The Flask server may be not listening yet
+                pass
+            time.sleep(poll_interval)
+        return False
+
     def crashspot_stop(self):
         try:
             API_URL = self.api_address + "/crashspot_stop"
@@ -21,43 +45,111 @@ class Client:
         except Exception as e:
             self.st.error(f"Error in closing the application: {e}")
     
-    def get_general_cause_of_accident(self, param):
+    def get_revalidated(self, API_URL):
+        """ GETs a catalog route. If a copy of the response is already available, it's
+        revalidated with its ETag: when the backend answers 304 the copy is returned
+        without transferring and parsing the response again"""
+        cached = _revalidation_cache.get(API_URL)
+        headers = {"If-None-Match": cached[0]} if cached is not None else {}
+        response = requests.get(API_URL, headers=headers)
+        if response.status_code == 304 and cached is not None:
+            return cached[1]
+        data = response.json()
+        etag = response.headers.get("ETag")
+        if etag is not None:
+            _revalidation_cache[API_URL] = (etag, data)
+        return data
+
+    def get_general_cause_of_accident(self, param, min_partition_size=0):
+        """ Returns the general causes of accident of a city/state, excluding those
+        ones with less than min_partition_size accidents"""
         try:
             API_URL = self.api_address + f"/general_cause_of_accident?{param}"
-            response = requests.get(API_URL)
-            return response.json()["causes_list"]
+            data = self.get_revalidated(API_URL)
+            counts = data["counts"]
+            return [cause for cause in data["causes_list"] if counts[cause] >= min_partition_size]
         except Exception as e:
             print(f"FLASK connection error: {e}")
     
     def get_cities(self):
         try:
             API_URL = self.api_address + "/cities"
-            response = requests.get(API_URL)
-            return response.json()["cities_list"]
+            return self.get_revalidated(API_URL)["cities_list"]
         except Exception as e:
             print(f"FLASK connection error: {e}")
     
     def get_states(self):
         try:
             API_URL = self.api_address + "/states"
-            response = requests.get(API_URL)
-            return response.json()["states_list"]
+            return self.get_revalidated(API_URL)["states_list"]
         except Exception as e:
             print(f"FLASK connection error: {e}")
     
-    def select_clustering_mode(self, algorithm, city, state, cause):
+    def submit_clustering_job(self, payload):
+        """ Submits a clustering request to the backend. Returns the id of the job"""
+        API_URL = self.api_address + "/clustering_jobs"
+        response = requests.post(API_URL, json=payload, timeout=30)
+        response.raise_for_status()
+        return response.json()["job_id"]
+
+    def get_clustering_job(self, job_id):
+        """ Returns the status of a clustering job"""
+        API_URL = self.api_address + f"/clustering_jobs/{job_id}"
+        response = requests.get(API_URL, timeout=30)
+        response.raise_for_status()
+        return response.json()
+
+    def cancel_clustering_job(self, job_id):
+        """ Cancels a clustering job, ignoring the errors: the job may be already finished"""
+        try:
+            API_URL = self.api_address + f"/clustering_jobs/{job_id}/cancel"
+            requests.post(API_URL, timeout=5)
+        except requests.exceptions.RequestException as e:
+            print(f"FLASK connection error: {e}")
+
+    def select_clustering_mode(self, algorithm, city, state, cause, poll_interval=1.0, timeout=None):
         """ Returns both the labelled dataframe and the clustering performances
-        responses to the frontend"""
+        responses to the frontend. The clustering runs as a job on the backend: its
+        progress is shown while it's polled. If the page is left, the Cancel button is
+        pressed or the timeout (in seconds) expires, the job is cancelled.
+        Returns None if the job fails or is cancelled"""
+        job_id = None
+        finished = False
         try:
-             API_URL = self.api_address + "/clustering"
              payload = {
                  "algorithm": algorithm,
                  "city": city if city is not None else "",
                  "state": state if state is not None else "",
                  "cause": cause
              }
-             response = requests.post(API_URL, json=payload)
-             data = response.json()
+             job_id = self.submit_clustering_job(payload)
+             # Pressing the button reruns the script: the polling is interrupted
+             # and the job is cancelled below
+             self.st.button("Cancel", key="cancel_clustering")
+             progress_bar = self.st.progress(0.0, text="Waiting for a free worker..")
+             deadline = time.monotonic() + timeout if timeout is not None else None
+             while True:
+                 job = self.get_clustering_job(job_id)
+                 if job["status"] == "done":
+                     break
+                 if job["status"] in ("failed", "cancelled"):
+                     finished = True
+                     print(f"FLASK clustering job {job['status']}: {job.get('error')}")
+                     return None
+                 if deadline is not None and time.monotonic() >= deadline:
+                     print("FLASK clustering job timed out")
+                     return None
+                 # Updated at every poll: Streamlit interrupts the script at its next call
+                 done, total = job["progress"]["done"], job["progress"]["total"]
+                 if job["status"] == "running" and total:
+                     progress_bar.progress(min(done / total, 1.0),
+                                           text=f"Tuning the parameters: {done}/{total} combinations")
+                 else:
+                     progress_bar.progress(0.0, text="Waiting for a free worker..")
+                 time.sleep(poll_interval)
+             finished = True
+             progress_bar.empty()
+             data = job["result"]
              
              sts = data["sts"]
              if sts == -1: # in this case the other fields are not returned by the backend, because no cluster exists
@@ -70,6 +162,10 @@ class Client:
              return sts, hopkins, max_eps, df_labelled, df_perf
         except Exception as e:
             print(f"FLASK connection error: {e}")
+        finally:
+            # Also reached when Streamlit stops the script for a rerun
+            if job_id is not None and not finished:
+                self.cancel_clustering_job(job_id)
 
     def get_features(self):
         """ Returns to the frontend the list of features selected by the model
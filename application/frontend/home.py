@@ -25,11 +25,24 @@ def read_confidence_threshold():
     utility = Utility()
     return utility.read_json(path, mode="field", field="predict_proba_threshold")
 
+def read_min_partition_size():
+    path = get_absolute_path("../config.json")
+    utility = Utility()
+    return utility.read_json(path, mode="field", field="min_partition_size")
+
 # Page title
 st.markdown("<h1 style='text-align: center;'><em>CrashSpot</em></h1>", unsafe_allow_html=True)
 
 client = Client(st)
 
+# The backend loads the dataset in background: we wait for it only once per session
+if not st.session_state.get("backend_ready"):
+    with st.spinner("Waiting for the backend to load the dataset..."):
+        st.session_state["backend_ready"] = client.wait_ready()
+    if not st.session_state["backend_ready"]:
+        st.error("The backend is not available. Check the logs of the application.")
+        st.stop()
+
 # We have to exploit the onchange callback of the selectbox method
 granularityOptions = st.selectbox(
     label = "Granularity selection:",
@@ -49,10 +62,16 @@ match granularityOptions:
             index = None,
             placeholder="Select.."
         )
-        algorithm = "DBSCAN"
+        # HDBSCAN clusters the city with a single fit, without the parameter sweep of DBSCAN
+        algorithm = st.selectbox(
+            label = "Clustering algorithm:",
+            options=("DBSCAN", "HDBSCAN"),
+            index = 0
+        )
         stateOptions = None
 
-        accident_causes_list = client.get_general_cause_of_accident(f"city={citiesOptions}")
+        # The causes with too few accidents to be clustered are not shown
+        accident_causes_list = client.get_general_cause_of_accident(f"city={citiesOptions}", read_min_partition_size())
         causeOfAccidentOptions = st.selectbox(
             label = "Cause of accident:",
             options=accident_causes_list,
@@ -69,10 +88,14 @@ match granularityOptions:
             index = None,
             placeholder="Select.."
         )
-        algorithm = "OPTICS"
+        algorithm = st.selectbox(
+            label = "Clustering algorithm:",
+            options=("OPTICS", "HDBSCAN"),
+            index = 0
+        )
         citiesOptions = None
 
-        accident_causes_list = client.get_general_cause_of_accident(f"state={stateOptions}")
+        accident_causes_list = client.get_general_cause_of_accident(f"state={stateOptions}", read_min_partition_size())
         causeOfAccidentOptions = st.selectbox(
             label = "Cause of accident:",
             options=accident_causes_list,
@@ -88,19 +111,23 @@ match granularityOptions:
 
 if granularityOptions != None and causeOfAccidentOptions != None:
     if st.button("Discover hotspots", type="primary"):
-        sts, hopkins, max_eps, df_labelled, df_performance = client.select_clustering_mode(algorithm, citiesOptions, stateOptions, causeOfAccidentOptions)
-        handler.set_sts(sts)
-        if sts != -1:
-            handler.set_dataframe(df_labelled)
-            handler.set_clustering_perf(df_performance)
-            handler.set_hopkins_max_eps(hopkins, max_eps)
-            if citiesOptions != None:
-                handler.set_graph_title(f"{causeOfAccidentOptions} accidents distribution - City: {citiesOptions}")
-            if stateOptions != None:
-                handler.set_graph_title(f"{causeOfAccidentOptions} accidents distrubtion  - State: {stateOptions}")
-            # Computation of the hotspot score
-            handler.compute_hotspot_score()
-        st.switch_page("pages/graph.py")
+        clustering_result = client.select_clustering_mode(algorithm, citiesOptions, stateOptions, causeOfAccidentOptions)
+        if clustering_result is None:
+            st.error("Error. The clustering didn't complete, please retry")
+        else:
+            sts, hopkins, max_eps, df_labelled, df_performance = clustering_result
+            handler.set_sts(sts)
+            if sts != -1:
+                handler.set_dataframe(df_labelled)
+                handler.set_clustering_perf(df_performance)
+                handler.set_hopkins_max_eps(hopkins, max_eps)
+                if citiesOptions != None:
+                    handler.set_graph_title(f"{causeOfAccidentOptions} accidents distribution - City: {citiesOptions}")
+                if stateOptions != None:
+                    handler.set_graph_title(f"{causeOfAccidentOptions} accidents distrubtion  - State: {stateOptions}")
+                # Computation of the hotspot score
+                handler.compute_hotspot_score()
+            st.switch_page("pages/graph.py")
 
 if granularityOptions != None and uploaded_file != None:
     if st.button("Predict", type="primary"):
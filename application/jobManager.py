@@ -0,0 +1,243 @@
+import os
+import json
+import time
+import uuid
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+class JobCancelled(Exception):
+    """ Raised inside a job when it's cancelled, to stop it at the next check"""
+    pass
+
+class Job:
+    """ A long-running request executed by the JobManager. The running function reports
+    its progress (steps done out of the total and the partial result) through update, and
+    calls check_cancelled between its steps: a cancelled job stops at the next check.
+    If the job has a state directory, its status is published there at every change, and
+    a cancellation may be requested there by other processes."""
+
+    def __init__(self, key=None, state_dir=None):
+        self.id = uuid.uuid4().hex
+        self.key = key
+        self.state_path = os.path.join(state_dir, self.id + ".json") if state_dir is not None else None
+        self.cancel_path = os.path.join(state_dir, self.id + ".cancel") if state_dir is not None else None
+        self.status = "queued"
+        self.total = None
+        self.done = 0
+        self.partial = None
+        self.result = None
+        self.error = None
+        self.submitted = time.time()
+        self.started = None
+        self.finished = None
+        self.future = None
+        self.cancel_event = threading.Event()
+        self.lock = threading.Lock()
+
+    def set_total(self, total):
+        """ Sets the number of steps of the job and restarts the count of the done ones"""
+        with self.lock:
+            self.total = total
+            self.done = 0
+        self.publish()
+
+    def update(self, steps, partial=None):
+        """ Adds steps to the done ones and replaces the partial result, if given"""
+        with self.lock:
+            self.done += steps
+            if partial is not None:
+                self.partial = partial
+        self.publish()
+
+    def check_cancelled(self):
+        """ Raises JobCancelled if the job has been cancelled"""
+        if self.cancel_path is not None and not self.cancel_event.is_set() and os.path.exists(self.cancel_path):
+            self.cancel_event.set()
+        if self.cancel_event.is_set():
+            raise JobCancelled()
+
+    def publish(self):
+        """ Writes the status of the job in the state directory, if any. The file is
+        replaced atomically, so that a concurrent reader never sees a partial status"""
+        if self.state_path is None:
+            return
+        tmp_path = self.state_path + f".{threading.get_ident()}.tmp"
+        try:
+            with open(tmp_path, "w") as file:
+                json.dump(self.to_dict(), file)
+            os.replace(tmp_path, self.state_path)
+        except OSError as e:
+            print(f"[ERR] Status of the job {self.id} not written: {e}")
+
+    def unpublish(self):
+        """ Removes the files of the job from the state directory, if any"""
+        for path in (self.state_path, self.cancel_path):
+            if path is not None and os.path.exists(path):
+                os.remove(path)
+
+    def is_active(self):
+        return self.status in ("queued", "running")
+
+    def to_dict(self):
+        """ Returns the status of the job, ready to be serialized. The result is included
+        only when the job is done, the partial result while it's running"""
+        with self.lock:
+            status = {
+                "job_id": self.id,
+                "status": self.status,
+                "progress": {"done": self.done, "total": self.total},
+                "submitted": self.submitted,
+                "started": self.started,
+                "finished": self.finished
+            }
+            if self.status == "done":
+                status["result"] = self.result
+            elif self.status == "running":
+                status["partial"] = self.partial
+            elif self.status == "failed":
+                status["error"] = self.error
+            return status
+
+class JobManager:
+    """ Runs the jobs on a pool of max_workers threads. At most max_queued jobs wait for a
+    free worker, further submissions are refused. The finished jobs are kept, up to
+    max_jobs, until their status is read by the clients. A job submitted with the key of
+    an active job is not run twice: the active job is returned. The manager is thread-safe.
+    When several processes serve the same clients, each one with its own manager, the
+    managers share a state directory: the status of a job can be read, and the job
+    cancelled, by any of them."""
+
+    def __init__(self, max_workers=2, max_queued=16, max_jobs=100, state_dir=None):
+        """ Creates a new instance of the class JobManager
+            Args:
+                max_workers: Optional field. The number of jobs running at the same time
+                max_queued: Optional field. The largest number of jobs waiting for a worker
+                max_jobs: Optional field. The largest number of jobs kept, the oldest finished
+                ones are forgotten first
+                state_dir: Optional field. The directory shared with the managers of the other
+                processes, None if the jobs are served by this process only
+        """
+        self.max_queued = max_queued
+        self.max_jobs = max_jobs
+        self.state_dir = None
+        self.set_state_dir(state_dir)
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="job")
+        self.jobs = OrderedDict()
+        self.lock = threading.Lock()
+
+    def set_state_dir(self, state_dir):
+        """ Sets the directory shared with the managers of the other processes. It must be
+        set before the first job is submitted"""
+        self.state_dir = state_dir
+        if state_dir is not None:
+            os.makedirs(state_dir, exist_ok=True)
+
+    def submit(self, fn, key=None):
+        """ Queues a job
+            Args:
+                fn: A function receiving the Job and returning its result, which must be
+                serializable as JSON
+                key: Optional field. Identifies the request: while a job with the same key
+                is queued or running, it's returned instead of a new one
+            Returns:
+                The Job, None if too many jobs are queued
+        """
+        with self.lock:
+            if key is not None:
+                for job in self.jobs.values():
+                    if job.key == key and job.is_active() and not job.cancel_event.is_set():
+                        return job
+            queued = sum(1 for job in self.jobs.values() if job.status == "queued")
+            if queued >= self.max_queued:
+                return None
+            job = Job(key, self.state_dir)
+            self.jobs[job.id] = job
+            self.evict()
+        job.publish()
+        job.future = self.executor.submit(self.run, job, fn)
+        return job
+
+    def run(self, job, fn):
+        with job.lock:
+            cancelled = job.cancel_event.is_set()
+            job.status = "cancelled" if cancelled else "running"
+            job.started = time.time()
+            if cancelled:
+                job.finished = job.started
+        job.publish()
+        if cancelled:
+            return
+        try:
+            result = fn(job)
+        except JobCancelled:
+            status, result, error = "cancelled", None, None
+            print(f"[INFO] Job {job.id} cancelled")
+        except Exception as e:
+            status, result, error = "failed", None, str(e)
+            print(f"[ERR] Job {job.id} failed: {e}")
+        else:
+            status, error = "done", None
+        with job.lock:
+            job.status = status
+            job.result = result
+            job.error = error
+            job.finished = time.time()
+        job.publish()
+
+    def get(self, job_id):
+        """ Returns the job, None if it doesn't exist in this process"""
+        with self.lock:
+            return self.jobs.get(job_id)
+
+    def status(self, job_id):
+        """ Returns the status of a job (see Job.to_dict), read from the state directory if
+        the job runs in another process. None if the job doesn't exist"""
+        job = self.get(job_id)
+        if job is not None:
+            return job.to_dict()
+        return self.read_state(job_id)
+
+    def read_state(self, job_id):
+        # The job id is used as a file name: it must be a uuid
+        if self.state_dir is None or not job_id.isalnum():
+            return None
+        try:
+            with open(os.path.join(self.state_dir, job_id + ".json"), "r") as file:
+                return json.load(file)
+        except (OSError, ValueError):
+            return None
+
+    def cancel(self, job_id):
+        """ Cancels a job: a queued job never starts, a running one stops at its next check.
+        The job of another process is cancelled through the state directory.
+        Returns the status of the job, None if it doesn't exist"""
+        job = self.get(job_id)
+        if job is None:
+            status = self.read_state(job_id)
+            if status is not None and status["status"] in ("queued", "running"):
+                open(os.path.join(self.state_dir, job_id + ".cancel"), "w").close()
+            return status
+        job.cancel_event.set()
+        with job.lock:
+            cancelled = job.status == "queued" and job.future is not None and job.future.cancel()
+            if cancelled:
+                job.status = "cancelled"
+                job.finished = time.time()
+        if cancelled:
+            job.publish()
+        return job.to_dict()
+
+    def evict(self):
+        """ Forgets the oldest finished jobs beyond max_jobs. The lock must be held"""
+        finished = [job_id for job_id, job in self.jobs.items() if not job.is_active()]
+        for job_id in finished[:max(0, len(self.jobs) - self.max_jobs)]:
+            self.jobs.pop(job_id).unpublish()
+
+    def stats(self):
+        """ Returns the number of jobs in each status, ready to be serialized"""
+        with self.lock:
+            counts = {}
+            for job in self.jobs.values():
+                counts[job.status] = counts.get(job.status, 0) + 1
+            return counts
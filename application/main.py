@@ -1,5 +1,9 @@
 import os
+import shutil
+import tempfile
 import threading
+import multiprocessing
+import functools
 import joblib
 import numpy as np
 import pandas as pd
@@ -7,16 +11,23 @@ import io
 from dotenv import load_dotenv
 from flask import Flask
 from flask import request
+from flask import make_response
 from ml.hotspotDetector.datasetLoader import DatasetLoader
 from ml.hotspotDetector.preprocessing import Preprocessing
-from ml.hotspotDetector.cityClustering import CityClustering
-from ml.hotspotDetector.stateClustering import StateClustering
+from ml.hotspotDetector.partitionIndex import PartitionIndex
+from ml.hotspotDetector.coordinateStore import CoordinateStore
+from ml.hotspotDetector.catalog import Catalog
+from ml.hotspotDetector.clusteringService import ClusteringService
+from ml.hotspotDetector.resultCache import ResultCache
 from ml.configloader import ConfigLoader
 from ml.severityPrediction.manufacturingYearImputer import ManufacturingYearImputer
 from ml.severityPrediction.personSexImputer import PersonSexImputer
 from ml.severityPrediction.frequencySubsetEncoder import FrequencySubsetEncoder
 from ml.severityPrediction.ordinalSubsetEncoder import OrdinalSubsetEncoder
 from webview import WebView
+from warmup import Warmup
+from jobManager import JobManager
+from preforkServer import PreforkServer
 
 load_dotenv()
 FLASK_PORT = os.getenv('FLASK_PORT')
@@ -27,6 +38,9 @@ app = Flask(__name__)
 # of the classification model from the frontend to avoid un-useful overhead
 _model = None
 _require_conversion = None
+_model_lock = threading.Lock()
+# Serializes the incremental appends of new accident files
+_ingest_lock = threading.Lock()
 
 def get_model():
     """ Loads the model from the joblib file into the main memory
@@ -38,19 +52,38 @@ def get_model():
     models_requiring_conversion = ['models/xgboost.joblib', 'models/lightgbm.joblib']
     if not os.path.exists(model_name):
         print("[ERR] Model file not found")
-        return -1
+        return -1, None
     
     global _model
     global _require_conversion
-    if _model is None:
-        _model = joblib.load(model_name)
-        _require_conversion = False
-        print("[INFO] Joblib ended the loading of the model..")
-        if model_name in models_requiring_conversion:
-            _require_conversion = True
+    # The model may be requested by the warm-up and by a request at the same time:
+    # the lock guarantees that it's loaded only once
+    with _model_lock:
+        if _model is None:
+            _model = joblib.load(model_name)
+            _require_conversion = False
+            print("[INFO] Joblib ended the loading of the model..")
+            if model_name in models_requiring_conversion:
+                _require_conversion = True
              
     return _model, _require_conversion
 
+def requires_warmup(handler):
+    """ Decorator for the routes needing the dataset: until the warm-up is completed
+    they answer 503, along with the progress of the warm-up"""
+    @functools.wraps(handler)
+    def wrapper(*args, **kwargs):
+        if not warmup.is_ready():
+            return warmup.status(), 503
+        return handler(*args, **kwargs)
+    return wrapper
+
+@app.route("/ready", methods=["GET"])
+def ready():
+    """ Reports the progress and the timings of the warm-up stages"""
+    status = warmup.status()
+    return status, 200 if status["ready"] else 503
+
 @app.route("/crashspot_stop", methods=["POST"])
 def crashspot_stop():
     stop_event.set()
@@ -59,93 +92,139 @@ def crashspot_stop():
         shutdown()
     return {"status": "ok"}, 200
 
+def catalog_response(payload):
+    """ Builds the response of a route served from the catalog, tagged with the ETag
+    and the Last-Modified date of the catalog. If the client already has the current
+    version of the resource (If-None-Match/If-Modified-Since), a 304 is returned"""
+    response = make_response(payload)
+    response.set_etag(catalog.getETag(request.full_path))
+    response.last_modified = catalog.getLastModified()
+    # The client may keep the response, but it has to revalidate it every time
+    response.cache_control.no_cache = True
+    return response.make_conditional(request)
+
 @app.route("/general_cause_of_accident", methods=["GET"])
+@requires_warmup
 def send_general_cause_of_accident():
     city = request.args.get("city")
     state = request.args.get("state")
+    causes = {}
     if city != None:
-        causes_list = preprocessing.getGeneralCausesCity(city)
+        causes = catalog.getCausesCity(city)
     if state != None:
-        causes_list = preprocessing.getGeneralCausesState(state)
-    return {"causes_list": causes_list}, 200
+        causes = catalog.getCausesState(state)
+    # The number of accidents of each partition lets the frontend hide the partitions
+    # too small to be clustered
+    return catalog_response({"causes_list": list(causes), "counts": causes})
 
 @app.route("/cities", methods=["GET"])
+@requires_warmup
 def send_cities():
-    cities_list = preprocessing.getCities()
-    return {"cities_list": cities_list}, 200
+    return catalog_response({"cities_list": catalog.getCities()})
 
 @app.route("/states", methods=["GET"])
+@requires_warmup
 def send_states():
-    states_list = preprocessing.getStates()
-    return {"states_list": states_list}, 200
+    return catalog_response({"states_list": catalog.getStates()})
+
+def parse_clustering_payload(payload):
+    """ Returns the algorithm, the granularity, the name of the city or state and the
+    cause of a clustering request, None if the algorithm is unknown"""
+    algorithm = payload.get("algorithm", "")
+    if algorithm not in ClusteringService.ALGORITHMS:
+        return None
+    # HDBSCAN works on the city, if given, or on the state
+    granularity = clusteringService.get_granularity(algorithm, "city" if payload.get("city") else "state")
+    return algorithm, granularity, payload[granularity], payload["cause"]
+
+def cached_clustering(algorithm, granularity, name, cause, progress=None):
+    """ Returns the response of a clustering request, computing it only if it isn't cached.
+    The same partitions are requested again and again: the responses are cached
+    until the partition or the parameters of the clustering change"""
+    key = clusteringService.cache_key(resultCache, algorithm, name, cause,
+                                      partitionIndex, dataset_fingerprint, granularity)
+    response = resultCache.get(key)
+    if response is None:
+        response = clusteringService.cluster(preprocessed_df, partitionIndex, coordinateStore,
+                                             algorithm, name, cause, granularity,
+                                             dataset_fingerprint, progress)
+        resultCache.put(key, response)
+    return response
 
 @app.route("/clustering", methods=["POST"])
+@requires_warmup
 def clustering():
+    request_params = parse_clustering_payload(request.get_json())
+    if request_params is None:
+        return {"error": f"Unknown algorithm {request.get_json().get('algorithm', '')}"}, 400
+    return cached_clustering(*request_params), 200
+
+@app.route("/clustering_jobs", methods=["POST"])
+@requires_warmup
+def submit_clustering_job():
+    """ Runs a clustering request in background. The response is the id of the job,
+    whose progress is reported by /clustering_jobs/<job_id>"""
+    request_params = parse_clustering_payload(request.get_json())
+    if request_params is None:
+        return {"error": f"Unknown algorithm {request.get_json().get('algorithm', '')}"}, 400
+    algorithm, granularity, name, cause = request_params
+    # The same request submitted again while it's running joins the running job
+    key = clusteringService.cache_key(resultCache, algorithm, name, cause,
+                                      partitionIndex, dataset_fingerprint, granularity)
+    job = jobManager.submit(lambda job: cached_clustering(algorithm, granularity, name, cause, job), key)
+    if job is None:
+        return {"error": "Too many queued jobs, retry later"}, 503
+    return {"job_id": job.id, "status": job.status}, 202
+
+@app.route("/clustering_jobs/<job_id>", methods=["GET"])
+def clustering_job_status(job_id):
+    """ Reports the status of a clustering job: the parameter combinations run out of the
+    total and the best 3 ones found so far while it's running, the response of /clustering
+    when it's done"""
+    status = jobManager.status(job_id)
+    if status is None:
+        return {"error": "Job not found"}, 404
+    return status, 200
+
+@app.route("/clustering_jobs/<job_id>/cancel", methods=["POST"])
+def cancel_clustering_job(job_id):
+    """ Cancels a clustering job: a running job stops after the current parameter combinations"""
+    status = jobManager.cancel(job_id)
+    if status is None:
+        return {"error": "Job not found"}, 404
+    return status, 200
+
+@app.route("/cache_stats", methods=["GET"])
+def cache_stats():
+    """ Reports the hits and the misses of the cache of the clustering results
+    and of the cache of the k-distance curves"""
+    stats = resultCache.stats()
+    stats["kdistance"] = clusteringService.kDistanceCache.stats()
+    return stats, 200
+
+@app.route("/ingest", methods=["POST"])
+@requires_warmup
+def ingest():
+    """ Appends the accidents of a new file to the dataset, without restarting the backend.
+    The file must have the attributes of the brasilian aggregated dataset"""
+    if serving_mode == "prefork":
+        # Every worker has its own copy of the dataset: an append would reach only one of them
+        return {"error": "Not available in the prefork serving mode, restart the backend"}, 409
     payload = request.get_json()
-    algorithm = payload.get("algorithm", "")
-    if algorithm == "DBSCAN":
-        cityClustering = CityClustering(preprocessed_df, 
-                        payload["city"],
-                        payload["cause"],
-                        configloader.getKDistGraph(),
-                        configloader.get_dbscanMinEps(),
-                        configloader.get_dbscanStepEps(),
-                        configloader.get_dbscanMinPtsArr())
-        hopkins = cityClustering.getHopkins()
-        knee = cityClustering.knee_heurstic_search()
-        sts, cityClustering_perf = cityClustering.clustering_tuning()
-
-        if sts == -1:
-            response = {
-                "sts": sts
-            }
-            return response, 200
-
-        cityClustering.run(eps_km = cityClustering_perf.iloc[0,0],
-                                minPts=cityClustering_perf.iloc[0,1])
-        print(f"eps_km: {cityClustering_perf.iloc[0,0]}, minPts: {cityClustering_perf.iloc[0,1]}")
-        cityClustering.attachLabels()
-        cityClustering.add_victims_condition_rank()
-        # We have to serialize both the dataframe and the clustering 
-        # performances as a response to the frontend
-        response = {
-            "sts": sts,
-            "hopkins": hopkins,
-            "max_eps": knee,
-            "dfLabelled": cityClustering.get_dfLabelled().to_json(),
-            "clusteringPerf": cityClustering_perf.to_json()
-        }
-        return response, 200
-    if algorithm == "OPTICS":
-        max_eps = configloader.get_opticsMaxRadiusArr()[-1]
-        stateClustering = StateClustering(preprocessed_df, 
-                        payload["state"],
-                        payload["cause"],
-                        configloader.get_opticsMaxRadiusArr(),
-                        configloader.get_opticsMinPtsArr(),
-                        configloader.get_opticsXiArr())
-        hopkins = stateClustering.getHopkins()
-        sts, stateClustering_perf = stateClustering.clustering_tuning()
-
-        if sts == -1:
-            response = {
-                "sts": sts
-            }
-            return response, 200
-
-        stateClustering.run(minPts = stateClustering_perf.iloc[0,0],
-                max_eps = stateClustering_perf.iloc[0,1],
-                xi = stateClustering_perf.iloc[0,2])
-        stateClustering.attachLabels()
-        stateClustering.add_victims_condition_rank()
-        response = {
-            "sts": sts,
-            "hopkins": hopkins,
-            "max_eps": max_eps,
-            "dfLabelled": stateClustering.get_dfLabelled().to_json(),
-            "clusteringPerf": stateClustering_perf.to_json()
-        }
-        return response, 200
+    path = payload.get("path")
+    if path is None or not os.path.exists(path):
+        return {"error": "File not found"}, 400
+    with _ingest_lock:
+        since_version = partitionIndex.getVersion()
+        appended_rows = append_dataset(path)
+    if appended_rows is None:
+        return {"appended_rows": 0, "version": since_version}, 200
+    response = {
+        "appended_rows": appended_rows,
+        "version": partitionIndex.getVersion(),
+        "changed_partitions": partitionIndex.getChangedPartitions(since_version)
+    }
+    return response, 200
 
 @app.route("/selected_features", methods=["GET"])
 def send_selected_features():
@@ -205,24 +284,139 @@ def classify():
 def run_flask():
     app.run(host="0.0.0.0", port=FLASK_PORT)
 
-# We run Flask as a separated thread
-flask_thread = threading.Thread(target=run_flask, daemon=True)
-flask_thread.start()
+def load_dataset():
+    global datasetloader
+    global cleaned_df
+    global dataset_fingerprint
+    datasetloader = DatasetLoader(full_dataset_path=configloader.getFullDataset(),
+                        clean_dataset_path=configloader.getCleanDataset())
+    cleaned_df = datasetloader.loadDataset()
+    if cleaned_df is None:
+        raise Exception("No dataset available")
+    # The fingerprint changes with the appends, but the cached results of the partitions
+    # not touched by an append stay valid: within a run they're keyed by the fingerprint
+    # at load time and by the version of the partition
+    dataset_fingerprint = datasetloader.getFingerprint()
+
+def preprocess_dataset():
+    global preprocessing
+    global preprocessed_df
+    preprocessing = Preprocessing(cleaned_df)
+    preprocessing.drop_columns(cols_to_keep=["latitude",
+                "longitude", "cause_of_accident", "victims_conditions", "road_id", "km", "city", "state", "victims_condition"])
+    preprocessing.map_general_causes()
+    preprocessing.compact_dataframe()
+    preprocessed_df = preprocessing.getDataframe()
+
+def build_indexes():
+    global partitionIndex
+    global coordinateStore
+    global catalog
+    # Built once, it makes the extraction of every (city/state, cause) partition
+    # proportional to the size of the partition
+    partitionIndex = PartitionIndex(preprocessed_df)
+    # The coordinates in radians are memory-mapped from disk, so that they are
+    # shared with any other process of the backend
+    store_dir = os.path.splitext(configloader.getCleanDataset())[0] + "_coordinates"
+    coordinateStore = CoordinateStore(store_dir)
+    coordinateStore.load_or_build(preprocessed_df, datasetloader.getFingerprint())
+    # The builds of the previous runs of the backend are not used anymore
+    coordinateStore.remove_stale_builds()
+    # The lists served to the frontend are computed once here
+    catalog = Catalog(preprocessed_df, partitionIndex)
+
+def append_dataset(path):
+    """ Cleans, pre-processes and indexes the rows of a new file, then publishes them.
+    Since the rows are only appended, the positions used by the old index and the old
+    coordinate store stay valid in the new dataframe: the requests being served while
+    the globals are replaced see a consistent (old or new) view of the data.
+    Returns the number of appended rows, None if the file was already appended"""
+    global cleaned_df
+    global preprocessed_df
+    global coordinateStore
+    global catalog
+    new_rows_df = datasetloader.append_dataset(path)
+    if new_rows_df is None:
+        return None
+    start = len(preprocessed_df)
+    preprocessing.append_rows(new_rows_df)
+    cleaned_df = datasetloader.getDataframe()
+    preprocessed_df = preprocessing.getDataframe()
+    partitionIndex.append(preprocessed_df, start)
+    # The store is sorted by state, so it's rebuilt in a new folder and a new object is
+    # published: the requests using the old one keep reading the old folder
+    store = CoordinateStore(coordinateStore.store_dir)
+    store.load_or_build(preprocessed_df, datasetloader.getFingerprint())
+    # The old folder may still be memory-mapped by the requests in progress: it's
+    # removed by the next append (or restart), the older ones now
+    store.remove_stale_builds(keep=[coordinateStore.get_buildName()])
+    coordinateStore = store
+    catalog = Catalog(preprocessed_df, partitionIndex)
+    return len(new_rows_df)
+
+def preload_model():
+    model, _ = get_model()
+    if model == -1:
+        raise Exception("Model file not found")
 
 configloader = ConfigLoader(os.path.join(os.path.dirname(__file__), "config.json"))
-datasetloader = DatasetLoader(full_dataset_path=configloader.getFullDataset(),
-                    clean_dataset_path=configloader.getCleanDataset())
-cleaned_df = datasetloader.loadDataset()
-preprocessing = Preprocessing(cleaned_df)
-preprocessing.drop_columns(cols_to_keep=["latitude",
-            "longitude", "cause_of_accident", "victims_conditions", "road_id", "km", "city", "state", "victims_condition"])
-preprocessing.map_general_causes()
-preprocessed_df = preprocessing.getDataframe()
-
-# Automatically ends the process associated to the frontend at the
-# end of life of the main program
-with WebView() as webview:
-    
-    # We wait for the button to be pressed, so that the subprocess terminates naturally
-    # When this happens, we exit from the application
-    stop_event.wait()
\ No newline at end of file
+# The backend is multi-threaded (requests, jobs, BLAS/OpenMP): a forked worker could
+# deadlock on a lock held by another thread, so the sweeps run on threads. The fork
+# pool of the config file is used by the offline tools (e.g. precompute_hotspots.py)
+clusteringService = ClusteringService(configloader, tuning_executor="thread")
+# The on-disk tier keeps the results across the restarts of the backend
+resultCache = ResultCache(max_entries=configloader.get_resultCacheEntries(),
+                    disk_dir=configloader.get_resultCacheDir())
+# The long clustering requests run in background on a bounded number of threads
+jobManager = JobManager(max_workers=configloader.get_jobWorkers(),
+                    max_queued=configloader.get_jobMaxQueued(),
+                    max_jobs=configloader.get_jobMaxKept())
+
+warmup = Warmup()
+warmup.add_stage("dataset", load_dataset)
+warmup.add_stage("preprocessing", preprocess_dataset)
+warmup.add_stage("indexes", build_indexes)
+if configloader.get_preloadModel():
+    warmup.add_stage("model", preload_model)
+
+serving_mode = configloader.get_servingMode()
+if serving_mode == "prefork" and not PreforkServer.is_supported():
+    print("[INFO] The prefork serving mode requires fork, using the thread mode")
+    serving_mode = "thread"
+
+if serving_mode == "prefork":
+    # The button may be pressed in any worker: the event must be shared with the parent
+    stop_event = multiprocessing.get_context("fork").Event()
+    # The workers don't share the jobs in memory: their status is shared on disk
+    job_state_dir = tempfile.mkdtemp(prefix="crashspot_jobs_")
+    jobManager.set_state_dir(job_state_dir)
+    server = PreforkServer(app, "0.0.0.0", FLASK_PORT, configloader.get_servingWorkers(), stop_event)
+    with WebView() as webview:
+        # The dataset is loaded before forking, while the frontend process starts:
+        # the workers share it copy-on-write. The frontend waits for the port to open
+        warmup.run()
+        if warmup.failed:
+            print("[ERR] Warm-up failed, the backend is not started")
+        else:
+            server.start()
+            try:
+                server.supervise()
+            finally:
+                server.stop()
+    shutil.rmtree(job_state_dir, ignore_errors=True)
+else:
+    # We run Flask as a separated thread: until the warm-up is completed it
+    # reports its progress through the /ready route
+    flask_thread = threading.Thread(target=run_flask, daemon=True)
+    flask_thread.start()
+
+    # The dataset is loaded in background, while the frontend process starts
+    warmup.start()
+
+    # Automatically ends the process associated to the frontend at the
+    # end of life of the main program
+    with WebView() as webview:
+        
+        # We wait for the button to be pressed, so that the subprocess terminates naturally
+        # When this happens, we exit from the application
+        stop_event.wait()
\ No newline at end of file
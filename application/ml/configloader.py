@@ -16,10 +16,39 @@ class ConfigLoader:
         self.dbscan_minEps = json.get("dbscan_minEps", -1)
         self.dbscan_stepEps = json.get("dbscan_stepEps", -1)
         self.dbscan_minPtsArr = json.get("dbscan_minPtsArr", -1)
+        self.dbscan_precomputedGraph = json.get("dbscan_precomputed_graph", False)
         self.optics_maxRadiusArr = json.get("optics_maxRadiusArr", -1)
         self.optics_minPtsArr = json.get("optics_minPtsArr", -1)
         self.optics_xiArr = json.get("optics_xiArr", -1)
+        self.optics_sharedReachability = json.get("optics_shared_reachability", False)
         self.classification_model = json.get("classification_model", -1)
+        self.preload_model = json.get("preload_model", False)
+        self.tuning_workers = json.get("tuning_workers", 1)
+        self.silhouette_exactMaxPoints = json.get("silhouette_exact_max_points", 10000)
+        self.silhouette_sampleSize = json.get("silhouette_sample_size", 2000)
+        self.silhouette_seed = json.get("silhouette_seed", 0)
+        self.silhouette_workingMemoryMb = json.get("silhouette_working_memory_mb", 64)
+        self.clusterMetrics_distance = json.get("cluster_metrics_distance", "euclidean")
+        self.hopkins_seed = json.get("hopkins_seed", None)
+        self.resultCache_entries = json.get("result_cache_entries", 128)
+        self.resultCache_dir = json.get("result_cache_dir", None)
+        self.kDistanceCache_entries = json.get("kdistance_cache_entries", 64)
+        self.job_workers = json.get("job_workers", 2)
+        self.job_maxQueued = json.get("job_max_queued", 16)
+        self.job_maxKept = json.get("job_max_kept", 100)
+        self.serving_mode = json.get("serving_mode", "thread")
+        self.serving_workers = json.get("serving_workers", 0)
+        self.minPartitionSize = json.get("min_partition_size", 0)
+        self.dbscan_graphMaxEdges = json.get("dbscan_graph_max_edges", None)
+        self.dbscan_search = json.get("dbscan_search", "exhaustive")
+        self.dbscan_coarseStep = json.get("dbscan_coarse_step", 4)
+        self.dbscan_timeBudget = json.get("dbscan_time_budget_s", None)
+        self.hdbscan_minClusterSize = json.get("hdbscan_min_cluster_size", 5)
+        self.hdbscan_minSamples = json.get("hdbscan_min_samples", 4)
+        self.hdbscan_clusterSelectionEpsilon = json.get("hdbscan_cluster_selection_epsilon", 0.0)
+        self.projection_mode = json.get("projection_mode", False)
+        self.projection_maxErrorM = json.get("projection_max_error_m", 1.0)
+        self.tuning_executor = json.get("tuning_executor", "process")
     
     def getFullDataset(self):
         return self.full_dataset
@@ -39,6 +68,9 @@ class ConfigLoader:
     def get_dbscanMinPtsArr(self):
         return self.dbscan_minPtsArr
     
+    def get_dbscanPrecomputedGraph(self):
+        return self.dbscan_precomputedGraph
+    
     def get_opticsMaxRadiusArr(self):
         return self.optics_maxRadiusArr
     
@@ -48,5 +80,89 @@ class ConfigLoader:
     def get_opticsXiArr(self):
         return self.optics_xiArr
     
+    def get_opticsSharedReachability(self):
+        return self.optics_sharedReachability
+    
     def get_classificationModel(self):
-        return self.classification_model
\ No newline at end of file
+        return self.classification_model
+    
+    def get_preloadModel(self):
+        return self.preload_model
+    
+    def get_tuningWorkers(self):
+        return self.tuning_workers
+    
+    def get_tuningExecutor(self):
+        return self.tuning_executor
+    
+    def get_silhouetteExactMaxPoints(self):
+        return self.silhouette_exactMaxPoints
+    
+    def get_silhouetteSampleSize(self):
+        return self.silhouette_sampleSize
+    
+    def get_silhouetteSeed(self):
+        return self.silhouette_seed
+    
+    def get_silhouetteWorkingMemoryMb(self):
+        return self.silhouette_workingMemoryMb
+    
+    def get_clusterMetricsDistance(self):
+        return self.clusterMetrics_distance
+    
+    def get_hopkinsSeed(self):
+        return self.hopkins_seed
+    
+    def get_resultCacheEntries(self):
+        return self.resultCache_entries
+    
+    def get_resultCacheDir(self):
+        return self.resultCache_dir
+    
+    def get_minPartitionSize(self):
+        return self.minPartitionSize
+    
+    def get_dbscanGraphMaxEdges(self):
+        return self.dbscan_graphMaxEdges
+    
+    def get_hdbscanMinClusterSize(self):
+        return self.hdbscan_minClusterSize
+    
+    def get_hdbscanMinSamples(self):
+        return self.hdbscan_minSamples
+    
+    def get_hdbscanClusterSelectionEpsilon(self):
+        return self.hdbscan_clusterSelectionEpsilon
+    
+    def get_projectionMode(self):
+        return self.projection_mode
+    
+    def get_projectionMaxErrorM(self):
+        return self.projection_maxErrorM
+    
+    def get_dbscanSearch(self):
+        return self.dbscan_search
+    
+    def get_dbscanCoarseStep(self):
+        return self.dbscan_coarseStep
+    
+    def get_dbscanTimeBudget(self):
+        return self.dbscan_timeBudget
+    
+    def get_kDistanceCacheEntries(self):
+        return self.kDistanceCache_entries
+    
+    def get_jobWorkers(self):
+        return self.job_workers
+    
+    def get_jobMaxQueued(self):
+        return self.job_maxQueued
+    
+    def get_jobMaxKept(self):
+        return self.job_maxKept
+    
+    def get_servingMode(self):
+        return self.serving_mode
+    
+    def get_servingWorkers(self):
+        return self.serving_workers
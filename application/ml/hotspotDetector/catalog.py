@@ -0,0 +1,62 @@
+import json
+import hashlib
+from datetime import datetime, timezone
+
+class Catalog:
+    """ Materialized catalog of the preprocessed dataset: the lists of cities and states,
+    the general causes of accident of each city/state and the number of accidents of each
+    (city/state, cause) partition. It's built once at load time (and after every append),
+    so that the requests are answered from memory. The catalog has a content digest and
+    a modification time, used by the clients to revalidate their copy."""
+
+    def __init__(self, df, partitionIndex):
+        """ Creates a new instance of the class Catalog
+            Args:
+                self: A reference to the current object
+                df: The preprocessed dataframe
+                partitionIndex: The PartitionIndex built over df
+        """
+        # Same order of unique(): order of first appearance in the dataframe
+        self.cities = list(df["city"].unique())
+        self.states = list(df["state"].unique())
+        self.causes_by_city = {}
+        self.causes_by_state = {}
+        for name in self.cities:
+            causes = partitionIndex.getGeneralCausesCity(name)
+            self.causes_by_city[name] = {cause: len(partitionIndex.getCityRows(name, cause)) for cause in causes}
+        for name in self.states:
+            causes = partitionIndex.getGeneralCausesState(name)
+            self.causes_by_state[name] = {cause: len(partitionIndex.getStateRows(name, cause)) for cause in causes}
+        self.version = partitionIndex.getVersion()
+
+        content = json.dumps([self.cities, self.states, self.causes_by_city, self.causes_by_state], default=str)
+        self.digest = hashlib.sha256(content.encode("utf-8")).hexdigest()
+        # HTTP dates have the precision of the second
+        self.last_modified = datetime.now(timezone.utc).replace(microsecond=0)
+
+    def getCities(self):
+        return self.cities
+
+    def getStates(self):
+        return self.states
+
+    def getCausesCity(self, city):
+        """ Returns a dictionary general cause -> number of accidents of the city,
+        in order of first appearance of the causes"""
+        return self.causes_by_city.get(city, {})
+
+    def getCausesState(self, state):
+        """ Returns a dictionary general cause -> number of accidents of the state,
+        in order of first appearance of the causes"""
+        return self.causes_by_state.get(state, {})
+
+    def getVersion(self):
+        return self.version
+
+    def getLastModified(self):
+        return self.last_modified
+
+    def getETag(self, resource):
+        """ Returns the entity tag of a resource derived from the catalog (e.g. the
+        path and the query string of a request). It changes with the content of the catalog"""
+        return hashlib.sha256((self.digest + resource).encode("utf-8")).hexdigest()[:32]
@@ -1,9 +1,9 @@
+import time
 import numpy as np
 import pandas as pd
 from .geoclustering import Geoclustering # searches the module in the same folder
-from sklearn.neighbors import NearestNeighbors
 from sklearn.cluster import DBSCAN
-from kneed import KneeLocator
+from scipy.sparse import csr_matrix
 from utility import Utility
 
 class CityClustering(Geoclustering):
@@ -11,24 +11,39 @@ class CityClustering(Geoclustering):
     Class that implements the hotspot location for specified city
     """
 
-    def __init__(self, df, cityName, accidentCause, k, minEps, stepEps, minPtsArr):
+    def __init__(self, df, cityName, accidentCause, k, minEps, stepEps, minPtsArr, partitionIndex=None, coordinateStore=None):
 
         """ Creates a new instance of the class CityClustering
         Args:
             self: A reference to the current object
             df: A pre-processed dataframe containing accident events records
             cityName: The name of the city to be considered in the analysis
+            partitionIndex: Optional field. The PartitionIndex built over df, used to
+            extract the rows of the city without scanning the whole dataframe
+            coordinateStore: Optional field. The CoordinateStore built over df, providing
+            both the rows of the city and their coordinates in radians
         """
 
         # With this statement we are able to call the constructor of the class Geoclustering
         # We are redefining the constructor for Cityclustering
-        df_city = df.query(f"city == '{cityName}' and general_cause_of_accident == '{accidentCause}'").copy()
-        super().__init__(df_city, accidentCause)
+        arr_Radians = None
+        if coordinateStore is not None:
+            rows, arr_Radians = coordinateStore.getCityPartition(cityName, accidentCause)
+            df_city = df.iloc[rows].copy()
+        elif partitionIndex is not None:
+            df_city = df.iloc[partitionIndex.getCityRows(cityName, accidentCause)].copy()
+        else:
+            df_city = df[(df["city"] == cityName) & (df["general_cause_of_accident"] == accidentCause)].copy()
+        super().__init__(df_city, accidentCause, arr_Radians)
         self.cityName = cityName
         self.k = k
         self.minEps = minEps
         self.stepEps = stepEps
         self.minPtsArr = minPtsArr
+        # Sparse graph of the distances within graph_eps_km, see build_neighbors_graph
+        self.neighbors_graph = None
+        self.graph_eps_km = None
+        self.eps_graph = (None, None)
     
     def knee_heurstic_search(self):
 
@@ -50,30 +65,11 @@ class CityClustering(Geoclustering):
         # Sometimes we might hava a very few set of coordinates
         if coords_rad.shape[0] < self.k:
             self.k = coords_rad.shape[0]
-        # For each object, we consider its distance with the k-th nearest neighbor
-        neigh = NearestNeighbors(n_neighbors=self.k, metric="haversine")
-        neigh.fit(coords_rad)
-
-        # The kneighbors method of neighb object returns the distance as the first
-        # parameter and the index of the nearest point as second parameter
-        # However, we are not interested in the second parameter
-        
-        distances_rad, _ = neigh.kneighbors(coords_rad)
-        
-        # the k-1 column in distances is the distance with the k-th nearest neighbor
-        # : is to consider the distance between EACH point and that k-th neighbor
-        # We consider a decreasing order, that is not implemented in numpy
-
-        kth_rad = distances_rad[:,self.k-1]
-        kth_km = kth_rad * Utility.getEarthRadius()
-
-        kth_km_sorted = np.sort(kth_km)[::-1]
-
-        # Looking for the knee of the K-distance graph
-        x = np.arange(1, len(kth_km_sorted)+1)
-        y = kth_km_sorted
-        knee = KneeLocator(x, y, curve="convex", direction="decreasing")
-        eps = y[knee.knee] if knee.knee is not None else None
+        # For each object, we consider its distance with the k-th nearest neighbor,
+        # in non-increasing order, and we look for the knee of the K-distance graph.
+        # The curve and the tree (shared with the Hopkins statistic) are cached
+        # with the partition, if the object has a KDistanceCache entry
+        _, eps = Geoclustering.get_kDistance(self, self.k)
         
         if eps != None:
             self.maxEps = eps
@@ -81,8 +77,74 @@ class CityClustering(Geoclustering):
             self.maxEps = self.minEps + self.stepEps + 0.02
         return eps
     
+    def build_neighbors_graph(self, max_eps_km):
+        """ Computes once the sparse graph of the haversine distances between the points
+        closer than max_eps_km. The following runs with an Eps not greater than max_eps_km
+        use the graph instead of searching again the neighbors of every point: the
+        neighborhoods of a smaller Eps are the edges of the graph not longer than Eps.
+        Args:
+            self: A reference to the current object
+            max_eps_km: The largest Eps (in km) that will be used
+        """
+        # The graph connects the distinct coordinates, as DBSCAN works on them
+        tree = Geoclustering.get_uniqueTree(self)
+        X, _ = Geoclustering.get_clusteringCoords(self)
+        # Querying the indexed points themselves stores the diagonal (each point is its own
+        # neighbor) explicitly, so DBSCAN doesn't have to insert it at every fit. The rows
+        # sorted by distance spare DBSCAN from sorting them
+        indices, distances = tree.query_radius(X, r=max_eps_km/Utility.getEarthRadius(),
+                                               return_distance=True, sort_results=True)
+        indptr = np.concatenate([[0], np.cumsum([len(row) for row in indices])])
+        self.neighbors_graph = csr_matrix((np.concatenate(distances), np.concatenate(indices), indptr),
+                                          shape=(len(X), len(X)))
+        self.graph_eps_km = max_eps_km
+        self.eps_graph = (None, None)
+
+    def graph_eps_within_budget(self, eps_to_test, max_edges, sample_size=1000):
+        """ Returns the largest Eps of eps_to_test whose neighbors graph is estimated to have
+        at most max_edges edges, None if there isn't any. The number of edges is estimated
+        from the neighbors of a sample of the points: with large partitions and a large Eps
+        the graph wouldn't fit in memory.
+        Args:
+            self: A reference to the current object
+            eps_to_test: The Eps (in km) of the parameter sweep
+            max_edges: The largest number of edges of the graph
+            sample_size: Optional field. The number of sampled points
+        """
+        tree = Geoclustering.get_uniqueTree(self)
+        X, _ = Geoclustering.get_clusteringCoords(self)
+        rng = np.random.default_rng(0)
+        sample = X[rng.choice(len(X), size=min(sample_size, len(X)), replace=False)]
+        _, distances = tree.query_radius(sample, r=max(eps_to_test)/Utility.getEarthRadius(), return_distance=True)
+        distances = np.concatenate(distances)
+        budget_eps = None
+        for eps in sorted(eps_to_test):
+            estimated_edges = np.sum(distances <= eps/Utility.getEarthRadius()) * len(X) / len(sample)
+            if estimated_edges > max_edges:
+                break
+            budget_eps = eps
+        return budget_eps
+
+    def get_neighbors_graph(self, eps_km):
+        """ Returns the subgraph of the neighbors graph containing only the edges not
+        longer than eps_km. The last subgraph is kept, since the runs with the same Eps
+        (and different minPts) are consecutive in the parameter sweep"""
+        cached_eps_km, graph = self.eps_graph
+        if cached_eps_km == eps_km:
+            return graph
+        full_graph = self.neighbors_graph
+        keep = full_graph.data <= eps_km/Utility.getEarthRadius()
+        # The new row pointers count the edges kept before the beginning of each row
+        indptr = np.concatenate([[0], np.cumsum(keep)])[full_graph.indptr]
+        graph = csr_matrix((full_graph.data[keep], full_graph.indices[keep], indptr), shape=full_graph.shape)
+        self.eps_graph = (eps_km, graph)
+        return graph
+
     def run(self, eps_km, minPts):
-        """ Performs DBSCAN clustering algorithm
+        """ Performs DBSCAN clustering algorithm. If the neighbors graph has been built
+        for a large enough Eps, DBSCAN works on the precomputed distances of the graph.
+        DBSCAN is fitted on the distinct coordinates, each one weighted by the number of
+        its accidents, which is equivalent to fitting it on all the accidents
         Args:
             self: A reference to the current object
             eps: The Eps parameter of DBSCAN expressed in km
@@ -93,56 +155,141 @@ class CityClustering(Geoclustering):
             of the clustering algorithm or "No clusters" if no more than
             1 cluster is found
         """
-        dbscan = DBSCAN(eps = eps_km/Utility.getEarthRadius(), 
-                        min_samples=minPts, metric='haversine')
-        dbscan.fit(self.get_arrRadians())
+        Geoclustering.calculateUniqueCoords(self)
+        if self.neighbors_graph is not None and eps_km <= self.graph_eps_km:
+            dbscan = DBSCAN(eps = eps_km/Utility.getEarthRadius(),
+                            min_samples=minPts, metric='precomputed')
+            dbscan.fit(self.get_neighbors_graph(eps_km), sample_weight=self.get_counts())
+        else:
+            # In the projected mode the neighbors are searched with a KD-tree
+            X, metric = Geoclustering.get_clusteringCoords(self)
+            dbscan = DBSCAN(eps = eps_km/Utility.getEarthRadius(), 
+                            min_samples=minPts, metric=metric)
+            dbscan.fit(X, sample_weight=self.get_counts())
         
-        self.arr_Labels = dbscan.labels_
+        # Each accident takes the label of its coordinates
+        Geoclustering.set_labels(self, dbscan.labels_[self.get_inverse()])
         n_clusters = Geoclustering.get_numberOfClusters(self)
         if n_clusters <= 1:
             return "No clusters"
+        quality = Geoclustering.get_quality_metrics(self)
         dbscan_performance = {
             'eps_km': eps_km,
             'min_samples': minPts,
-            'core_outlier_ratio': Geoclustering.get_coreOutlierRatio(self),
+            'core_outlier_ratio': quality['core_outlier_ratio'],
             'number_of_clusters': n_clusters,
-            'davies_bouldin_index': Geoclustering.get_davies_bouldin_index(self),
-            'silouette_coefficent': Geoclustering.get_silouette_coefficent(self),
-            'calinski_index': Geoclustering.get_calinski_index(self)
+            'davies_bouldin_index': quality['davies_bouldin_index'],
+            'silouette_coefficent': quality['silouette_coefficent'],
+            'calinski_index': quality['calinski_index']
         }
         return dbscan_performance
 
-    def clustering_tuning(self):
+    def adaptive_sweep(self, eps_to_test, workers=1, executor="process", coarse_step=4, deadline=None):
+        """ Searches the best Eps of eps_to_test without running all of them: a coarse pass
+        runs every coarse_step-th Eps (and the last one), then the Eps around the best
+        combinations are refined. The best combinations are the ones chosen by
+        rank_tuning_results among all the results and among the results of each minPts,
+        so that the best region of every minPts is refined. The refinement is repeated
+        around the new best combinations until all the Eps closer than coarse_step steps
+        to them have been run.
+        It's a heuristic, opt-in through dbscan_search: a better Eps farther than
+        coarse_step steps from the best Eps of the coarse pass is missed, so the top 3
+        may differ from the exhaustive sweep (see benchmarks/benchmark_eps_search.py).
+        Args:
+            self: A reference to the current object
+            eps_to_test: The Eps (in km) of the exhaustive grid, in increasing order
+            workers: Optional field. The number of workers, 0 to use all the CPUs
+            executor: Optional field. The kind of pool of the sweep, "process" or "thread"
+            coarse_step: Optional field. The distance, in steps of eps_to_test, between two
+            Eps of the coarse pass
+            deadline: Optional field. A time.monotonic() value after which the search stops
+            and returns the results obtained so far
+        Returns:
+            The list of the results of run of the combinations run
+        """
+        coarse_step = max(1, int(coarse_step))
+        tested = set(range(0, len(eps_to_test), coarse_step)) | {len(eps_to_test) - 1}
+        candidates = sorted(tested)
+        arr_tuning_results = []
+        eps_run = 0
+        # The coarse pass and the refinements share a single pool of workers
+        full_grid = [(eps, minPts) for eps in eps_to_test for minPts in self.minPtsArr]
+        pool = Geoclustering.open_sweep_pool(self, full_grid, workers, executor)
+        try:
+            while len(candidates) > 0:
+                grid = [(eps_to_test[i], minPts) for i in candidates for minPts in self.minPtsArr]
+                results, completed = self.sweep_until(grid, workers, executor, deadline, len(self.minPtsArr), pool)
+                eps_run += len(results) // len(self.minPtsArr)
+                arr_tuning_results += [perf for perf in results if isinstance(perf, str) == False]
+                if not completed or len(arr_tuning_results) == 0:
+                    break
+
+                # The positions in eps_to_test of the best combinations
+                results_df = pd.DataFrame(arr_tuning_results)
+                selected = [Geoclustering.rank_tuning_results(self, arr_tuning_results)[1]]
+                selected += [Geoclustering.rank_tuning_results(self, group.to_dict("records"))[1]
+                             for _, group in results_df.groupby("min_samples")]
+                best_eps = pd.concat(selected)["eps_km"].unique()
+                best_positions = np.searchsorted(eps_to_test, best_eps)
+
+                candidates = sorted({i for position in best_positions
+                                     for i in range(position - coarse_step + 1, position + coarse_step)
+                                     if 0 <= i < len(eps_to_test)} - tested)
+                tested |= set(candidates)
+        finally:
+            if pool[0] is not None:
+                pool[0].shutdown(cancel_futures=True)
+        print(f"[INFO] Adaptive search: {eps_run} of {len(eps_to_test)} Eps tested")
+        return arr_tuning_results
+
+    def clustering_tuning(self, workers=1, executor="process", precomputed_graph=False, graph_max_edges=None,
+                          search="exhaustive", coarse_step=4, time_budget=None):
 
         """ Selects the best combination of parameters to use.
         Args:
             self: A reference to the current object
+            workers: Optional field. The number of workers of the parameter sweep,
+            0 to use all the CPUs
+            executor: Optional field. The kind of pool of the sweep, "process" or "thread"
+            precomputed_graph: Optional field. If True the neighbors graph is computed once
+            for the largest Eps of the grid and shared by all the runs
+            graph_max_edges: Optional field. If given, the graph is computed only for the
+            largest Eps whose graph is estimated to have at most graph_max_edges edges: the
+            runs with a larger Eps search the neighbors
+            search: Optional field. "exhaustive" to run every Eps of the grid, "adaptive"
+            for the coarse-to-fine search of adaptive_sweep
+            coarse_step: Optional field. The step of the coarse pass of the adaptive search
+            time_budget: Optional field. The seconds after which the sweep stops and the
+            best combinations found so far are returned, None for no limit
         Returns:
             A dataframe containing the best 3 combination of paramters to use
         """
-        arr_tuning_results = []
-
+        deadline = time.monotonic() + time_budget if time_budget is not None else None
         eps_to_test = []
         for eps in np.arange(self.minEps, self.maxEps, self.stepEps):
             eps_to_test.append(eps)
 
-        for eps in eps_to_test:
-            for minPts in self.minPtsArr:
-                perf = self.run(eps, minPts)
-                if isinstance(perf, str) == False:
-                    arr_tuning_results.append(perf)
-        
-        if len(arr_tuning_results) == 0:
-            return -1, None
-
-        # Selecting the best performances
-        tuning_results_df = pd.DataFrame(arr_tuning_results)
-        tuning_results_df = tuning_results_df.sort_values(
-            by = ["core_outlier_ratio", "silouette_coefficent", "davies_bouldin_index", "calinski_index"],
-            ascending = [True, False, True, False]
-        )
-        df_returned = tuning_results_df.query("core_outlier_ratio > 1.4")[:3]
-        if df_returned.shape[0] < 3:
-            return 1, tuning_results_df[-3:]
+        # The projection is checked against the largest Eps of the sweep
+        if len(eps_to_test) > 0:
+            Geoclustering.enable_projection(self, max(eps_to_test))
+
+        # Built before the sweep, so that the workers share it
+        if precomputed_graph and len(eps_to_test) > 0:
+            Geoclustering.check_cancelled(self)
+            Geoclustering.calculateRadians(self)
+            graph_eps = max(eps_to_test)
+            if graph_max_edges is not None:
+                graph_eps = self.graph_eps_within_budget(eps_to_test, graph_max_edges)
+            if graph_eps is not None:
+                self.build_neighbors_graph(graph_eps)
+
+        # The adaptive search may end before running all the combinations
+        Geoclustering.start_progress(self, len(eps_to_test) * len(self.minPtsArr))
+        if search == "adaptive" and len(eps_to_test) > 0:
+            arr_tuning_results = self.adaptive_sweep(eps_to_test, workers, executor, coarse_step, deadline)
         else:
-            return 0, df_returned
\ No newline at end of file
+            grid = [(eps, minPts) for eps in eps_to_test for minPts in self.minPtsArr]
+            results, _ = self.sweep_until(grid, workers, executor, deadline, len(self.minPtsArr))
+            arr_tuning_results = [perf for perf in results if isinstance(perf, str) == False]
+
+        return Geoclustering.rank_tuning_results(self, arr_tuning_results)
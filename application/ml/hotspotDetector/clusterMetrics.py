@@ -0,0 +1,122 @@
+import numpy as np
+
+class ClusterMetrics:
+    """ Computes the quality indices of a clustering in a single pass: the per-cluster
+    weights, centroids and dispersions are computed once with bincount and all the indices
+    (core/outlier ratio, Davies-Bouldin, Calinski-Harabasz and, through a SilhouetteEngine,
+    the silhouette) are derived from them.
+    The points may be weighted (e.g. distinct coordinates weighted by their number of
+    accidents): the result is the same of the points repeated as many times as their weight.
+    Two distances are available:
+        euclidean: the coordinates in radians are treated as Euclidean, as scikit-learn
+        does. The indices match davies_bouldin_score and calinski_harabasz_score
+        haversine: the centroids are the (normalized) mean of the points on the unit
+        sphere and the dispersions are great-circle distances
+    """
+
+    def __init__(self, distance="euclidean"):
+        """ Creates a new instance of the class ClusterMetrics
+            Args:
+                distance: Optional field. "euclidean" or "haversine"
+        """
+        if distance not in ("euclidean", "haversine"):
+            raise ValueError(f"Unknown distance {distance}: use euclidean or haversine")
+        self.distance = distance
+
+    def evaluate(self, X, labels, weights=None, silhouetteEngine=None):
+        """ Returns the quality indices of a clustering
+            Args:
+                X: The coordinates (latitude, longitude) in radians of the points
+                labels: The cluster of each point, -1 for the outliers
+                weights: Optional field. The weight of each point, 1 by default
+                silhouetteEngine: Optional field. If given, the silhouette coefficient is
+                computed with it on the points that aren't outliers
+            Returns:
+                A dictionary with number_of_clusters, core_outlier_ratio, davies_bouldin_index,
+                calinski_index and silouette_coefficent (None if no engine is given). The
+                indices that need at least 2 clusters are None otherwise
+        """
+        labels = np.asarray(labels)
+        weights = np.ones(len(labels)) if weights is None else np.asarray(weights, dtype=np.float64)
+        mask = labels != -1
+        core_weight = weights[mask].sum()
+        outlier_weight = weights.sum() - core_weight
+
+        # The clusters are renumbered 0..k-1, so that bincount works on them
+        cluster_ids, cluster_of_point = np.unique(labels[mask], return_inverse=True)
+        cluster_of_point = cluster_of_point.reshape(-1)
+        n_clusters = len(cluster_ids)
+        result = {
+            'number_of_clusters': n_clusters,
+            # As before, 0 outliers gives a ratio of 10k
+            'core_outlier_ratio': 10000 if outlier_weight == 0 else core_weight/outlier_weight,
+            'davies_bouldin_index': None,
+            'silouette_coefficent': None,
+            'calinski_index': None
+        }
+        if n_clusters < 2:
+            return result
+
+        X = np.asarray(X, dtype=np.float64)[mask]
+        weights = weights[mask]
+        if self.distance == "haversine":
+            points = self.to_unit_vectors(X)
+        else:
+            # The distances don't change with a translation: the points of a partition are
+            # close, and centering them avoids the cancellation in the centroid distances
+            points = X - X[0]
+        cluster_weights = np.bincount(cluster_of_point, weights=weights, minlength=n_clusters)
+        centroids = np.column_stack([
+            np.bincount(cluster_of_point, weights=weights * points[:, j], minlength=n_clusters)
+            for j in range(points.shape[1])]) / cluster_weights[:, None]
+        center = (weights[:, None] * points).sum(axis=0) / weights.sum()
+        if self.distance == "haversine":
+            centroids /= np.linalg.norm(centroids, axis=1, keepdims=True)
+            center /= np.linalg.norm(center)
+
+        # Distance of every point from the centroid of its cluster
+        point_distances = self.distances(points, centroids[cluster_of_point])
+        mean_distances = np.bincount(cluster_of_point, weights=weights * point_distances,
+                                     minlength=n_clusters) / cluster_weights
+        squared_distances = np.bincount(cluster_of_point, weights=weights * point_distances**2,
+                                        minlength=n_clusters)
+
+        result['davies_bouldin_index'] = self.davies_bouldin(centroids, mean_distances)
+        result['calinski_index'] = self.calinski_harabasz(centroids, center, cluster_weights,
+                                                          squared_distances.sum())
+        if silhouetteEngine is not None:
+            result['silouette_coefficent'] = silhouetteEngine.score(X, cluster_of_point, weights)
+        return result
+
+    def davies_bouldin(self, centroids, mean_distances):
+        """ Returns the Davies-Bouldin index from the centroids and the mean distance of the
+        points of each cluster from its centroid. Same conventions of sklearn"""
+        centroid_distances = self.distances(centroids[:, None, :], centroids[None, :, :])
+        if np.allclose(mean_distances, 0) or np.allclose(centroid_distances, 0):
+            return 0.0
+        centroid_distances[centroid_distances == 0] = np.inf
+        combined = (mean_distances[:, None] + mean_distances) / centroid_distances
+        return np.mean(np.max(combined, axis=1))
+
+    def calinski_harabasz(self, centroids, center, cluster_weights, within):
+        """ Returns the Calinski-Harabasz index from the centroids, the centroid of all the
+        points, the weight of each cluster and the within-cluster sum of squares.
+        Same conventions of sklearn"""
+        n_clusters = len(centroids)
+        between = np.sum(cluster_weights * self.distances(centroids, center)**2)
+        if within == 0:
+            return 1.0
+        return between * (cluster_weights.sum() - n_clusters) / (within * (n_clusters - 1))
+
+    def to_unit_vectors(self, X):
+        """ Returns the points on the unit sphere of the coordinates (latitude, longitude) in radians"""
+        cos_lat = np.cos(X[:, 0])
+        return np.column_stack([cos_lat * np.cos(X[:, 1]), cos_lat * np.sin(X[:, 1]), np.sin(X[:, 0])])
+
+    def distances(self, a, b):
+        """ Returns the distances between the points a and b (element-wise, with broadcasting).
+        With the haversine distance a and b are unit vectors and the distance is the angle
+        between them, computed with atan2 to stay accurate for close points"""
+        if self.distance == "haversine":
+            return np.arctan2(np.linalg.norm(np.cross(a, b), axis=-1), np.sum(a * b, axis=-1))
+        return np.linalg.norm(a - b, axis=-1)
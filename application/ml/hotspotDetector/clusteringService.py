@@ -0,0 +1,260 @@
+from .cityClustering import CityClustering
+from .stateClustering import StateClustering
+from .hdbscanClustering import HdbscanClustering
+from .silhouetteEngine import SilhouetteEngine
+from .clusterMetrics import ClusterMetrics
+from .kDistanceCache import KDistanceCache
+
+class ClusteringService:
+    """ Computes the hotspots of a (city, cause) partition with DBSCAN, of a (state, cause)
+    partition with OPTICS or of either of them with HDBSCAN: Hopkins statistic, parameter
+    sweep (a single fit for HDBSCAN) and final fit, with the parameters read from the config file. The result is the response of
+    the /clustering route. It's shared by the web server and the offline tools."""
+
+    ALGORITHMS = ("DBSCAN", "OPTICS", "HDBSCAN")
+    # Bumped whenever the same partition and parameters give a different result,
+    # so that the results cached by the previous versions are recomputed
+    RESULT_FORMAT_VERSION = 4
+
+    def __init__(self, configloader, tuning_workers=None, tuning_executor=None):
+        """ Creates a new instance of the class ClusteringService
+            Args:
+                configloader: The ConfigLoader of the parameters of the clustering
+                tuning_workers: Optional field. Overrides the number of workers of the
+                parameter sweep of the config file (e.g. 1 when the service itself runs
+                in a pool of processes)
+                tuning_executor: Optional field. Overrides the executor of the parameter
+                sweep of the config file (e.g. "thread" in a multi-threaded process, which
+                can't be forked safely)
+        """
+        self.configloader = configloader
+        self.tuning_workers = configloader.get_tuningWorkers() if tuning_workers is None else tuning_workers
+        self.tuning_executor = configloader.get_tuningExecutor() if tuning_executor is None else tuning_executor
+        # The silhouette is computed exactly in blocks of bounded size for the small partitions,
+        # and estimated on a sample for the large ones
+        self.silhouetteEngine = SilhouetteEngine(exact_max_points=configloader.get_silhouetteExactMaxPoints(),
+                            sample_size=configloader.get_silhouetteSampleSize(),
+                            seed=configloader.get_silhouetteSeed(),
+                            working_memory_mb=configloader.get_silhouetteWorkingMemoryMb())
+        # Davies-Bouldin and Calinski-Harabasz on the radians as Euclidean (as scikit-learn) or haversine
+        self.clusterMetrics = ClusterMetrics(configloader.get_clusterMetricsDistance())
+        # The tree and the k-distance curves of the partitions, reused by the next requests
+        # on the same partition (e.g. with another algorithm or other parameters)
+        self.kDistanceCache = KDistanceCache(configloader.get_kDistanceCacheEntries())
+
+    def get_parameters(self, algorithm):
+        """ Returns the parameters of the config file that change the result of the clustering.
+        The ones changing only the speed (e.g. the number of workers) are excluded"""
+        configloader = self.configloader
+        parameters = {
+            "hopkins_seed": configloader.get_hopkinsSeed(),
+            "silhouette": [configloader.get_silhouetteExactMaxPoints(), configloader.get_silhouetteSampleSize(),
+                           configloader.get_silhouetteSeed()],
+            "cluster_metrics_distance": configloader.get_clusterMetricsDistance(),
+            # The projected distances may move the points at the border of the clusters
+            "projection": configloader.get_projectionMaxErrorM() if configloader.get_projectionMode() else None
+        }
+        if algorithm == "DBSCAN":
+            parameters.update({
+                "k_distGraph": configloader.getKDistGraph(),
+                "dbscan_minEps": configloader.get_dbscanMinEps(),
+                "dbscan_stepEps": configloader.get_dbscanStepEps(),
+                "dbscan_minPtsArr": configloader.get_dbscanMinPtsArr(),
+                # The time budget may stop the search before the best combinations are found
+                "dbscan_search": [configloader.get_dbscanSearch(), configloader.get_dbscanCoarseStep(),
+                                  configloader.get_dbscanTimeBudget()]
+            })
+        elif algorithm == "HDBSCAN":
+            parameters.update({
+                "hdbscan_min_cluster_size": configloader.get_hdbscanMinClusterSize(),
+                "hdbscan_min_samples": configloader.get_hdbscanMinSamples(),
+                "hdbscan_cluster_selection_epsilon": configloader.get_hdbscanClusterSelectionEpsilon()
+            })
+        else:
+            parameters.update({
+                "optics_maxRadiusArr": configloader.get_opticsMaxRadiusArr(),
+                "optics_minPtsArr": configloader.get_opticsMinPtsArr(),
+                "optics_xiArr": configloader.get_opticsXiArr()
+            })
+        return parameters
+
+    def get_granularity(self, algorithm, granularity=None):
+        """ Returns "city" or "state": DBSCAN works on the cities and OPTICS on the states,
+        while for HDBSCAN the granularity is chosen by the caller"""
+        if algorithm == "DBSCAN":
+            return "city"
+        if algorithm == "OPTICS":
+            return "state"
+        return granularity
+
+    def cache_key(self, resultCache, algorithm, name, cause, partitionIndex, fingerprint, granularity=None):
+        """ Returns the key of the result of a partition in a ResultCache.
+        Args:
+            resultCache: The ResultCache
+            algorithm: "DBSCAN" (name is a city), "OPTICS" (name is a state) or "HDBSCAN"
+            name: The city or the state
+            cause: The general cause of accident
+            partitionIndex: The PartitionIndex of the dataset: the version of the partition
+            changes when new accidents are appended to it
+            fingerprint: The fingerprint of the dataset when it was loaded
+            granularity: Optional field. "city" or "state", required by HDBSCAN only
+        """
+        granularity = self.get_granularity(algorithm, granularity)
+        if granularity == "city":
+            version = partitionIndex.getCityVersion(name, cause)
+        else:
+            version = partitionIndex.getStateVersion(name, cause)
+        parts = [algorithm, name, cause, self.get_parameters(algorithm), fingerprint, version,
+                 self.RESULT_FORMAT_VERSION]
+        if algorithm == "HDBSCAN":
+            parts.append(granularity)
+        return resultCache.make_key(*parts)
+
+    def kDistance_entry(self, granularity, name, cause, partitionIndex, fingerprint):
+        """ Returns the entry of the partition in the KDistanceCache, None if the version of
+        the dataset is unknown"""
+        if fingerprint is None:
+            return None
+        if granularity == "city":
+            version = partitionIndex.getCityVersion(name, cause)
+        else:
+            version = partitionIndex.getStateVersion(name, cause)
+        return self.kDistanceCache.get_entry(granularity, name, cause, (fingerprint, version))
+
+    def cluster(self, df, partitionIndex, coordinateStore, algorithm, name, cause, granularity=None, fingerprint=None,
+                progress=None):
+        """ Runs the clustering of a partition
+        Args:
+            df: The preprocessed dataframe
+            partitionIndex: The PartitionIndex of df
+            coordinateStore: The CoordinateStore of df, or None
+            algorithm: "DBSCAN" (name is a city), "OPTICS" (name is a state) or "HDBSCAN"
+            name: The city or the state
+            cause: The general cause of accident
+            granularity: Optional field. "city" or "state", required by HDBSCAN only
+            fingerprint: Optional field. The fingerprint of the dataset when it was loaded:
+            if given, the tree and the k-distance curves of the partition are cached
+            progress: Optional field. The Job receiving the progress of the tuning: when it's
+            cancelled, the clustering stops raising JobCancelled
+        Returns:
+            The response of the /clustering route: the status of the tuning and, if any
+            cluster is found, the Hopkins statistic, the max Eps, the labelled accidents and
+            the performances of the best combinations
+        """
+        configloader = self.configloader
+        kDistance_entry = self.kDistance_entry(self.get_granularity(algorithm, granularity), name, cause,
+                                               partitionIndex, fingerprint)
+        # The projected mode, where the error bound allows it
+        max_error_m = configloader.get_projectionMaxErrorM() if configloader.get_projectionMode() else None
+        if algorithm == "DBSCAN":
+            cityClustering = CityClustering(df,
+                            name,
+                            cause,
+                            configloader.getKDistGraph(),
+                            configloader.get_dbscanMinEps(),
+                            configloader.get_dbscanStepEps(),
+                            configloader.get_dbscanMinPtsArr(),
+                            partitionIndex,
+                            coordinateStore)
+            cityClustering.set_silhouetteEngine(self.silhouetteEngine)
+            cityClustering.set_clusterMetrics(self.clusterMetrics)
+            cityClustering.set_projection(max_error_m)
+            cityClustering.set_kDistanceEntry(kDistance_entry)
+            cityClustering.set_progress(progress)
+            hopkins = cityClustering.getHopkins(configloader.get_hopkinsSeed())
+            knee = cityClustering.knee_heurstic_search()
+            sts, cityClustering_perf = cityClustering.clustering_tuning(self.tuning_workers,
+                                                                        self.tuning_executor,
+                                                                        configloader.get_dbscanPrecomputedGraph(),
+                                                                        configloader.get_dbscanGraphMaxEdges(),
+                                                                        configloader.get_dbscanSearch(),
+                                                                        configloader.get_dbscanCoarseStep(),
+                                                                        configloader.get_dbscanTimeBudget())
+
+            if sts == -1:
+                return {"sts": sts}
+
+            cityClustering.check_cancelled()
+            cityClustering.run(eps_km = cityClustering_perf.iloc[0,0],
+                                    minPts=cityClustering_perf.iloc[0,1])
+            print(f"eps_km: {cityClustering_perf.iloc[0,0]}, minPts: {cityClustering_perf.iloc[0,1]}")
+            cityClustering.attachLabels()
+            cityClustering.add_victims_condition_rank()
+            # We have to serialize both the dataframe and the clustering
+            # performances as a response to the frontend
+            return {
+                "sts": sts,
+                "hopkins": hopkins,
+                "max_eps": knee,
+                "dfLabelled": cityClustering.get_dfLabelled().to_json(),
+                "clusteringPerf": cityClustering_perf.to_json()
+            }
+
+        if algorithm == "HDBSCAN":
+            hdbscanClustering = HdbscanClustering(df,
+                            granularity,
+                            name,
+                            cause,
+                            configloader.get_hdbscanMinClusterSize(),
+                            configloader.get_hdbscanMinSamples(),
+                            configloader.get_hdbscanClusterSelectionEpsilon(),
+                            partitionIndex,
+                            coordinateStore)
+            hdbscanClustering.set_silhouetteEngine(self.silhouetteEngine)
+            hdbscanClustering.set_clusterMetrics(self.clusterMetrics)
+            hdbscanClustering.set_projection(max_error_m)
+            hdbscanClustering.set_kDistanceEntry(kDistance_entry)
+            hdbscanClustering.set_progress(progress)
+            hopkins = hdbscanClustering.getHopkins(configloader.get_hopkinsSeed())
+            # A single fit: its labels are already the final ones
+            sts, hdbscanClustering_perf = hdbscanClustering.clustering_tuning()
+
+            if sts == -1:
+                return {"sts": sts}
+
+            hdbscanClustering.attachLabels()
+            hdbscanClustering.add_victims_condition_rank()
+            return {
+                "sts": sts,
+                "hopkins": hopkins,
+                # HDBSCAN has no Eps: the distance below which its clusters are merged
+                "max_eps": configloader.get_hdbscanClusterSelectionEpsilon(),
+                "dfLabelled": hdbscanClustering.get_dfLabelled().to_json(),
+                "clusteringPerf": hdbscanClustering_perf.to_json()
+            }
+
+        max_eps = configloader.get_opticsMaxRadiusArr()[-1]
+        stateClustering = StateClustering(df,
+                        name,
+                        cause,
+                        configloader.get_opticsMaxRadiusArr(),
+                        configloader.get_opticsMinPtsArr(),
+                        configloader.get_opticsXiArr(),
+                        partitionIndex,
+                        coordinateStore)
+        stateClustering.set_silhouetteEngine(self.silhouetteEngine)
+        stateClustering.set_clusterMetrics(self.clusterMetrics)
+        stateClustering.set_projection(max_error_m)
+        stateClustering.set_kDistanceEntry(kDistance_entry)
+        stateClustering.set_progress(progress)
+        hopkins = stateClustering.getHopkins(configloader.get_hopkinsSeed())
+        sts, stateClustering_perf = stateClustering.clustering_tuning(self.tuning_workers,
+                                                                      self.tuning_executor,
+                                                                      configloader.get_opticsSharedReachability())
+
+        if sts == -1:
+            return {"sts": sts}
+
+        stateClustering.check_cancelled()
+        stateClustering.run(minPts = stateClustering_perf.iloc[0,0],
+                max_eps = stateClustering_perf.iloc[0,1],
+                xi = stateClustering_perf.iloc[0,2])
+        stateClustering.attachLabels()
+        stateClustering.add_victims_condition_rank()
+        return {
+            "sts": sts,
+            "hopkins": hopkins,
+            "max_eps": max_eps,
+            "dfLabelled": stateClustering.get_dfLabelled().to_json(),
+            "clusteringPerf": stateClustering_perf.to_json()
+        }
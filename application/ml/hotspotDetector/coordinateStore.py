@@ -0,0 +1,185 @@
+import os
+import json
+import shutil
+import hashlib
+import numpy as np
+import pandas as pd
+
+class CoordinateStore:
+    """ Persisted store of the coordinates (in radians) of the preprocessed dataframe.
+    The coordinates are ordered by (state, general cause), keeping the order of the
+    dataframe inside each partition, so that every (state, cause) partition is a
+    contiguous slice of the store. The rows of a city are spread among the rows of its
+    states: a table of their positions in the store, in the order of the dataframe,
+    gives the (city, cause) partitions. The partitions hold the same rows, in the same
+    order, of the ones of the PartitionIndex.
+    The store is memory-mapped: all the processes of the backend share a single
+    physical copy of it, and the state partitions are handed to the clustering
+    algorithms as zero-copy views."""
+
+    # Bumped whenever the on-disk layout or the content of the store changes
+    STORE_FORMAT_VERSION = 3
+
+    def __init__(self, store_dir):
+        """ Creates a new instance of the class CoordinateStore
+            Args:
+                self: A reference to the current object
+                store_dir: The folder hosting the store
+        """
+        self.store_dir = store_dir
+        # The folder of the loaded build, see build
+        self.build_name = None
+        self.empty_rows = np.empty(0, dtype=np.int64)
+        self.empty_radians = np.empty((0, 2), dtype=np.float64)
+
+    def load_or_build(self, df, fingerprint):
+        """ Memory-maps the store, building it first if it's missing or it was
+        built from a different version of the dataset
+            Args:
+                df: The preprocessed dataframe
+                fingerprint: The fingerprint of the dataset df was obtained from
+        """
+        expected = {"format_version": self.STORE_FORMAT_VERSION, "dataset": fingerprint, "rows": len(df)}
+        build_name = self.read_pointer()
+        manifest = None
+        if build_name is not None:
+            manifest_path = os.path.join(self.store_dir, build_name, "manifest.json")
+            if os.path.exists(manifest_path):
+                with open(manifest_path, "r") as file:
+                    manifest = json.load(file)
+        if manifest is None or manifest["fingerprint"] != expected:
+            print("[INFO] Building the coordinate store...")
+            self.build(df, expected)
+        self.load()
+
+    def read_pointer(self):
+        """ Returns the name of the folder of the current build of the store, None if
+        the store has never been built"""
+        pointer_path = os.path.join(self.store_dir, "current.json")
+        if not os.path.exists(pointer_path):
+            return None
+        with open(pointer_path, "r") as file:
+            return json.load(file)["build"]
+
+    def build(self, df, fingerprint):
+        """ Writes the store: the coordinates in radians, the position in df of each
+        coordinate, the positions in the store of the rows of the cities and the offsets
+        tables of the partitions.
+        Every build is written in its own folder, named after the fingerprint, and then
+        becomes the current one: the folders memory-mapped by the objects loaded before
+        are never modified (see remove_stale_builds)"""
+        # The positions returned by groupby are in the order of df. As in the PartitionIndex,
+        # the rows without a general cause aren't stored, while the rows without a state
+        # are stored (after the states) for their cities
+        state_groups = df.groupby(["state", "general_cause_of_accident"], observed=True, sort=True, dropna=False).indices
+        city_groups = df.groupby(["city", "general_cause_of_accident"], observed=True, sort=True).indices
+
+        states = []
+        rows = []
+        start = 0
+        for (state, cause), positions in state_groups.items():
+            if pd.isna(cause):
+                continue
+            rows.append(positions)
+            if not pd.isna(state):
+                states.append([state, cause, start, start + len(positions)])
+            start += len(positions)
+        rows = np.concatenate(rows).astype(np.int64) if rows else self.empty_rows
+
+        # Position in the store of each row of df
+        store_positions = np.full(len(df), -1, dtype=np.int64)
+        store_positions[rows] = np.arange(len(rows))
+        cities = []
+        city_positions = []
+        start = 0
+        for (city, cause), positions in city_groups.items():
+            city_positions.append(store_positions[positions])
+            cities.append([city, cause, start, start + len(positions)])
+            start += len(positions)
+        city_positions = np.concatenate(city_positions) if city_positions else self.empty_rows
+
+        coords = df[["latitude", "longitude"]].to_numpy(dtype=np.float64)
+        radians = np.ascontiguousarray(np.radians(coords[rows]))
+
+        digest = hashlib.sha256(json.dumps(fingerprint, sort_keys=True, default=str).encode("utf-8")).hexdigest()
+        build_name = "build_" + digest[:16]
+        build_dir = os.path.join(self.store_dir, build_name)
+        # Like the dataset cache, the build is published only once it's complete.
+        # The temporary folder is private to the process: another process may be
+        # building the same version at the same time
+        tmp_dir = f"{build_dir}.{os.getpid()}.tmp"
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        os.makedirs(tmp_dir)
+        np.save(os.path.join(tmp_dir, "radians.npy"), radians)
+        np.save(os.path.join(tmp_dir, "rows.npy"), rows)
+        np.save(os.path.join(tmp_dir, "city_positions.npy"), city_positions)
+        with open(os.path.join(tmp_dir, "manifest.json"), "w") as file:
+            json.dump({"fingerprint": fingerprint, "states": states, "cities": cities}, file)
+        if os.path.exists(build_dir):
+            # Already built by another process, with the same content
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+        else:
+            os.replace(tmp_dir, build_dir)
+
+        tmp_pointer = os.path.join(self.store_dir, f"current.json.{os.getpid()}.tmp")
+        with open(tmp_pointer, "w") as file:
+            json.dump({"build": build_name}, file)
+        os.replace(tmp_pointer, os.path.join(self.store_dir, "current.json"))
+
+    def remove_stale_builds(self, keep=()):
+        """ Removes the builds of the store other than the loaded one and the ones in keep,
+        e.g. the build still memory-mapped by the object that the loaded one replaced.
+        A build that can't be removed (on Windows a memory-mapped file can't be deleted)
+        is left in place and removed by a next call
+            Args:
+                keep: Optional field. The names of the builds to keep, see get_buildName
+        """
+        keep = set(keep) | {self.build_name, "current.json"}
+        for name in os.listdir(self.store_dir):
+            if name in keep or name.endswith(".tmp"):
+                continue
+            path = os.path.join(self.store_dir, name)
+            try:
+                if os.path.isdir(path):
+                    shutil.rmtree(path)
+                else:
+                    os.remove(path)
+            except OSError as e:
+                print(f"[INFO] Coordinate store {name} not removed yet: {e}")
+
+    def get_buildName(self):
+        return self.build_name
+
+    def load(self):
+        """ Memory-maps the arrays of the current build of the store and loads its offsets tables"""
+        self.build_name = self.read_pointer()
+        build_dir = os.path.join(self.store_dir, self.build_name)
+        self.radians = np.load(os.path.join(build_dir, "radians.npy"), mmap_mode="r")
+        self.rows = np.load(os.path.join(build_dir, "rows.npy"), mmap_mode="r")
+        self.city_positions = np.load(os.path.join(build_dir, "city_positions.npy"), mmap_mode="r")
+        with open(os.path.join(build_dir, "manifest.json"), "r") as file:
+            manifest = json.load(file)
+
+        # (state, cause) -> (start, end) in the store and (city, cause) -> (start, end)
+        # in the positions of the cities
+        self.state_ranges = {(state, cause): (start, end) for state, cause, start, end in manifest["states"]}
+        self.city_ranges = {(city, cause): (start, end) for city, cause, start, end in manifest["cities"]}
+
+    def getCityPartition(self, city, cause):
+        """ Returns the positions in the dataframe and the coordinates in radians
+        of the accidents of the city caused by the specified general cause.
+        The rows of a city aren't contiguous in the store, so they're copied"""
+        ranges = self.city_ranges.get((city, cause))
+        if ranges is None:
+            return self.empty_rows, self.empty_radians
+        positions = self.city_positions[ranges[0]:ranges[1]]
+        return self.rows[positions], self.radians[positions]
+
+    def getStatePartition(self, state, cause):
+        """ Returns the positions in the dataframe and the coordinates in radians
+        of the accidents of the state caused by the specified general cause,
+        as views of the store"""
+        ranges = self.state_ranges.get((state, cause))
+        if ranges is None:
+            return self.empty_rows, self.empty_radians
+        return self.rows[ranges[0]:ranges[1]], self.radians[ranges[0]:ranges[1]]
@@ -1,43 +1,110 @@
 import os
+import json
+import shutil
+import hashlib
 import pandas as pd
 import numpy as np
 
 class DatasetLoader:
     """ The DatasetLoader class performs all the IO operations related to csv files"""
-    
-    def __init__(self, full_dataset_path, clean_dataset_path):
+
+    # Bumped whenever the on-disk layout of the cache changes, so that caches
+    # written by older versions of the class are rebuilt automatically
+    CACHE_FORMAT_VERSION = 1
+
+    # Explicit dtypes for the attributes of the brasilian aggregated dataset, so that
+    # every chunk is parsed in the same way without any type inference. The counts are
+    # nullable integers: a file may have empty cells
+    FULL_DATASET_DTYPES = {
+        "inverse_data": str, "week_day": str, "hour": str, "state": str,
+        "road_id": np.float64, "km": str, "city": str, "cause_of_accident": str,
+        "type_of_accident": str, "victims_condition": str, "weather_timestamp": str,
+        "road_direction": str, "wheather_condition": str, "road_type": str,
+        "people": "Int64", "deaths": "Int64", "slightly_injured": "Int64",
+        "severely_injured": "Int64", "uninjured": "Int64", "ignored": "Int64",
+        "total_injured": "Int64", "vehicles_involved": "Int64",
+        "latitude": np.float64, "longitude": np.float64,
+        "regional": str, "police_station": str
+    }
+
+    def __init__(self, full_dataset_path, clean_dataset_path, cache_dir=None):
+        """ Creates a new instance of the class DatasetLoader
+            Args:
+                full_dataset_path: The path of the brasilian aggregated dataset
+                clean_dataset_path: The path of the cleaned version of the dataset
+                cache_dir: Optional field. The folder hosting the columnar cache of the
+                cleaned dataset. By default it's placed next to the cleaned csv file.
+        """
         self.full_dataset_path = full_dataset_path
         self.clean_dataset_path = clean_dataset_path
+        if cache_dir is None and clean_dataset_path != -1:
+            cache_dir = os.path.splitext(clean_dataset_path)[0] + "_cache"
+        self.cache_dir = cache_dir
+        self.dataset_fingerprint = None
+        self.clean_dataset_df = None
+        # Log of the files appended to the cleaned dataset by append_dataset()
+        self.append_log_path = None
+        if clean_dataset_path != -1:
+            self.append_log_path = os.path.splitext(clean_dataset_path)[0] + "_appended.json"
     
-    def produce_clean_dataset(self):
-        """ Produces the cleaned version of the brasilian aggregated dataset"""
-        # The motivation for the following processing steps can be find in the dataCleaning notebook
-        full_dataset_df = pd.read_csv(self.full_dataset_path)
-        
-        full_dataset_df.rename(columns={"ignored": "unharmed"}, inplace=True)
-        full_dataset_df.rename(columns={"inverse_data": "date"}, inplace=True)
-        full_dataset_df.rename(columns={"wheather_condition": "weather_condition"}, inplace=True)
+    def produce_clean_dataset(self, chunksize=100000):
+        """ Produces the cleaned version of the brasilian aggregated dataset.
+        The dataset is streamed in chunks of chunksize rows: each chunk is cleaned
+        and appended to the output file, so that the peak memory doesn't depend on
+        the size of the input file.
+            Args:
+                chunksize: Optional field. The number of rows read and cleaned at a time
+        """
+        # If the folders don't exists, we create them
+        dir_path = os.path.dirname(self.clean_dataset_path)
+        os.makedirs(dir_path, exist_ok=True)
 
-        full_dataset_df["road_id"] = full_dataset_df["road_id"].apply(lambda x: str(int(x)) if not pd.isna(x) else None)
+        # We write on a temporary file, which replaces the output only when complete
+        tmp_path = self.clean_dataset_path + ".tmp"
+        reader = pd.read_csv(self.full_dataset_path, chunksize=chunksize,
+                             usecols=lambda col: col != "road_delineation",
+                             dtype=self.FULL_DATASET_DTYPES)
+        header = True
+        for chunk in reader:
+            chunk = self.clean_chunk(chunk)
+            chunk.to_csv(tmp_path, mode="w" if header else "a", header=header,
+                         index=False, encoding='utf-8')
+            header = False
+        os.replace(tmp_path, self.clean_dataset_path)
+        # The rows appended so far are lost with the regeneration of the cleaned dataset
+        if os.path.exists(self.append_log_path):
+            os.remove(self.append_log_path)
 
-        full_dataset_df = full_dataset_df.dropna(subset=['police_station', 'regional', 'road_id', 'km'])
+    def clean_chunk(self, chunk):
+        """ Applies the cleaning steps to a chunk of the brasilian aggregated dataset.
+        The motivation for the following processing steps can be find in the dataCleaning notebook
+            Args:
+                chunk: A dataframe containing a slice of the rows of the dataset
+            Returns:
+                The cleaned dataframe
+        """
+        chunk = chunk.rename(columns={"ignored": "unharmed",
+                                      "inverse_data": "date",
+                                      "wheather_condition": "weather_condition"})
 
-        full_dataset_df.replace('Not informed', np.nan).dropna(subset=['type_of_accident'])
+        # road_id is parsed as a float (e.g. 116.0), but it's an identifier (e.g. 116)
+        road_id = chunk["road_id"]
+        mask = road_id.notna()
+        chunk["road_id"] = None
+        chunk.loc[mask, "road_id"] = road_id[mask].astype(np.int64).astype(str)
 
-        full_dataset_df.drop(columns = ['road_delineation'], inplace=True)
+        chunk = chunk.dropna(subset=['police_station', 'regional', 'road_id', 'km'])
 
-        df_invalid = full_dataset_df[
-            (full_dataset_df['latitude'] > 90) | (full_dataset_df['latitude'] < -90) |
-            (full_dataset_df['longitude'] > 180) | (full_dataset_df['longitude'] < -180)
-        ]
+        # In the dataCleaning notebook the replacement of 'Not informed' with NaN in
+        # type_of_accident, followed by the dropna, isn't assigned: no row is dropped,
+        # so the accidents whose type is 'Not informed' or missing are kept
 
-        self.clean_dataset_df = full_dataset_df.drop(df_invalid.index)
+        # Only the coordinates out of range are dropped. The comparisons with a missing
+        # coordinate are False, so the accidents without coordinates are kept
+        invalid = ((chunk['latitude'] > 90) | (chunk['latitude'] < -90) |
+                   (chunk['longitude'] > 180) | (chunk['longitude'] < -180))
+        return chunk[~invalid]
 
-        # If the folders don't exists, we create them
-        dir_path = os.path.dirname(self.clean_dataset_path)
-        os.makedirs(dir_path, exist_ok=True)
-        self.clean_dataset_df.to_csv(self.clean_dataset_path, index=False, encoding='utf-8')
-    
     def loadDataset(self):
         """ Loads the dataset pointed by the path in the json configuration file into
         a Pandas Dataframe
@@ -63,10 +130,175 @@ class DatasetLoader:
                 print("Performing pre-processing...")
                 # The method works on the implicit class object
                 self.produce_clean_dataset()
+                self.clean_dataset_df = self.load_cached_dataset()
                 return self.clean_dataset_df
             else:
                 print("(2) Invalid JSON format. Exiting")
                 return
         else:
-            self.clean_dataset_df = pd.read_csv(self.clean_dataset_path)
-        return self.clean_dataset_df
\ No newline at end of file
+            self.clean_dataset_df = self.load_cached_dataset()
+        return self.clean_dataset_df
+
+    def append_dataset(self, new_dataset_path, chunksize=100000):
+        """ Cleans the accidents of a new file and appends them to the cleaned dataset,
+        to the dataframe in memory and to the columnar cache, without regenerating the
+        cleaned dataset. The file must have the attributes of the brasilian aggregated
+        dataset. A file already appended (same SHA-256 digest) is skipped.
+        Must be called after loadDataset.
+            Args:
+                new_dataset_path: The path of the csv file containing the new accidents
+                chunksize: Optional field. The number of rows read and cleaned at a time
+            Returns:
+                A dataframe containing only the cleaned new rows, None if the file
+                was already appended
+        """
+        digest = self.file_digest(new_dataset_path)
+        append_log = []
+        if os.path.exists(self.append_log_path):
+            with open(self.append_log_path, "r") as file:
+                append_log = json.load(file)
+        if any(entry["sha256"] == digest for entry in append_log):
+            print(f"[INFO] {new_dataset_path} has already been appended to the dataset")
+            return None
+
+        # The new rows must follow the column order of the cleaned csv
+        columns = pd.read_csv(self.clean_dataset_path, nrows=0).columns
+        tmp_path = self.clean_dataset_path + ".append.tmp"
+        reader = pd.read_csv(new_dataset_path, chunksize=chunksize,
+                             usecols=lambda col: col != "road_delineation",
+                             dtype=self.FULL_DATASET_DTYPES)
+        with open(tmp_path, "w", encoding='utf-8') as tmp_file:
+            for chunk in reader:
+                self.clean_chunk(chunk).reindex(columns=columns).to_csv(
+                    tmp_file, header=False, index=False)
+
+        # Parsing the new rows as the loader parses the cleaned csv
+        new_rows_df = pd.read_csv(tmp_path, header=None, names=columns)
+        with open(tmp_path, "rb") as src, open(self.clean_dataset_path, "ab") as dst:
+            shutil.copyfileobj(src, dst)
+        os.remove(tmp_path)
+
+        self.clean_dataset_df = pd.concat([self.clean_dataset_df, new_rows_df], ignore_index=True)
+        # The cleaned csv changed, so the cache is refreshed with the new fingerprint
+        self.dataset_fingerprint = self.fingerprint()
+        self.write_cache(self.clean_dataset_df, self.dataset_fingerprint)
+
+        append_log.append({"file": new_dataset_path, "sha256": digest, "rows": len(new_rows_df)})
+        with open(self.append_log_path, "w") as file:
+            json.dump(append_log, file, indent=2)
+        print(f"[INFO] Appended {len(new_rows_df)} rows from {new_dataset_path}")
+        return new_rows_df
+
+    def getDataframe(self):
+        """ Returns the cleaned dataset, including the appended rows"""
+        return self.clean_dataset_df
+
+    def getFingerprint(self):
+        """ Returns the fingerprint of the last dataset loaded through the cache"""
+        return self.dataset_fingerprint
+
+    def fingerprint(self):
+        """ Computes the fingerprint of the cleaned csv file. A columnar cache
+        is valid only if it was produced from a source with the very same fingerprint.
+
+        Returns:
+            A dictionary containing the size, the modification time and the SHA-256
+            digest of the cleaned csv, along with the dataset paths of the configuration
+        """
+        stat = os.stat(self.clean_dataset_path)
+        return {
+            "format_version": self.CACHE_FORMAT_VERSION,
+            "full_dataset": self.full_dataset_path,
+            "clean_dataset": self.clean_dataset_path,
+            "size": stat.st_size,
+            "mtime_ns": stat.st_mtime_ns,
+            "sha256": self.file_digest(self.clean_dataset_path)
+        }
+
+    def file_digest(self, path):
+        """ Returns the SHA-256 digest of a file"""
+        sha256 = hashlib.sha256()
+        with open(path, "rb") as file:
+            # We hash the file in blocks of 1MB to keep the memory footprint constant
+            for block in iter(lambda: file.read(1 << 20), b""):
+                sha256.update(block)
+        return sha256.hexdigest()
+
+    def load_cached_dataset(self):
+        """ Loads the cleaned dataset from its columnar cache. If the cache is missing
+        or was produced from a different version of the cleaned csv, the csv is parsed
+        and the cache is (re)built for the next loads.
+
+        Returns:
+            A Pandas Dataframe containing the cleaned dataset
+        """
+        fingerprint = self.fingerprint()
+        # Kept for the structures derived from the dataset (e.g. the coordinate store)
+        self.dataset_fingerprint = fingerprint
+        manifest_path = os.path.join(self.cache_dir, "manifest.json")
+        if os.path.exists(manifest_path):
+            with open(manifest_path, "r") as file:
+                manifest = json.load(file)
+            if manifest.get("fingerprint") == fingerprint:
+                return self.read_cache(manifest)
+            print("[INFO] The dataset cache is stale. Rebuilding it...")
+        else:
+            print("[INFO] No dataset cache found. Building it...")
+
+        df = pd.read_csv(self.clean_dataset_path)
+        self.write_cache(df, fingerprint)
+        return df
+
+    def write_cache(self, df, fingerprint):
+        """ Writes the dataframe as a columnar cache: one .npy file per column.
+        Numerical columns are stored as they are, while textual columns are
+        factorized into an array of integer codes plus the list of their distinct values.
+            Args:
+                df: The dataframe to be cached
+                fingerprint: The fingerprint of the csv the dataframe was read from
+        """
+        # The cache is written into a temporary folder which replaces the old one only
+        # at the end, so that an interrupted write never leaves a half-written cache
+        tmp_dir = self.cache_dir + ".tmp"
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        os.makedirs(tmp_dir)
+
+        columns = []
+        for i, name in enumerate(df.columns):
+            col = df[name]
+            file_name = f"col{i}.npy"
+            if pd.api.types.is_numeric_dtype(col) or pd.api.types.is_bool_dtype(col):
+                np.save(os.path.join(tmp_dir, file_name), col.to_numpy())
+                columns.append({"name": name, "kind": "numeric", "file": file_name})
+            else:
+                # NaN values are factorized as -1
+                codes, uniques = pd.factorize(col)
+                np.save(os.path.join(tmp_dir, file_name), codes.astype(np.int32))
+                columns.append({"name": name, "kind": "factorized", "file": file_name,
+                                "values": uniques.tolist()})
+
+        manifest = {"fingerprint": fingerprint, "rows": len(df), "columns": columns}
+        with open(os.path.join(tmp_dir, "manifest.json"), "w") as file:
+            json.dump(manifest, file)
+
+        shutil.rmtree(self.cache_dir, ignore_errors=True)
+        os.replace(tmp_dir, self.cache_dir)
+
+    def read_cache(self, manifest):
+        """ Rebuilds the dataframe from the columnar cache described by the manifest
+            Args:
+                manifest: The parsed manifest.json of the cache
+            Returns:
+                A Pandas Dataframe with the same columns and dtypes of the cached csv
+        """
+        data = {}
+        for column in manifest["columns"]:
+            arr = np.load(os.path.join(self.cache_dir, column["file"]))
+            if column["kind"] == "factorized":
+                values = np.empty(len(column["values"]) + 1, dtype=object)
+                values[:-1] = column["values"]
+                values[-1] = np.nan
+                # The code -1 picks the last element of values, so the NaN
+                arr = values[arr]
+            data[column["name"]] = arr
+        return pd.DataFrame(data)
\ No newline at end of file
@@ -1,20 +1,65 @@
+import os
+import time
+import copy
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
 import numpy as np
-from sklearn import metrics
+import pandas as pd
+from sklearn.neighbors import BallTree, KDTree
+from kneed import KneeLocator
 from utility import Utility
+from .silhouetteEngine import SilhouetteEngine
+from .clusterMetrics import ClusterMetrics
+
+# The clustering object of a worker process of the parameter sweep
+_worker_clustering = None
+
+def _init_sweep_worker(clustering):
+    global _worker_clustering
+    _worker_clustering = clustering
+
+def _run_sweep_worker(params):
+    return _worker_clustering.run(*params)
 
 class Geoclustering:
 
-    def __init__(self, df, accidentCause):
+    def __init__(self, df, accidentCause, arr_Radians=None):
         """ Creates a new instance of the class Geoclustering
          During the instantiation, the dataframe inside the implict object
          is created as the projection of the attributes latitude and longitude only.
         Args:
             self: A reference to the current object
             df: The pruned dataframe
+            arr_Radians: Optional field. The coordinates of df already converted in radians
+            (e.g. a view of the CoordinateStore). If None, they are computed from df
         """
         self.df_labelled = df.copy()
         self.df_coordsGPS = df[["latitude", "longitude"]].copy()
         self.accidentCause = accidentCause
+        self.arr_Radians = arr_Radians
+        # Distinct coordinates, see calculateUniqueCoords
+        self.arr_UniqueRadians = None
+        self.arr_Inverse = None
+        self.arr_Counts = None
+        # BallTree on arr_Radians, see get_spatialTree
+        self.spatial_tree = None
+        # Tree on the distinct coordinates, see get_uniqueTree
+        self.unique_tree = None
+        # Entry of a KDistanceCache, see set_kDistanceEntry
+        self.kDistance_entry = None
+        # Job reporting the progress of the tuning, see set_progress
+        self.progress = None
+        self.progress_results = []
+        # Projected mode, see set_projection and enable_projection
+        self.projection_max_error_m = None
+        self.projection = None
+        self.arr_UniqueProjected = None
+        self.silhouetteEngine = SilhouetteEngine()
+        self.clusterMetrics = ClusterMetrics()
+        # Quality indices of arr_Labels, see get_quality_metrics. They're computed on the
+        # distinct coordinates, if available, unless metrics_on_unique is False
+        self.quality_metrics = None
+        self.metrics_on_unique = True
         # I require also:
         # df_coordsGPSLabeled
         # arr_Labels
@@ -48,24 +93,193 @@ class Geoclustering:
         to be passed to the clustering algorithm
         The format parameter, if equal to pd forces the method to return a copy
         of the object as a dataframe"""
-        self.arr_Radians = np.radians(self.df_coordsGPS).to_numpy()
+        if self.arr_Radians is None:
+            self.arr_Radians = np.radians(self.df_coordsGPS.astype(np.float64)).to_numpy()
         if format == 'pd':
-            return np.radians(self.df_coordsGPS)
+            return pd.DataFrame(self.arr_Radians, columns=["latitude", "longitude"])
     
-    def getHopkins(self):
+    def calculateUniqueCoords(self):
+        """ Collapses the accidents sharing the very same coordinates. Computes once the
+        distinct coordinates in radians, the number of accidents at each of them and, for
+        each accident, the position of its coordinates among the distinct ones.
+        The clustering algorithms work on the distinct coordinates weighted by their counts,
+        and their labels are brought back to the accidents through the inverse array."""
+        if self.arr_UniqueRadians is not None:
+            return
+        self.calculateRadians()
+        # The distinct coordinates are sorted by (lat, lon)
+        unique, inverse, counts = np.unique(self.arr_Radians, axis=0, return_inverse=True, return_counts=True)
+        self.arr_UniqueRadians = unique
+        self.arr_Inverse = inverse.reshape(-1)
+        self.arr_Counts = counts
+
+    def get_uniqueRadians(self):
+        return self.arr_UniqueRadians
+
+    def get_inverse(self):
+        return self.arr_Inverse
+
+    def get_counts(self):
+        return self.arr_Counts
+
+    def set_projection(self, max_error_m):
+        """ Enables the projected mode: the clustering algorithms work on the coordinates
+        projected on a plane, with the Euclidean distance, if the error of the projection
+        on the distances used by the clustering is at most max_error_m metres"""
+        self.projection_max_error_m = max_error_m
+
+    def enable_projection(self, reference_km=None):
+        """ If the projected mode is enabled, projects the distinct coordinates with the
+        azimuthal equidistant projection centered in their centroid. The distances from the
+        center are exact, while the other ones are stretched at most by the factor
+        k = rho/sin(rho) of the farthest point (rho is its angular distance from the center):
+        a projected distance d' of a true distance d is d <= d' <= k*d. The projection is
+        used only if the error (k-1)*reference_km is at most the allowed one, so the large
+        partitions (e.g. states) fall back to the haversine distance.
+        Args:
+            self: A reference to the current object
+            reference_km: Optional field. The largest distance (in km) compared by the
+            clustering algorithm, e.g. the largest Eps. By default the diameter of the partition
+        Returns:
+            True if the clustering algorithms work on the projected coordinates
+        """
+        self.projection = None
+        self.arr_UniqueProjected = None
+        self.unique_tree = None
+        if self.projection_max_error_m is None:
+            return False
+        self.calculateUniqueCoords()
+        X = self.arr_UniqueRadians
+        # The centroid of the accidents on the sphere
+        cos_lat = np.cos(X[:, 0])
+        vectors = np.column_stack([cos_lat*np.cos(X[:, 1]), cos_lat*np.sin(X[:, 1]), np.sin(X[:, 0])])
+        mean = (vectors * self.arr_Counts[:, None]).sum(axis=0)
+        mean /= np.linalg.norm(mean)
+        center = (np.arcsin(mean[2]), np.arctan2(mean[1], mean[0]))
+        rho_max = np.max(self.angular_distances(X, center))
+        k_max = rho_max/np.sin(rho_max) if rho_max > 0 else 1.0
+        if reference_km is None:
+            reference_km = 2 * rho_max * Utility.getEarthRadius()
+        error_m = (k_max - 1) * reference_km * 1000
+        if error_m > self.projection_max_error_m:
+            print(f"[INFO] Projection error up to {error_m:.2f} m: the haversine distance is used")
+            return False
+        self.projection = {"center": center, "error_m": error_m}
+        self.arr_UniqueProjected = self.project(X)
+        return True
+
+    def angular_distances(self, X, center):
+        """ Returns the angular distances (haversine formula) of the coordinates X in radians from center"""
+        lat0, lon0 = center
+        a = np.sin((X[:, 0] - lat0)/2)**2 + np.cos(lat0)*np.cos(X[:, 0])*np.sin((X[:, 1] - lon0)/2)**2
+        return 2*np.arcsin(np.sqrt(np.clip(a, 0, 1)))
+
+    def project(self, X):
+        """ Returns the azimuthal equidistant projection of the coordinates X in radians.
+        The projected coordinates are expressed in radians of arc, as the haversine distance"""
+        lat0, lon0 = self.projection["center"]
+        lat, delta_lon = X[:, 0], X[:, 1] - lon0
+        c = self.angular_distances(X, self.projection["center"])
+        sin_c = np.sin(c)
+        k = np.divide(c, sin_c, out=np.ones_like(c), where=sin_c > 0)
+        x = k * np.cos(lat) * np.sin(delta_lon)
+        y = k * (np.cos(lat0)*np.sin(lat) - np.sin(lat0)*np.cos(lat)*np.cos(delta_lon))
+        return np.column_stack([x, y])
+
+    def get_clusteringCoords(self, unique=True):
+        """ Returns the coordinates the clustering algorithms work on and their metric:
+        the projected coordinates with the Euclidean distance (KD-tree) in the projected mode,
+        the coordinates in radians with the haversine distance otherwise
+        Args:
+            self: A reference to the current object
+            unique: Optional field. If True the distinct coordinates, otherwise all the accidents
+        """
+        if self.projection is None:
+            return (self.arr_UniqueRadians if unique else self.arr_Radians), "haversine"
+        if unique:
+            return self.arr_UniqueProjected, "euclidean"
+        return self.project(self.arr_Radians), "euclidean"
+
+    def set_kDistanceEntry(self, entry):
+        """ Shares the tree and the k-distance curves of the partition with the other
+        requests, through an entry of a KDistanceCache"""
+        self.kDistance_entry = entry
+
+    def get_spatialTree(self):
+        """ Returns the BallTree (haversine metric) of the coordinates in radians.
+        It's built once and shared by the k-distance search and the Hopkins statistic,
+        and with the next requests if the object has a KDistanceCache entry"""
+        # The callers use the coordinates in radians along with the tree
+        self.calculateRadians()
+        if self.spatial_tree is None:
+            if self.kDistance_entry is not None and self.kDistance_entry["tree"] is not None:
+                self.spatial_tree = self.kDistance_entry["tree"]
+            else:
+                self.spatial_tree = BallTree(self.arr_Radians, leaf_size=40, metric='haversine')
+                if self.kDistance_entry is not None:
+                    self.kDistance_entry["tree"] = self.spatial_tree
+        return self.spatial_tree
+
+    def get_uniqueTree(self):
+        """ Returns the tree of the distinct coordinates, in the space of get_clusteringCoords:
+        a BallTree (haversine metric) of the coordinates in radians or, in the projected mode,
+        a KD-tree of the projected coordinates. It's built once and shared by the neighbors
+        searches of the tuning, and with the next requests if the object has a KDistanceCache
+        entry. The tree of get_spatialTree indexes every accident, so it would return each
+        distinct coordinates once per accident"""
+        self.calculateUniqueCoords()
+        if self.unique_tree is None:
+            key = "unique_tree" if self.projection is None else "projected_tree"
+            if self.kDistance_entry is not None and self.kDistance_entry[key] is not None:
+                self.unique_tree = self.kDistance_entry[key]
+            else:
+                if self.projection is None:
+                    self.unique_tree = BallTree(self.arr_UniqueRadians, metric='haversine')
+                else:
+                    # The projection depends only on the coordinates of the partition
+                    self.unique_tree = KDTree(self.arr_UniqueProjected)
+                if self.kDistance_entry is not None:
+                    self.kDistance_entry[key] = self.unique_tree
+        return self.unique_tree
+
+    def get_kDistance(self, k):
+        """ Returns the k-distance curve, i.e. the distances (in km) of the points from their
+        k-th nearest neighbor (the point itself is the first one) in non-increasing order,
+        and its knee, None if any knee isn't found. Both are kept in the KDistanceCache
+        entry of the object, if any
+        Args:
+            self: A reference to the current object
+            k: The neighbor, not greater than the number of points
+        """
+        if self.kDistance_entry is not None and k in self.kDistance_entry["curves"]:
+            return self.kDistance_entry["curves"][k]
+        self.calculateRadians()
+        distances_rad, _ = self.get_spatialTree().query(self.arr_Radians, k=k)
+        curve = np.sort(distances_rad[:, k-1] * Utility.getEarthRadius())[::-1]
+        x = np.arange(1, len(curve)+1)
+        knee = KneeLocator(x, curve, curve="convex", direction="decreasing")
+        result = (curve, curve[knee.knee] if knee.knee is not None else None)
+        if self.kDistance_entry is not None:
+            self.kDistance_entry["curves"][k] = result
+        return result
+
+    def getHopkins(self, seed=None):
         """ Returns the Hopkins index for the data to be clustered
-        A score tending to 0 expresses high clustering tendency."""
-        X = self.df_coordsGPS.copy()
-        dim = X.shape[0]
+        A score tending to 0 expresses high clustering tendency.
+        Args:
+            self: A reference to the current object
+            seed: Optional field. The seed of the sampling, for reproducible results
+        """
+        dim = self.df_coordsGPS.shape[0]
         if dim < 50:
             n_samples = dim
         else:
             n_samples = 50
-        # The conversion is necessary since hopkins() expects an ndarray as first parameter
         # Check: to compute the hopkins metrics we need at least 2 points
         if dim < 2:
             return 1
-        H = Utility.hopkins(X.to_numpy(), n_samples)
+        tree = self.get_spatialTree()
+        H = Utility.hopkins(self.arr_Radians, n_samples, seed=seed, tree=tree, in_radians=True)
         return H
         
     
@@ -74,48 +288,230 @@ class Geoclustering:
         """
         return len(set(self.arr_Labels[self.arr_Labels >= 0]))
     
+    def set_labels(self, labels):
+        """ Stores the labels of the accidents found by the clustering algorithm.
+        The quality indices of the previous labels are discarded
+            Args:
+                labels: The cluster of each accident, -1 for the outliers
+        """
+        self.arr_Labels = labels
+        self.quality_metrics = None
+
+    def set_silhouetteEngine(self, silhouetteEngine):
+        """ Replaces the default SilhouetteEngine (e.g. with one configured from the config file)"""
+        self.silhouetteEngine = silhouetteEngine
+        self.quality_metrics = None
+
+    def set_clusterMetrics(self, clusterMetrics):
+        """ Replaces the default ClusterMetrics (e.g. with one using the haversine distance)"""
+        self.clusterMetrics = clusterMetrics
+        self.quality_metrics = None
+
+    def get_quality_metrics(self):
+        """ Returns all the quality indices of the clustering, computed in a single pass.
+        If the distinct coordinates are available (and metrics_on_unique is True), the
+        indices are computed on them, each one weighted by its number of accidents. The SilhouetteEngine computes the
+        silhouette exactly or on a sample depending on the number of points.
+        The indices are computed once per labelling (see set_labels): the getters of the
+        single indices read them from the same dictionary
+        Returns:
+            A dictionary with number_of_clusters, core_outlier_ratio, davies_bouldin_index,
+            silouette_coefficent and calinski_index
+        """
+        if self.quality_metrics is not None:
+            return self.quality_metrics
+        if self.metrics_on_unique and self.arr_UniqueRadians is not None:
+            # Accidents with the same coordinates share the label
+            unique_labels = np.empty(len(self.arr_UniqueRadians), dtype=self.arr_Labels.dtype)
+            unique_labels[self.arr_Inverse] = self.arr_Labels
+            self.quality_metrics = self.clusterMetrics.evaluate(self.arr_UniqueRadians, unique_labels,
+                                                                self.arr_Counts, self.silhouetteEngine)
+        else:
+            self.quality_metrics = self.clusterMetrics.evaluate(self.arr_Radians, self.arr_Labels,
+                                                                silhouetteEngine=self.silhouetteEngine)
+        return self.quality_metrics
+
     def get_coreOutlierRatio(self):
         """ Returns the ratio between the number of core points and the numbers
         of outliers found by the clustering algorithm"""
-        
-        mask = self.arr_Labels != -1
-        count_core_points = np.sum(mask)
-        total_points = np.size(mask)
-        count_outliers = total_points - count_core_points
-
-        # Protection against division by zero
-        # It may happen to have 0 outliers
-        # In that case we set the ratio equal to 10k
-        if count_outliers == 0:
-            return 10000
-        
-        return count_core_points/count_outliers
+        return self.get_quality_metrics()['core_outlier_ratio']
     
     def get_davies_bouldin_index(self):
         """ Returns the Davies-Boudlin Index found by the clustering algorithm"""
-        
-        mask = self.arr_Labels != -1
-        data_filtered = self.arr_Radians[mask]
-        labels_filtered = self.arr_Labels[mask]
-        
-        return metrics.davies_bouldin_score(data_filtered, labels_filtered)
+        return self.get_quality_metrics()['davies_bouldin_index']
+
     def get_silouette_coefficent(self):
         """ Returns the Silouette Coefficent found by the clustering algorithm"""
-
-        mask = self.arr_Labels != -1
-        data_filtered = self.arr_Radians[mask]
-        labels_filtered = self.arr_Labels[mask]
-
-        return metrics.silhouette_score(data_filtered, labels_filtered, metric='haversine')
+        return self.get_quality_metrics()['silouette_coefficent']
     
     def get_calinski_index(self):
         """ Returns the Calinski-Harabasz index found by the clustering algorithm"""
+        return self.get_quality_metrics()['calinski_index']
+
+    def sweep(self, grid, workers=1, executor="process"):
+        """ Runs the clustering algorithm for every combination of parameters of the grid,
+        in parallel if more than one worker is requested (see open_sweep_pool).
+        Args:
+            self: A reference to the current object
+            grid: A list of tuples, each one containing the arguments of a call to run
+            workers: Optional field. The number of workers, 0 to use all the CPUs
+            executor: Optional field. "process" or "thread"
+        Returns:
+            The list of the results of run, in the same order of grid
+        """
+        pool, fn = self.open_sweep_pool(grid, workers, executor)
+        if pool is None:
+            return [self.run(*params) for params in grid]
+        with pool:
+            return list(pool.map(fn, grid))
+
+    def open_sweep_pool(self, grid, workers=1, executor="process"):
+        """ Creates the pool of workers running the combinations of a sweep.
+        With the process executor the workers are forked: they inherit the coordinates
+        of the current object instead of receiving a copy of them with every task.
+        Forking is safe only in a single-threaded process (e.g. the offline tools): a
+        multi-threaded one, as the web server, must use the thread executor.
+        Where fork isn't available (e.g. Windows) a thread pool is used.
+        Args:
+            self: A reference to the current object
+            grid: The combinations of parameters of the sweep
+            workers: Optional field. The number of workers, 0 to use all the CPUs
+            executor: Optional field. "process" or "thread"
+        Returns:
+            The pool and the function to submit to it with a combination of the grid,
+            (None, None) if a single worker is enough
+        """
+        # The coordinates are computed before the workers are started, so that they're shared
+        self.calculateRadians()
+        self.calculateUniqueCoords()
+        if workers == 0:
+            workers = os.cpu_count() or 1
+        workers = min(workers, len(grid))
+        if workers <= 1:
+            return None, None
+
+        if executor == "process" and "fork" in multiprocessing.get_all_start_methods():
+            # The labelled dataframe and the Job aren't needed by run: they stay in the parent process
+            worker_clustering = copy.copy(self)
+            worker_clustering.df_labelled = None
+            worker_clustering.progress = None
+            pool = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("fork"),
+                                       initializer=_init_sweep_worker, initargs=(worker_clustering,))
+            return pool, _run_sweep_worker
 
-        mask = self.arr_Labels != -1
-        data_filtered = self.arr_Radians[mask]
-        labels_filtered = self.arr_Labels[mask]
+        # run stores the labels in the object, so every thread works on a shallow copy
+        # sharing the coordinates
+        return ThreadPoolExecutor(max_workers=workers), lambda params: copy.copy(self).run(*params)
 
-        return metrics.calinski_harabasz_score(data_filtered, labels_filtered)
+    def set_progress(self, progress):
+        """ Reports the progress of the tuning to a Job: the combinations run out of the
+        total and the best combinations found so far. The tuning stops, raising
+        JobCancelled, at the first check after the job is cancelled"""
+        self.progress = progress
+
+    def start_progress(self, total):
+        """ Starts the count of the combinations of the tuning"""
+        self.progress_results = []
+        if self.progress is not None:
+            self.progress.set_total(total)
+
+    def report_progress(self, steps, results):
+        """ Reports to the Job the combinations run and the best 3 ones found so far
+        Args:
+            self: A reference to the current object
+            steps: The number of combinations run since the last report
+            results: Their results returned by run
+        """
+        if self.progress is None:
+            return
+        self.progress_results += [perf for perf in results if isinstance(perf, str) == False]
+        _, best = Geoclustering.rank_tuning_results(self, self.progress_results)
+        self.progress.update(steps, best.to_json() if best is not None else None)
+
+    def check_cancelled(self):
+        """ Raises JobCancelled if the Job of the tuning has been cancelled"""
+        if self.progress is not None:
+            self.progress.check_cancelled()
+
+    def sweep_until(self, grid, workers=1, executor="process", deadline=None, chunk_size=1, pool=None):
+        """ Runs the grid in chunks on a single pool of workers, stopping at the first
+        chunk that ends after the deadline: the combinations not run yet are skipped.
+        If the object has a Job, the progress is reported after every chunk, and the
+        cancellation checked whenever a combination ends.
+        Args:
+            self: A reference to the current object
+            grid: A list of tuples, each one containing the arguments of a call to run
+            workers: Optional field. The number of workers, 0 to use all the CPUs
+            executor: Optional field. "process" or "thread"
+            deadline: Optional field. A time.monotonic() value, None to run the whole grid
+            chunk_size: Optional field. The number of combinations run between two checks
+            of the deadline, multiplied by the number of workers
+            pool: Optional field. The pool returned by open_sweep_pool, shared by more sweeps
+            of the same object: it isn't shut down. By default a pool is created
+        Returns:
+            The list of the results of run of the combinations run, in the same order of
+            grid, and True if the whole grid has been run
+        """
+        if pool is None and deadline is None and self.progress is None:
+            return self.sweep(grid, workers, executor), True
+        if workers == 0:
+            workers = os.cpu_count() or 1
+        chunk_size = max(1, chunk_size * workers)
+        own_pool = pool is None
+        pool, fn = self.open_sweep_pool(grid, workers, executor) if own_pool else pool
+        results = []
+        try:
+            for start in range(0, len(grid), chunk_size):
+                if start > 0 and deadline is not None and time.monotonic() >= deadline:
+                    print(f"[INFO] Time budget exhausted after {start} of {len(grid)} combinations")
+                    return results, False
+                self.check_cancelled()
+                chunk = grid[start:start + chunk_size]
+                chunk_results = [None] * len(chunk)
+                if pool is None:
+                    for i, params in enumerate(chunk):
+                        chunk_results[i] = self.run(*params)
+                        self.check_cancelled()
+                else:
+                    futures = {pool.submit(fn, params): i for i, params in enumerate(chunk)}
+                    for future in as_completed(futures):
+                        chunk_results[futures[future]] = future.result()
+                        self.check_cancelled()
+                self.report_progress(len(chunk_results), chunk_results)
+                results += chunk_results
+        finally:
+            if own_pool and pool is not None:
+                # On a cancellation the combinations not started yet are dropped
+                pool.shutdown(cancel_futures=True)
+        return results, True
+
+    def rank_tuning_results(self, arr_tuning_results):
+        """ Ranks the performances of the parameter combinations
+        Args:
+            self: A reference to the current object
+            arr_tuning_results: A list of dictionaries returned by run
+        Returns:
+            A status code and a dataframe containing the best 3 combinations. The status is
+            -1 (and the dataframe None) if there are no results, 0 if the best combinations
+            have a good core_outlier_ratio, 1 otherwise
+        """
+        if len(arr_tuning_results) == 0:
+            return -1, None
+
+        # Selecting the best performances
+        tuning_results_df = pd.DataFrame(arr_tuning_results)
+        tuning_results_df = tuning_results_df.sort_values(
+            by = ["core_outlier_ratio", "silouette_coefficent", "davies_bouldin_index", "calinski_index"],
+            ascending = [True, False, True, False]
+        )
+        df_returned = tuning_results_df.query("core_outlier_ratio > 1.4")[:3]
+        # Sometimes it may happen that it's not possible to obtain a good core_outlier_ratio
+        # In that case we inform the frontend and we return the top 3 highest metrics in terms
+        # of descending core_outlier_ratios
+        if df_returned.shape[0] < 3:
+            return 1, tuning_results_df[-3:]
+        else:
+            return 0, df_returned
 
     def attachLabels(self):
         """ Creates a dataframe in which the GPS coordinates and the labels
@@ -0,0 +1,108 @@
+import numpy as np
+import pandas as pd
+from .geoclustering import Geoclustering
+from sklearn.cluster import HDBSCAN
+from utility import Utility
+
+class HdbscanClustering(Geoclustering):
+    """
+    Class that implements the hotspot location for specified city or state with HDBSCAN.
+    HDBSCAN extracts the clusters of every density from a single fit: there is no grid of
+    Eps (DBSCAN) or of max_eps and xi (OPTICS) to scan
+    """
+
+    def __init__(self, df, granularity, name, accidentCause, minClusterSize, minSamples,
+                 clusterSelectionEpsilon=0.0, partitionIndex=None, coordinateStore=None):
+        """ Creates a new instance of the class HdbscanClustering
+        Args:
+            self: A reference to the current object
+            df: A pre-processed dataframe containing accident events records
+            granularity: "city" or "state"
+            name: The name of the city or of the state to be considered in the analysis
+            accidentCause: The general cause of accident
+            minClusterSize: The min_cluster_size parameter of HDBSCAN
+            minSamples: The min_samples parameter of HDBSCAN
+            clusterSelectionEpsilon: Optional field. The cluster_selection_epsilon parameter
+            of HDBSCAN expressed in km: the clusters closer than it are merged
+            partitionIndex: Optional field. The PartitionIndex built over df
+            coordinateStore: Optional field. The CoordinateStore built over df
+        """
+        arr_Radians = None
+        if coordinateStore is not None:
+            if granularity == "city":
+                rows, arr_Radians = coordinateStore.getCityPartition(name, accidentCause)
+            else:
+                rows, arr_Radians = coordinateStore.getStatePartition(name, accidentCause)
+            df_partition = df.iloc[rows].copy()
+        elif partitionIndex is not None:
+            if granularity == "city":
+                df_partition = df.iloc[partitionIndex.getCityRows(name, accidentCause)].copy()
+            else:
+                df_partition = df.iloc[partitionIndex.getStateRows(name, accidentCause)].copy()
+        else:
+            df_partition = df[(df[granularity] == name) & (df["general_cause_of_accident"] == accidentCause)].copy()
+        super().__init__(df_partition, accidentCause, arr_Radians)
+        self.granularity = granularity
+        self.name = name
+        self.minClusterSize = minClusterSize
+        self.minSamples = minSamples
+        self.clusterSelectionEpsilon = clusterSelectionEpsilon
+        # The accidents with the same coordinates may get different labels: the quality
+        # indices are computed on all the accidents, even when the projected mode
+        # computes the distinct coordinates
+        self.metrics_on_unique = False
+
+    def run(self):
+        """ Performs HDBSCAN clustering algorithm. HDBSCAN has no sample weights, so it's
+        fitted on all the accidents: the duplicated coordinates are dense regions.
+        The accidents with the same coordinates may get different labels, so the quality
+        indices are computed on all the accidents as well
+        Returns:
+            A dictionary containing the performance metrics
+            of the clustering algorithm or "No clusters" if no more than
+            1 cluster is found
+        """
+        Geoclustering.calculateRadians(self)
+        if self.arr_Radians.shape[0] < self.minClusterSize:
+            return "No clusters"
+        X, metric = Geoclustering.get_clusteringCoords(self, unique=False)
+        hdbscan = HDBSCAN(min_cluster_size=self.minClusterSize, min_samples=self.minSamples,
+                          cluster_selection_epsilon=self.clusterSelectionEpsilon/Utility.getEarthRadius(),
+                          metric=metric)
+        hdbscan.fit(X)
+        # The labels -2 and -3 (infinite and missing coordinates) are outliers as well
+        Geoclustering.set_labels(self, np.where(hdbscan.labels_ < 0, -1, hdbscan.labels_))
+
+        n_clusters = Geoclustering.get_numberOfClusters(self)
+        if n_clusters <= 1:
+            return "No clusters"
+        quality = Geoclustering.get_quality_metrics(self)
+        hdbscan_performance = {
+            'min_cluster_size': self.minClusterSize,
+            'min_samples': self.minSamples,
+            'core_outlier_ratio': quality['core_outlier_ratio'],
+            'number_of_clusters': n_clusters,
+            'davies_bouldin_index': quality['davies_bouldin_index'],
+            'silouette_coefficent': quality['silouette_coefficent'],
+            'calinski_index': quality['calinski_index']
+        }
+        return hdbscan_performance
+
+    def clustering_tuning(self):
+        """ Runs the single fit of HDBSCAN. Same return values of the tuning of the other
+        algorithms, so that the response of /clustering doesn't change
+        Returns:
+            A status code and a dataframe with the performances of the fit. The status is
+            -1 (and the dataframe None) if no cluster is found, 0 if the core_outlier_ratio
+            is good, 1 otherwise
+        """
+        # HDBSCAN compares the distances within the whole partition
+        Geoclustering.enable_projection(self)
+        Geoclustering.start_progress(self, 1)
+        perf = self.run()
+        Geoclustering.report_progress(self, 1, [perf])
+        if isinstance(perf, str):
+            return -1, None
+        # Same threshold on the core_outlier_ratio of rank_tuning_results
+        sts = 0 if perf['core_outlier_ratio'] > 1.4 else 1
+        return sts, pd.DataFrame([perf])
@@ -0,0 +1,69 @@
+import threading
+from collections import OrderedDict
+
+class KDistanceCache:
+    """ Cache of the k-distance data of the partitions, shared by the requests: the BallTree
+    (haversine metric) of the coordinates in radians, used by the k-distance search and by
+    the Hopkins statistic, the trees of the distinct coordinates, used by the neighbors
+    searches of DBSCAN, and for every k the sorted k-distance curve and its knee.
+    An entry is keyed by the partition and is valid for a version of the dataset: a lookup
+    with a different version replaces it. The entries are kept in LRU order, up to
+    max_entries. The cache is thread-safe."""
+
+    def __init__(self, max_entries=64):
+        """ Creates a new instance of the class KDistanceCache
+            Args:
+                max_entries: Optional field. The largest number of partitions kept in memory
+        """
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        self.evictions = 0
+
+    def get_entry(self, granularity, name, cause, dataset_version):
+        """ Returns the entry of a partition, an empty one if it isn't cached or if it was
+        computed on another version of the dataset. The entry is a dictionary with the
+        tree ("tree", None until it's built), the trees of the distinct coordinates
+        ("unique_tree" and, for the projected mode, "projected_tree") and the curves
+        ("curves", k -> (curve, knee)), filled by Geoclustering
+        Args:
+            granularity: "city" or "state"
+            name: The city or the state
+            cause: The general cause of accident
+            dataset_version: The version of the partition, e.g. the fingerprint of the
+            dataset and the version of the partition in the PartitionIndex
+        """
+        key = (granularity, name, cause)
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and entry["version"] == dataset_version:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return entry
+            if entry is None:
+                self.misses += 1
+            else:
+                self.invalidations += 1
+            entry = {"version": dataset_version, "tree": None, "unique_tree": None,
+                     "projected_tree": None, "curves": {}}
+            self.entries[key] = entry
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+            return entry
+
+    def stats(self):
+        """ Returns the counters of the cache, ready to be serialized"""
+        with self.lock:
+            return {
+                "entries": len(self.entries),
+                "max_entries": self.max_entries,
+                "hits": self.hits,
+                "misses": self.misses,
+                "invalidations": self.invalidations,
+                "evictions": self.evictions
+            }
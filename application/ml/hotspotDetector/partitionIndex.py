@@ -0,0 +1,103 @@
+import numpy as np
+
+class PartitionIndex:
+    """ Index built once over the preprocessed dataframe, mapping each (city, general cause)
+    and (state, general cause) partition to the positions of its rows. Extracting a
+    partition costs O(partition size) instead of a scan of the whole dataframe.
+    The index keeps a version of the dataset, bumped by every append, and the version
+    in which each partition was last changed: the results computed on a partition stay
+    valid as long as its version doesn't change."""
+
+    def __init__(self, df):
+        """ Creates a new instance of the class PartitionIndex
+            Args:
+                self: A reference to the current object
+                df: The preprocessed dataframe, containing the attributes city, state
+                and general_cause_of_accident
+        """
+        self.df = df
+        self.empty = np.empty(0, dtype=np.int64)
+        self.city_rows = self.group_rows("city")
+        self.state_rows = self.group_rows("state")
+        self.causes_by_city = self.group_causes(self.city_rows)
+        self.causes_by_state = self.group_causes(self.state_rows)
+        self.version = 0
+        # (name, general cause) -> version of the last change. Missing partitions are at version 0
+        self.city_versions = {}
+        self.state_versions = {}
+
+    def group_rows(self, col, start=0):
+        """ Returns a dictionary (name, general cause) -> ndarray of row positions,
+        considering the rows from the position start on.
+        The rows without a general cause of accident are not indexed."""
+        # observed=True avoids materializing the empty combinations of categorical columns
+        groups = self.df.iloc[start:].groupby([col, "general_cause_of_accident"], observed=True, sort=False).indices
+        return {key: positions + start for key, positions in groups.items()}
+
+    def group_causes(self, rows):
+        """ Returns a dictionary name -> list of general causes, in order of first
+        appearance in the dataframe (the same order of drop_duplicates)"""
+        first_rows = {}
+        for (name, cause), positions in rows.items():
+            first_rows.setdefault(name, []).append((positions[0], cause))
+        return {name: [cause for _, cause in sorted(pairs)] for name, pairs in first_rows.items()}
+
+    def append(self, df, start):
+        """ Indexes the rows appended to the dataframe and bumps the version of the
+        dataset. Only the partitions receiving new rows get the new version.
+            Args:
+                self: A reference to the current object
+                df: The preprocessed dataframe including the appended rows
+                start: The position of the first appended row
+            Returns:
+                The new version of the dataset
+        """
+        self.df = df
+        self.version += 1
+        for rows, causes, versions, col in [(self.city_rows, self.causes_by_city, self.city_versions, "city"),
+                                            (self.state_rows, self.causes_by_state, self.state_versions, "state")]:
+            new_rows = self.group_rows(col, start)
+            for key, positions in new_rows.items():
+                old_positions = rows.get(key)
+                rows[key] = positions if old_positions is None else np.concatenate([old_positions, positions])
+                versions[key] = self.version
+            # The new causes of a name appear after the old ones, as in drop_duplicates
+            for name, new_causes in self.group_causes(new_rows).items():
+                old_causes = causes.get(name, [])
+                causes[name] = old_causes + [cause for cause in new_causes if cause not in old_causes]
+        return self.version
+
+    def getVersion(self):
+        """ Returns the version of the dataset, bumped by every append"""
+        return self.version
+
+    def getCityVersion(self, city, cause):
+        """ Returns the version in which the partition (city, cause) was last changed"""
+        return self.city_versions.get((city, cause), 0)
+
+    def getStateVersion(self, state, cause):
+        """ Returns the version in which the partition (state, cause) was last changed"""
+        return self.state_versions.get((state, cause), 0)
+
+    def getChangedPartitions(self, since_version):
+        """ Returns the (city, cause) and (state, cause) partitions changed after since_version"""
+        return {
+            "cities": [list(key) for key, version in self.city_versions.items() if version > since_version],
+            "states": [list(key) for key, version in self.state_versions.items() if version > since_version]
+        }
+
+    def getCityRows(self, city, cause):
+        """ Returns the positions of the rows of the city caused by the specified general cause"""
+        return self.city_rows.get((city, cause), self.empty)
+
+    def getStateRows(self, state, cause):
+        """ Returns the positions of the rows of the state caused by the specified general cause"""
+        return self.state_rows.get((state, cause), self.empty)
+
+    def getGeneralCausesCity(self, city):
+        """ Returns a list containing the general causes of accident for a specific city"""
+        return self.causes_by_city.get(city, [])
+
+    def getGeneralCausesState(self, state):
+        """ Returns a list containing the general causes of accident for a specific state"""
+        return self.causes_by_state.get(state, [])
@@ -1,3 +1,6 @@
+import numpy as np
+import pandas as pd
+
 class Preprocessing:
     """ Class performing dimensionality, numerosity and class reduction """
 
@@ -102,6 +105,81 @@ class Preprocessing:
         
         self.df["general_cause_of_accident"] = self.df["cause_of_accident"].map(reverse_mapping)
 
+    def compact_dataframe(self, verbose=True):
+        """ Converts the columns of the dataframe into compact dtypes, in order to
+        reduce the memory footprint of the dataframe kept in memory by the backend.
+        The textual columns become categoricals and road_id the smallest unsigned integer
+        able to contain it. The coordinates and km stay float64: rounding them would change
+        the results of the clustering and the values of the response. Must be called after
+        map_general_causes.
+            Args:
+                self: A reference to the current object containing the dataframe
+                verbose: Optional field. If True the memory report is printed
+            Returns:
+                A dataframe reporting, for each column, the memory usage in bytes
+                before and after the compaction
+        """
+        memory_before = self.df.memory_usage(deep=True, index=False)
+
+        categorical_cols = ["city", "state", "cause_of_accident", "general_cause_of_accident", "victims_condition"]
+        for col in categorical_cols:
+            if col in self.df.columns:
+                self.df[col] = self.df[col].astype("category")
+
+        if "road_id" in self.df.columns:
+            self.df["road_id"] = pd.to_numeric(self.df["road_id"], errors="coerce", downcast="unsigned")
+
+        if "km" in self.df.columns:
+            # The milestones are written with the comma as decimal separator (e.g. 34,9)
+            # so we cannot use an integer type without losing the decimal part, and in
+            # float32 34.9 would be returned as 34.900001525878906
+            km = self.df["km"].astype(str).str.replace(",", ".", regex=False)
+            self.df["km"] = pd.to_numeric(km, errors="coerce").astype(np.float64)
+
+        memory_after = self.df.memory_usage(deep=True, index=False)
+        report = pd.DataFrame({
+            "dtype": self.df.dtypes.astype(str),
+            "bytes_before": memory_before,
+            "bytes_after": memory_after
+        })
+        report.loc["TOTAL"] = ["", memory_before.sum(), memory_after.sum()]
+
+        if verbose:
+            print("[INFO] Memory usage of the hotspot dataframe:")
+            print(report.to_string())
+        return report
+
+    def append_rows(self, df):
+        """ Pre-processes the rows of df with the same steps applied to the current
+        dataframe (projection, general causes, compaction) and appends them to it.
+        The categories of the categorical columns become the union of the old and the
+        new ones, with the old categories keeping their codes.
+        The current dataframe isn't modified: it's replaced by a new one.
+            Args:
+                self: A reference to the current object containing the dataframe
+                df: The cleaned dataframe containing the rows to append
+            Returns:
+                The pre-processed new rows
+        """
+        new_rows = Preprocessing(df)
+        new_rows.drop_columns(cols_to_keep=self.df.columns.to_list())
+        new_rows.map_general_causes()
+        new_rows.compact_dataframe(verbose=False)
+        new_df = new_rows.getDataframe().reindex(columns=self.df.columns)
+
+        dtypes = {}
+        for col in self.df.columns:
+            old_dtype = self.df[col].dtype
+            if isinstance(old_dtype, pd.CategoricalDtype):
+                new_values = new_df[col].dropna().unique()
+                dtypes[col] = pd.CategoricalDtype(old_dtype.categories.union(new_values, sort=False))
+            else:
+                # e.g. road_id may need a wider unsigned integer
+                dtypes[col] = np.result_type(old_dtype, new_df[col].dtype)
+        new_df = new_df.astype(dtypes)
+        self.df = pd.concat([self.df.astype(dtypes), new_df], ignore_index=True)
+        return new_df
+
     def getDataframe(self):
         """ Getter method for the Preprocessing object"""
         return self.df
@@ -109,7 +187,7 @@ class Preprocessing:
     def getGeneralCausesCity(self, city):
         """ Starting from the preprocessed dataset, returns a list containing the general causes of accident
         for a specific city"""
-        df_sel = self.df.query(f"city == '{city}'")
+        df_sel = self.df[self.df["city"] == city]
         # Notice: the na values we drop are not so relevant, and they derive from all the
         # secondaries cause of accidents for which there is a very very small amount of events
         # For the sake of the convenience, these options are not even returned to the frontend
@@ -118,7 +196,7 @@ class Preprocessing:
     def getGeneralCausesState(self, state):
         """ Starting from the preprocessed dataset, returns a list containing the general causes of accident
         for a specific state"""
-        df_sel = self.df.query(f"state == '{state}'")
+        df_sel = self.df[self.df["state"] == state]
         # Notice: the na values we drop are not so relevant, and they derive from all the
         # secondaries cause of accidents for which there is a very very small amount of events
         # For the sake of the convenience, these options are not even returned to the frontend
@@ -0,0 +1,114 @@
+import os
+import json
+import hashlib
+import threading
+from collections import OrderedDict
+
+class ResultCache:
+    """ Cache of the responses of the clustering. The entries are kept in memory in
+    LRU order, up to max_entries. If a directory is given, every entry is also written
+    there as a JSON file: the entries evicted from memory, or computed before a restart
+    of the backend, are read back from disk.
+    The values must be serializable as JSON. The cache is thread-safe."""
+
+    def __init__(self, max_entries=128, disk_dir=None):
+        """ Creates a new instance of the class ResultCache
+            Args:
+                max_entries: Optional field. The largest number of entries kept in memory
+                disk_dir: Optional field. The directory of the on-disk tier, None to keep
+                the entries in memory only
+        """
+        self.max_entries = max_entries
+        self.disk_dir = disk_dir
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        if disk_dir is not None:
+            os.makedirs(disk_dir, exist_ok=True)
+
+    def make_key(self, *parts):
+        """ Returns the key of an entry: a digest of its parts, which must be serializable as JSON"""
+        content = json.dumps(parts, sort_keys=True, default=str)
+        return hashlib.sha256(content.encode("utf-8")).hexdigest()
+
+    def get(self, key):
+        """ Returns the value of the key, None if it isn't cached.
+        A value found on disk is brought back in memory"""
+        with self.lock:
+            if key in self.entries:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return self.entries[key]
+        value = self.read_disk(key)
+        with self.lock:
+            if value is None:
+                self.misses += 1
+                return None
+            self.disk_hits += 1
+            self.store(key, value)
+        return value
+
+    def put(self, key, value):
+        """ Caches the value of the key, in memory and on disk"""
+        self.write_disk(key, value)
+        with self.lock:
+            self.store(key, value)
+
+    def store(self, key, value):
+        """ Inserts the entry in memory, evicting the least recently used ones. The lock must be held"""
+        self.entries[key] = value
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+            self.evictions += 1
+
+    def disk_path(self, key):
+        return os.path.join(self.disk_dir, key + ".json")
+
+    def read_disk(self, key):
+        if self.disk_dir is None or not os.path.exists(self.disk_path(key)):
+            return None
+        try:
+            with open(self.disk_path(key), "r") as file:
+                return json.load(file)
+        except (OSError, ValueError) as e:
+            print(f"[ERR] Cache entry {key} is not readable: {e}")
+            return None
+
+    def write_disk(self, key, value):
+        """ Writes the entry on disk. The file is replaced atomically, so that a
+        concurrent reader never sees a partial entry"""
+        if self.disk_dir is None:
+            return
+        tmp_path = self.disk_path(key) + f".{threading.get_ident()}.tmp"
+        try:
+            with open(tmp_path, "w") as file:
+                json.dump(value, file)
+            os.replace(tmp_path, self.disk_path(key))
+        except OSError as e:
+            print(f"[ERR] Cache entry {key} not written: {e}")
+
+    def contains(self, key):
+        """ Returns True if the key is cached, in memory or on disk. The counters don't change"""
+        with self.lock:
+            if key in self.entries:
+                return True
+        return self.disk_dir is not None and os.path.exists(self.disk_path(key))
+
+    def stats(self):
+        """ Returns the counters of the cache, ready to be serialized"""
+        with self.lock:
+            lookups = self.hits + self.disk_hits + self.misses
+            return {
+                "entries": len(self.entries),
+                "max_entries": self.max_entries,
+                "disk": self.disk_dir is not None,
+                "hits": self.hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_ratio": (self.hits + self.disk_hits) / lookups if lookups > 0 else None
+            }
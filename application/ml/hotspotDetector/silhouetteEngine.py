@@ -0,0 +1,129 @@
+import numpy as np
+from sklearn.metrics import DistanceMetric
+
+class SilhouetteEngine:
+    """ Computes the silhouette coefficient of a clustering with the haversine metric,
+    without materializing the whole matrix of the pairwise distances.
+    The points may be weighted (e.g. distinct coordinates weighted by their number of
+    accidents): the result is the same of the silhouette of the points repeated as many
+    times as their weight.
+    Two modes are available:
+        exact: the distances are computed in blocks of rows, whose size is bounded by
+        the working memory
+        sampled: the silhouette is estimated on a stratified sample of the points (the
+        size of the sample of each cluster is proportional to its weight), computing
+        exactly the silhouette of each sampled point
+    """
+
+    def __init__(self, exact_max_points=10000, sample_size=2000, seed=0, working_memory_mb=64):
+        """ Creates a new instance of the class SilhouetteEngine
+            Args:
+                exact_max_points: Optional field. The largest number of points for which
+                score() uses the exact mode
+                sample_size: Optional field. The number of points sampled in the sampled mode
+                seed: Optional field. The seed of the sampling, for reproducible results
+                working_memory_mb: Optional field. The size (in MB) of a block of distances
+        """
+        self.exact_max_points = exact_max_points
+        self.sample_size = sample_size
+        self.seed = seed
+        self.working_memory_mb = working_memory_mb
+        self.metric = DistanceMetric.get_metric("haversine")
+
+    def score(self, X, labels, weights=None):
+        """ Returns the silhouette coefficient, choosing the mode by the number of points
+            Args:
+                X: The coordinates in radians of the points (noise excluded)
+                labels: The cluster of each point
+                weights: Optional field. The weight of each point, 1 by default
+        """
+        if len(X) <= self.exact_max_points:
+            return self.exact(X, labels, weights)
+        return self.sampled(X, labels, weights)
+
+    def exact(self, X, labels, weights=None):
+        """ Returns the exact silhouette coefficient"""
+        clusters = self.sort_by_cluster(X, labels, weights)
+        rows = np.arange(len(clusters["X"]))
+        s = self.samples_silhouette(clusters, rows)
+        return np.sum(clusters["weights"] * s) / np.sum(clusters["weights"])
+
+    def sampled(self, X, labels, weights=None):
+        """ Returns an estimate of the silhouette coefficient computed on a stratified sample.
+        Within a cluster the points are drawn with probability proportional to their weight,
+        and the mean silhouette of each cluster is weighted by the weight of the cluster"""
+        clusters = self.sort_by_cluster(X, labels, weights)
+        rng = np.random.default_rng(self.seed)
+        total_weight = clusters["cluster_weights"].sum()
+
+        draws = []
+        draws_per_cluster = []
+        for c, (start, end) in enumerate(zip(clusters["starts"], clusters["ends"])):
+            n_draws = max(1, int(round(self.sample_size * clusters["cluster_weights"][c] / total_weight)))
+            p = clusters["weights"][start:end] / clusters["cluster_weights"][c]
+            draws.append(start + rng.choice(end - start, size=n_draws, p=p))
+            draws_per_cluster.append(n_draws)
+
+        # A point drawn more than once is computed once
+        drawn_rows, inverse = np.unique(np.concatenate(draws), return_inverse=True)
+        s = self.samples_silhouette(clusters, drawn_rows)[inverse.reshape(-1)]
+
+        cluster_of_draw = np.repeat(np.arange(len(draws_per_cluster)), draws_per_cluster)
+        cluster_means = np.bincount(cluster_of_draw, weights=s) / np.array(draws_per_cluster)
+        return np.sum(cluster_means * clusters["cluster_weights"]) / total_weight
+
+    def sort_by_cluster(self, X, labels, weights):
+        """ Sorts the points by cluster, so that every cluster is a contiguous range
+        Returns:
+            A dictionary with the sorted points, their weights, the range of each cluster,
+            the weight of each cluster and the cluster of each point
+        """
+        labels = np.asarray(labels)
+        weights = np.ones(len(labels)) if weights is None else np.asarray(weights, dtype=np.float64)
+        order = np.argsort(labels, kind="stable")
+        sorted_labels = labels[order]
+        starts = np.flatnonzero(np.r_[True, sorted_labels[1:] != sorted_labels[:-1]])
+        ends = np.r_[starts[1:], len(sorted_labels)]
+        n_labels = len(starts)
+        total_weight = weights.sum()
+        # Same check of sklearn.metrics.silhouette_score
+        if not 1 < n_labels < total_weight:
+            raise ValueError(f"Number of labels is {n_labels}. Valid values are 2 to n_samples - 1 (inclusive)")
+        sorted_weights = weights[order]
+        return {
+            "X": np.asarray(X, dtype=np.float64)[order],
+            "weights": sorted_weights,
+            "starts": starts,
+            "ends": ends,
+            "cluster_weights": np.add.reduceat(sorted_weights, starts),
+            "cluster_of_point": np.repeat(np.arange(n_labels), ends - starts)
+        }
+
+    def samples_silhouette(self, clusters, rows):
+        """ Returns the silhouette of the points in the positions rows of the sorted points.
+        The distances from all the points are computed in blocks of rows"""
+        X = clusters["X"]
+        weights = clusters["weights"]
+        cluster_weights = clusters["cluster_weights"]
+        # Each block holds the distances and their weighted copy
+        block_size = max(1, int(self.working_memory_mb * 2**20 // (2 * 8 * len(X))))
+        s = np.empty(len(rows))
+        for block_start in range(0, len(rows), block_size):
+            block = rows[block_start:block_start + block_size]
+            distances = self.metric.pairwise(X[block], X)
+            distances *= weights
+            # Weighted sum of the distances from each cluster
+            cluster_sums = np.add.reduceat(distances, clusters["starts"], axis=1)
+            own = clusters["cluster_of_point"][block]
+            positions = np.arange(len(block))
+            with np.errstate(divide="ignore", invalid="ignore"):
+                # The point itself doesn't count for its cluster: its distance is zero
+                # and it's removed from the weight
+                a = cluster_sums[positions, own] / (cluster_weights[own] - 1)
+                cluster_sums[positions, own] = np.inf
+                b = np.min(cluster_sums / cluster_weights, axis=1)
+                block_s = (b - a) / np.maximum(a, b)
+            # As in sklearn, the silhouette of a point alone in its cluster is 0
+            block_s[cluster_weights[own] == 1] = 0
+            s[block_start:block_start + len(block)] = np.nan_to_num(block_s)
+        return s
@@ -1,99 +1,142 @@
 from .geoclustering import Geoclustering
-from sklearn.cluster import OPTICS
+import numpy as np
+from sklearn.cluster import OPTICS, cluster_optics_xi
 from utility import Utility
-import pandas as pd
 
 class StateClustering(Geoclustering):
     """
     Class that implements the hotspot location for specified city
     """
 
-    def __init__(self, df, stateName, accidentCause, maxRadiusArr, minPtsArr, xiArr):
+    def __init__(self, df, stateName, accidentCause, maxRadiusArr, minPtsArr, xiArr, partitionIndex=None, coordinateStore=None):
         # We are overriding the constructor of Geoclustering
-        df_state = df.query(f"state == '{stateName}' and general_cause_of_accident == '{accidentCause}'").copy()
-        super().__init__(df_state, accidentCause)
+        # If available, the PartitionIndex avoids the scan of the whole dataframe, while
+        # the CoordinateStore provides also the coordinates already converted in radians
+        arr_Radians = None
+        if coordinateStore is not None:
+            rows, arr_Radians = coordinateStore.getStatePartition(stateName, accidentCause)
+            df_state = df.iloc[rows].copy()
+        elif partitionIndex is not None:
+            df_state = df.iloc[partitionIndex.getStateRows(stateName, accidentCause)].copy()
+        else:
+            df_state = df[(df["state"] == stateName) & (df["general_cause_of_accident"] == accidentCause)].copy()
+        super().__init__(df_state, accidentCause, arr_Radians)
         self.stateName = stateName
         self.maxRadiusArr = maxRadiusArr
         self.minPtsArr = minPtsArr
         self.xiArr = xiArr
+        # minPts -> ordering, reachability and predecessors of an OPTICS fit, see fit_reachability
+        self.reachability_fits = {}
+
+    def fit_reachability(self, minPts, max_eps):
+        """ Fits OPTICS once and stores its ordering, reachability distances and predecessors,
+        which depend only on minPts and max_eps. The following runs with the same minPts and
+        a max_eps not greater than this one derive their labels from the stored fit instead
+        of fitting OPTICS again.
+        Args:
+            self: A reference to the current object
+            minPts: The minPts parameter of OPTICS
+            max_eps: The largest max_eps (in km) that will be used with minPts
+        """
+        Geoclustering.calculateUniqueCoords(self)
+        X, metric = Geoclustering.get_clusteringCoords(self)
+        optics = OPTICS(min_samples=minPts, max_eps=max_eps/Utility.getEarthRadius(), metric=metric)
+        optics.fit(X)
+        self.reachability_fits[minPts] = {
+            "max_eps": max_eps,
+            "ordering": optics.ordering_,
+            "reachability": optics.reachability_,
+            "predecessor": optics.predecessor_
+        }
+
+    def labels_from_reachability(self, fit, minPts, max_eps, xi):
+        """ Extracts the clusters of the xi method from a stored OPTICS fit.
+        Since the reachability distances are never greater than max_eps, a smaller max_eps
+        is obtained by cutting the reachability plot at it: the distances above it become
+        infinite and their predecessors are dropped. This is an approximation of a fit with
+        the smaller max_eps, whose ordering may differ when the processing reaches a point
+        without neighbors within max_eps. With the same max_eps of the fit the labels are exact.
+        Returns:
+            The labels of the distinct coordinates
+        """
+        reachability = fit["reachability"]
+        predecessor = fit["predecessor"]
+        if max_eps < fit["max_eps"]:
+            cut = reachability > max_eps/Utility.getEarthRadius()
+            reachability = np.where(cut, np.inf, reachability)
+            predecessor = np.where(cut, -1, predecessor)
+        labels, _ = cluster_optics_xi(reachability=reachability, predecessor=predecessor,
+                                      ordering=fit["ordering"], min_samples=minPts, xi=xi)
+        return labels
     
     def run(self, max_eps, minPts, xi):
-        """" Performs OPTICS clustering algorithm"""
+        """" Performs OPTICS clustering algorithm. If OPTICS has already been fitted
+        with the same minPts and a large enough max_eps, the labels are derived from that fit"""
 
         # If we use OPTICS, we cannot maintain multiple accidents characterized by the *exact* 
         # couple (lat, lon)! In that case, 
         # we would obtain 0 in the computation of the reachability distance. 
         # This is one of the known issue of the OPTICS algorithm. 
-        # For this reason, to fit OPTICS I'll pass a dataframe without duplicates.
-        coords = Geoclustering.calculateRadians(self, format = 'pd')
-
-        # aggr contains a tuple of this kind
-        # lat | lon | count
-        aggr = (coords
-            .groupby(["latitude","longitude"], as_index=False)
-            .size().rename(columns={"size":"count"}))
-        np_coords = aggr[["latitude", "longitude"]].to_numpy()
-        
-        # min_samples defines the minimum density: how many neighbors are required to consider a point as a core poin
-        optics = OPTICS(min_samples=minPts, max_eps=max_eps/Utility.getEarthRadius(), metric='haversine', xi=xi)
-        optics.fit(np_coords)
-
-        aggr["label"] = optics.labels_
-        # Re-assigning the labels to the original data
-        gps_labeled = coords.merge(
-            aggr[["latitude","longitude","label","count"]],
-            on=["latitude","longitude"],
-            how="left"
-        )
+        # For this reason, to fit OPTICS I'll pass the distinct coordinates only.
+        Geoclustering.calculateUniqueCoords(self)
 
-        self.arr_Labels = gps_labeled['label'].to_numpy()
+        fit = self.reachability_fits.get(minPts)
+        if fit is not None and max_eps <= fit["max_eps"]:
+            unique_labels = self.labels_from_reachability(fit, minPts, max_eps, xi)
+        else:
+            # min_samples defines the minimum density: how many neighbors are required to consider a point as a core poin
+            X, metric = Geoclustering.get_clusteringCoords(self)
+            optics = OPTICS(min_samples=minPts, max_eps=max_eps/Utility.getEarthRadius(), metric=metric, xi=xi)
+            optics.fit(X)
+            unique_labels = optics.labels_
+        # Re-assigning the labels to the original data through the inverse indices
+        Geoclustering.set_labels(self, unique_labels[self.get_inverse()])
         
         n_clusters = Geoclustering.get_numberOfClusters(self)
         if n_clusters <= 1:
             return "No clusters"
+        quality = Geoclustering.get_quality_metrics(self)
         optics_performance = {
             'min_samples': minPts,
             'max_radius': max_eps,
             'xi': xi,
-            'core_outlier_ratio': Geoclustering.get_coreOutlierRatio(self),
+            'core_outlier_ratio': quality['core_outlier_ratio'],
             'number_of_clusters': n_clusters,
-            'davies_bouldin_index': Geoclustering.get_davies_bouldin_index(self),
-            'silouette_coefficent': Geoclustering.get_silouette_coefficent(self),
-            'calinski_index': Geoclustering.get_calinski_index(self)
+            'davies_bouldin_index': quality['davies_bouldin_index'],
+            'silouette_coefficent': quality['silouette_coefficent'],
+            'calinski_index': quality['calinski_index']
         }
         return optics_performance
     
-    def clustering_tuning(self):
+    def clustering_tuning(self, workers=1, executor="process", shared_reachability=False):
         """ Selects the best combination of parameters to use.
         Args:
             self: A reference to the current object
+            workers: Optional field. The number of workers of the parameter sweep,
+            0 to use all the CPUs
+            executor: Optional field. The kind of pool of the sweep, "process" or "thread"
+            shared_reachability: Optional field. If True OPTICS is fitted once per minPts,
+            with the largest max_eps, and all the xi and max_eps values are derived from
+            that fit (see labels_from_reachability)
         Returns:
             A dataframe containing the best 3 combination of paramters to use
         """
+        # The projection is checked against the largest max_eps of the sweep
+        if len(self.maxRadiusArr) > 0:
+            Geoclustering.enable_projection(self, max(self.maxRadiusArr))
 
-        arr_tuning_results = []
+        grid = [(max_eps, minPts, xi) for max_eps in self.maxRadiusArr
+                for minPts in self.minPtsArr
+                for xi in self.xiArr]
+        Geoclustering.start_progress(self, len(grid))
 
-        for max_eps in self.maxRadiusArr:
+        # Fitted before the sweep, so that the workers share the fits
+        if shared_reachability and len(self.maxRadiusArr) > 0:
             for minPts in self.minPtsArr:
-                for xi in self.xiArr:
-                    perf = self.run(max_eps, minPts, xi)
-                    if isinstance(perf, str) == False:
-                        arr_tuning_results.append(perf)
-        
-        if len(arr_tuning_results) == 0:
-            return -1, None
+                Geoclustering.check_cancelled(self)
+                self.fit_reachability(minPts, max(self.maxRadiusArr))
 
-        # Selecting the best performances
-        tuning_results_df = pd.DataFrame(arr_tuning_results)
-        tuning_results_df = tuning_results_df.sort_values(
-            by = ["core_outlier_ratio", "silouette_coefficent", "davies_bouldin_index", "calinski_index"],
-            ascending = [True, False, True, False]
-        )
-        df_returned = tuning_results_df.query("core_outlier_ratio > 1.4")[:3]
-        # Sometimes it may happen that it's not possible to obtain a good core_outlier_ratio
-        # In that case we inform the frontend and we return the top 3 highest metrics in terms
-        # of descending core_outlier_ratios
-        if df_returned.shape[0] < 3:
-            return 1, tuning_results_df[-3:]
-        else:
-            return 0, df_returned
\ No newline at end of file
+        results, _ = self.sweep_until(grid, workers, executor, chunk_size=len(self.xiArr))
+        arr_tuning_results = [perf for perf in results if isinstance(perf, str) == False]
+
+        return Geoclustering.rank_tuning_results(self, arr_tuning_results)
@@ -0,0 +1,102 @@
+import os
+import gc
+import time
+import signal
+import socket
+import threading
+from werkzeug.serving import make_server
+
+class PreforkServer:
+    """ Serves the Flask application with a pool of forked worker processes. The parent
+    process loads the dataset and the indexes before forking: the workers share that
+    memory copy-on-write, and each one runs its own interpreter, so the CPU-bound requests
+    don't block each other on the GIL. The workers accept the connections from a single
+    listening socket created by the parent, so the kernel routes every request to an idle
+    worker. A worker that dies is replaced. Fork is required (not available on Windows)."""
+
+    def __init__(self, app, host, port, workers=0, stop_event=None):
+        """ Creates a new instance of the class PreforkServer
+            Args:
+                app: The Flask application
+                host: The address to listen on
+                port: The port to listen on
+                workers: Optional field. The number of worker processes, 0 to use all the CPUs
+                stop_event: Optional field. A multiprocessing Event: when it's set by any
+                process, supervise returns
+        """
+        self.app = app
+        self.host = host
+        self.port = int(port)
+        self.workers = workers if workers > 0 else (os.cpu_count() or 1)
+        self.stop_event = stop_event
+        self.socket = None
+        self.pids = {}
+
+    @staticmethod
+    def is_supported():
+        return hasattr(os, "fork")
+
+    def start(self):
+        """ Opens the listening socket and forks the workers"""
+        self.socket = socket.create_server((self.host, self.port), backlog=128, reuse_port=False)
+        self.socket.set_inheritable(True)
+        # The objects allocated so far (the dataset, the indexes, ...) are never visited
+        # by the garbage collector of the workers: their pages are not copied
+        gc.freeze()
+        for index in range(self.workers):
+            self.spawn(index)
+        print(f"[INFO] Serving on {self.host}:{self.port} with {self.workers} worker processes")
+
+    def spawn(self, index):
+        pid = os.fork()
+        if pid == 0:
+            # The worker never returns to the code of the parent
+            status = 0
+            try:
+                signal.signal(signal.SIGINT, signal.SIG_IGN)
+                server = make_server(self.host, self.port, self.app, threaded=True, fd=self.socket.fileno())
+                # The requests in progress are completed before exiting (see server_close)
+                server.daemon_threads = False
+                # shutdown waits for serve_forever to return: it can't run in this thread
+                signal.signal(signal.SIGTERM,
+                              lambda signum, frame: threading.Thread(target=server.shutdown).start())
+                server.serve_forever()
+                server.server_close()
+            except Exception as e:
+                print(f"[ERR] Worker {index} stopped: {e}")
+                status = 1
+            finally:
+                os._exit(status)
+        self.pids[pid] = index
+
+    def supervise(self, poll_interval=1.0):
+        """ Replaces the workers that die, until the stop event is set"""
+        while not self.stop_event.wait(poll_interval):
+            for pid, index in list(self.pids.items()):
+                finished_pid, status = os.waitpid(pid, os.WNOHANG)
+                if finished_pid == 0:
+                    continue
+                del self.pids[pid]
+                # Negative if the worker was killed by a signal
+                exit_code = os.waitstatus_to_exitcode(status)
+                print(f"[ERR] Worker {index} (pid {pid}) exited with code {exit_code}: restarting it")
+                self.spawn(index)
+
+    def stop(self, timeout=10):
+        """ Terminates the workers, waiting up to timeout seconds for them to complete the
+        requests in progress. The workers still running after the timeout are killed"""
+        for pid in self.pids:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+        deadline = time.monotonic() + timeout
+        for pid in self.pids:
+            while os.waitpid(pid, os.WNOHANG)[0] == 0:
+                if time.monotonic() >= deadline:
+                    os.kill(pid, signal.SIGKILL)
+                    os.waitpid(pid, 0)
+                    break
+                time.sleep(0.1)
+        self.pids = {}
+        self.socket.close()
@@ -1,6 +1,5 @@
 import json
 import numpy as np
-import pandas as pd
 from sklearn.neighbors import BallTree
 
 class Utility:
@@ -41,64 +40,59 @@ class Utility:
 
         return 6371.0
     
-    def hopkins(data_frame, sampling_size):
+    def hopkins(data, sampling_size, seed=None, tree=None, in_radians=False):
         """ Adaptation of the hopkins method from pyclustend
         in which a prior conversion to radians and haversine distance
         is used
         
         Original code: https://pyclustertend.readthedocs.io/en/latest/_modules/pyclustertend/hopkins.html#hopkins
 
+        Args:
+            data: The coordinates (latitude, longitude), as a ndarray or a dataframe
+            sampling_size: The number of sampled and of simulated points
+            seed: Optional field. The seed (or a numpy Generator) of the sampling and of the
+            simulation: with the same seed the result is reproducible
+            tree: Optional field. A BallTree with the haversine metric already built on the
+            coordinates in radians of data (e.g. by the k-distance search)
+            in_radians: Optional field. True if data is already expressed in radians
+
+        Returns:
+            The hopkins statistic: a value tending to 0 expresses high clustering tendency
         """
 
-        if type(data_frame) == np.ndarray:
-            data_frame = pd.DataFrame(data_frame)
+        X = np.asarray(data, dtype=np.float64)
+        if not in_radians:
+            X = np.radians(X)
         
         # Sample n observations from D : P
-        if sampling_size > data_frame.shape[0]:
+        if sampling_size > X.shape[0]:
             raise Exception(
             'The number of sample of sample is bigger than the shape of D')
         
-        data_frame = np.radians(data_frame)
-        data_frame_sample = data_frame.sample(n=sampling_size)
+        rng = np.random.default_rng(seed)
+        sample = X[rng.choice(X.shape[0], size=sampling_size, replace=False)]
 
         # Get the distance to their neirest neighbors in D : X
+        # The tree is built once and queried both for the sampled and the simulated points
 
-        tree = BallTree(data_frame, leaf_size=2, metric='haversine')
-        dist, _ = tree.query(data_frame_sample, k=2)
-        data_frame_sample_distances_to_nearest_neighbours = dist[:, 1]
+        if tree is None:
+            tree = BallTree(X, leaf_size=40, metric='haversine')
+        dist, _ = tree.query(sample, k=2)
+        x = dist[:, 1].sum()
 
         # Randomly simulate n points with the same variation as in D : Q.
-
-        max_data_frame = data_frame.max()
-        min_data_frame = data_frame.min()
-
-        uniformly_selected_values_0 = np.random.uniform(min_data_frame[0], max_data_frame[0], sampling_size)
-        uniformly_selected_values_1 = np.random.uniform(min_data_frame[1], max_data_frame[1], sampling_size)
-
-        uniformly_selected_observations = np.column_stack((uniformly_selected_values_0, uniformly_selected_values_1))
-        if len(max_data_frame) >= 2:
-            for i in range(2, len(max_data_frame)):
-                uniformly_selected_values_i = np.random.uniform(min_data_frame[i], max_data_frame[i], sampling_size)
-                to_stack = (uniformly_selected_observations, uniformly_selected_values_i)
-                uniformly_selected_observations = np.column_stack(to_stack)
-        
-        uniformly_selected_observations_df = pd.DataFrame(uniformly_selected_observations)
-
         # Get the distance to their neirest neighbors in D : Y
 
-        tree = BallTree(data_frame, leaf_size=2, metric='haversine')
-        dist, _ = tree.query(uniformly_selected_observations_df, k=1)
-        uniformly_df_distances_to_nearest_neighbours = dist
+        uniformly_selected_observations = rng.uniform(X.min(axis=0), X.max(axis=0), size=(sampling_size, X.shape[1]))
+        dist, _ = tree.query(uniformly_selected_observations, k=1)
+        y = dist[:, 0].sum()
 
         # return the hopkins score
 
-        x = sum(data_frame_sample_distances_to_nearest_neighbours)
-        y = sum(uniformly_df_distances_to_nearest_neighbours)
-
         if x + y == 0:
             raise Exception('The denominator of the hopkins statistics is null')
         
-        return x / (x + y)[0]
+        return x / (x + y)
     
     def sample_years(self, min_y, q1, med, q3, max_y, n, weights=(0.2, 0.6, 0.2), seed=None):
         """ This function generates the column veichle_manufacturing_year for those
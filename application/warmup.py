@@ -0,0 +1,70 @@
+import time
+import threading
+
+class Warmup:
+    """ Runs the loading stages of the backend (dataset, indexes, model, ...) in a
+    background thread, keeping track of the progress and the timing of each stage.
+    The web server can be started before the warm-up ends, and report its progress."""
+
+    def __init__(self):
+        self.stages = []
+        self.lock = threading.Lock()
+        self.ready_event = threading.Event()
+        self.failed = False
+        self.thread = None
+
+    def add_stage(self, name, fn):
+        """ Appends a stage to the warm-up. The stages are executed in order of insertion
+            Args:
+                name: The name of the stage reported by status()
+                fn: A function without arguments performing the stage
+        """
+        self.stages.append({"name": name, "fn": fn, "status": "pending", "seconds": None, "error": None})
+
+    def start(self):
+        """ Starts the execution of the stages in a daemon thread"""
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def run(self):
+        """ Executes the stages one after the other. If a stage fails the following
+        ones are not executed, and the backend never becomes ready"""
+        for stage in self.stages:
+            with self.lock:
+                stage["status"] = "running"
+            start = time.perf_counter()
+            try:
+                stage["fn"]()
+            except Exception as e:
+                with self.lock:
+                    stage["status"] = "failed"
+                    stage["error"] = str(e)
+                    stage["seconds"] = time.perf_counter() - start
+                    self.failed = True
+                print(f"[ERR] Warm-up stage {stage['name']} failed: {e}")
+                return
+            with self.lock:
+                stage["status"] = "done"
+                stage["seconds"] = time.perf_counter() - start
+            print(f"[INFO] Warm-up stage {stage['name']} completed in {stage['seconds']:.2f} s")
+        self.ready_event.set()
+
+    def is_ready(self):
+        return self.ready_event.is_set()
+
+    def wait(self, timeout=None):
+        """ Blocks until all the stages are completed. Returns True if the backend is ready"""
+        return self.ready_event.wait(timeout)
+
+    def status(self):
+        """ Returns a dictionary describing the progress of the warm-up, ready to be serialized"""
+        with self.lock:
+            stages = [{"name": s["name"], "status": s["status"], "seconds": s["seconds"], "error": s["error"]}
+                      for s in self.stages]
+        done = sum(1 for s in stages if s["status"] == "done")
+        return {
+            "ready": self.is_ready(),
+            "failed": self.failed,
+            "progress": f"{done}/{len(stages)}",
+            "stages": stages
+        }
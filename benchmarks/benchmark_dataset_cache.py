@@ -0,0 +1,51 @@
+""" Compares the load time of the cleaned dataset when it's parsed from the csv
+file and when it's read from the columnar cache of DatasetLoader.
+
+Run it from the root of the project:
+    python benchmarks/benchmark_dataset_cache.py
+"""
+import os
+import sys
+import time
+import argparse
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "application"))
+from ml.configloader import ConfigLoader
+from ml.hotspotDetector.datasetLoader import DatasetLoader
+
+def best_of(fn, repeat):
+    """ Returns the best wall-clock time out of repeat executions of fn, along with its last result"""
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn()
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+parser.add_argument("--config", default=os.path.join("application", "config.json"))
+parser.add_argument("--repeat", type=int, default=3)
+args = parser.parse_args()
+
+configloader = ConfigLoader(args.config)
+datasetloader = DatasetLoader(full_dataset_path=configloader.getFullDataset(),
+                    clean_dataset_path=configloader.getCleanDataset())
+if not os.path.exists(configloader.getCleanDataset()):
+    print("The cleaned dataset doesn't exist yet. Start the application once to produce it.")
+    sys.exit(1)
+
+# The first call makes sure that the cache exists and is up to date
+datasetloader.load_cached_dataset()
+
+csv_time, csv_df = best_of(lambda: pd.read_csv(configloader.getCleanDataset()), args.repeat)
+fingerprint_time, _ = best_of(datasetloader.fingerprint, args.repeat)
+cache_time, cache_df = best_of(datasetloader.load_cached_dataset, args.repeat)
+
+pd.testing.assert_frame_equal(csv_df, cache_df)
+
+print(f"Rows: {len(csv_df)}")
+print(f"pd.read_csv:              {csv_time:.3f} s")
+print(f"cache (fingerprint only): {fingerprint_time:.3f} s")
+print(f"cache (total):            {cache_time:.3f} s")
+print(f"Speedup:                  {csv_time / cache_time:.1f}x")
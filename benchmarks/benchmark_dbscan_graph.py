@@ -0,0 +1,104 @@
+""" Compares the time of the DBSCAN parameter sweep of CityClustering when every run
+searches the neighbors from scratch and when all the runs share the neighbors graph
+precomputed for the largest Eps of the grid. The labels of the two sweeps must match.
+
+Run it from the root of the project:
+    python benchmarks/benchmark_dbscan_graph.py --cities BRASILIA CURITIBA
+"""
+import os
+import sys
+import time
+import argparse
+import contextlib
+import io
+import numpy as np
+import pandas as pd
+from sklearn.cluster import DBSCAN
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "application"))
+from ml.configloader import ConfigLoader
+from ml.hotspotDetector.datasetLoader import DatasetLoader
+from ml.hotspotDetector.preprocessing import Preprocessing
+from ml.hotspotDetector.partitionIndex import PartitionIndex
+from ml.hotspotDetector.cityClustering import CityClustering
+from utility import Utility
+
+parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+parser.add_argument("--config", default=os.path.join("application", "config.json"))
+parser.add_argument("--cities", nargs="+", default=["BRASILIA", "CURITIBA"])
+parser.add_argument("--cause", default=None, help="general cause of accident (default: the most frequent one of each city)")
+parser.add_argument("--full", action="store_true", help="also time the whole sweep, quality metrics included")
+args = parser.parse_args()
+
+configloader = ConfigLoader(args.config)
+datasetloader = DatasetLoader(full_dataset_path=configloader.getFullDataset(),
+                    clean_dataset_path=configloader.getCleanDataset())
+cleaned_df = datasetloader.loadDataset()
+if cleaned_df is None:
+    sys.exit(1)
+preprocessing = Preprocessing(cleaned_df)
+preprocessing.drop_columns(cols_to_keep=["latitude", "longitude", "cause_of_accident", "road_id", "km", "city", "state", "victims_condition"])
+preprocessing.map_general_causes()
+with contextlib.redirect_stdout(io.StringIO()):
+    preprocessing.compact_dataframe()
+df = preprocessing.getDataframe()
+partitionIndex = PartitionIndex(df)
+
+def fits(cityClustering, eps_to_test, precomputed_graph):
+    """ Runs only the DBSCAN fits of the grid. Returns the elapsed time and the labels of every fit"""
+    start = time.perf_counter()
+    if precomputed_graph:
+        cityClustering.build_neighbors_graph(max(eps_to_test))
+    labels = []
+    for eps in eps_to_test:
+        for minPts in cityClustering.minPtsArr:
+            eps_rad = eps / Utility.getEarthRadius()
+            if precomputed_graph:
+                dbscan = DBSCAN(eps=eps_rad, min_samples=minPts, metric="precomputed").fit(cityClustering.get_neighbors_graph(eps))
+            else:
+                dbscan = DBSCAN(eps=eps_rad, min_samples=minPts, metric="haversine").fit(cityClustering.get_arrRadians())
+            labels.append(dbscan.labels_)
+    return time.perf_counter() - start, labels
+
+def sweep(cityClustering, precomputed_graph):
+    """ Runs the whole parameter sweep (fits and quality metrics)"""
+    cityClustering.neighbors_graph = None
+    start = time.perf_counter()
+    result = cityClustering.clustering_tuning(precomputed_graph=precomputed_graph)
+    return time.perf_counter() - start, result
+
+for city in args.cities:
+    causes = partitionIndex.getGeneralCausesCity(city)
+    if len(causes) == 0:
+        print(f"{city}: not found")
+        continue
+    cause = args.cause or max(causes, key=lambda c: len(partitionIndex.getCityRows(city, c)))
+    cityClustering = CityClustering(df, city, cause,
+                        configloader.getKDistGraph(),
+                        configloader.get_dbscanMinEps(),
+                        configloader.get_dbscanStepEps(),
+                        configloader.get_dbscanMinPtsArr(),
+                        partitionIndex)
+    cityClustering.knee_heurstic_search()
+    eps_to_test = list(np.arange(cityClustering.minEps, cityClustering.maxEps, cityClustering.stepEps))
+
+    search_time, search_labels = fits(cityClustering, eps_to_test, False)
+    graph_time, graph_labels = fits(cityClustering, eps_to_test, True)
+    for search, graph in zip(search_labels, graph_labels):
+        np.testing.assert_array_equal(search, graph)
+
+    print(f"{city} - {cause}: {len(cityClustering.get_arrRadians())} accidents, "
+          f"{len(eps_to_test) * len(cityClustering.minPtsArr)} runs, max Eps {max(eps_to_test):.2f} km, "
+          f"{cityClustering.neighbors_graph.nnz} graph edges")
+    print(f"  DBSCAN fits, neighbors search per run: {search_time:.3f} s")
+    print(f"  DBSCAN fits, precomputed graph:        {graph_time:.3f} s")
+    print(f"  speedup:                               {search_time / graph_time:.1f}x")
+
+    if args.full:
+        search_time, (search_sts, search_perf) = sweep(cityClustering, False)
+        graph_time, (graph_sts, graph_perf) = sweep(cityClustering, True)
+        assert search_sts == graph_sts
+        if search_perf is not None:
+            pd.testing.assert_frame_equal(search_perf, graph_perf)
+        print(f"  whole sweep, neighbors search per run: {search_time:.3f} s")
+        print(f"  whole sweep, precomputed graph:        {graph_time:.3f} s")
@@ -0,0 +1,93 @@
+""" Compares the adaptive coarse-to-fine search of the Eps of DBSCAN with the exhaustive
+sweep of the grid from dbscan_minEps to the knee in dbscan_stepEps steps, as run by
+/clustering. For every partition it reports the time of both searches, the number of Eps
+tested by the adaptive one and whether the top 3 combinations are the same. It exits with
+status 1 if the top 3 of any partition differ: the adaptive search (dbscan_search
+"adaptive" in the config file) should be enabled only on datasets where it succeeds.
+
+Run it from the root of the project:
+    python benchmarks/benchmark_eps_search.py --cities BRASILIA CURITIBA
+"""
+import os
+import sys
+import time
+import argparse
+import contextlib
+import io
+import warnings
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "application"))
+from ml.configloader import ConfigLoader
+from ml.hotspotDetector.datasetLoader import DatasetLoader
+from ml.hotspotDetector.preprocessing import Preprocessing
+from ml.hotspotDetector.partitionIndex import PartitionIndex
+from ml.hotspotDetector.cityClustering import CityClustering
+
+parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+parser.add_argument("--config", default=os.path.join("application", "config.json"))
+parser.add_argument("--cities", nargs="+", default=["BRASILIA"])
+parser.add_argument("--cause", default=None, help="general cause of accident (default: all the causes of each city)")
+parser.add_argument("--coarse-step", type=int, default=None, help="step of the coarse pass (default: dbscan_coarse_step of the config file)")
+args = parser.parse_args()
+
+configloader = ConfigLoader(args.config)
+coarse_step = args.coarse_step if args.coarse_step is not None else configloader.get_dbscanCoarseStep()
+datasetloader = DatasetLoader(full_dataset_path=configloader.getFullDataset(),
+                    clean_dataset_path=configloader.getCleanDataset())
+cleaned_df = datasetloader.loadDataset()
+if cleaned_df is None:
+    sys.exit(1)
+preprocessing = Preprocessing(cleaned_df)
+preprocessing.drop_columns(cols_to_keep=["latitude", "longitude", "cause_of_accident", "road_id", "km", "city", "state", "victims_condition"])
+preprocessing.map_general_causes()
+with contextlib.redirect_stdout(io.StringIO()):
+    preprocessing.compact_dataframe()
+df = preprocessing.getDataframe()
+partitionIndex = PartitionIndex(df)
+warnings.filterwarnings("ignore")
+
+def tune(city, cause, search):
+    """ Returns the elapsed time, the result of the tuning and its log"""
+    cityClustering = CityClustering(df, city, cause, configloader.getKDistGraph(), configloader.get_dbscanMinEps(),
+                        configloader.get_dbscanStepEps(), configloader.get_dbscanMinPtsArr(), partitionIndex)
+    with contextlib.redirect_stdout(io.StringIO()) as log:
+        cityClustering.knee_heurstic_search()
+        start = time.perf_counter()
+        result = cityClustering.clustering_tuning(1, configloader.get_tuningExecutor(),
+                                                  configloader.get_dbscanPrecomputedGraph(),
+                                                  configloader.get_dbscanGraphMaxEdges(),
+                                                  search, coarse_step)
+    return time.perf_counter() - start, result, log.getvalue()
+
+def same_result(a, b):
+    (sts_a, df_a), (sts_b, df_b) = a, b
+    if sts_a != sts_b or (df_a is None) != (df_b is None):
+        return False
+    return df_a is None or df_a.reset_index(drop=True).equals(df_b.reset_index(drop=True))
+
+total = {"exhaustive": 0.0, "adaptive": 0.0}
+different = []
+for city in args.cities:
+    causes = [args.cause] if args.cause else partitionIndex.getGeneralCausesCity(city)
+    if len(causes) == 0:
+        print(f"{city}: not found")
+        continue
+    for cause in causes:
+        exhaustive_time, exhaustive_result, _ = tune(city, cause, "exhaustive")
+        adaptive_time, adaptive_result, log = tune(city, cause, "adaptive")
+        total["exhaustive"] += exhaustive_time
+        total["adaptive"] += adaptive_time
+        tested = [line for line in log.splitlines() if line.startswith("[INFO] Adaptive search")]
+        print(f"{city} - {cause}: {len(partitionIndex.getCityRows(city, cause))} accidents")
+        print(f"  exhaustive: {exhaustive_time:8.2f} s")
+        print(f"  adaptive:   {adaptive_time:8.2f} s  {tested[0][len('[INFO] Adaptive search: '):] if tested else ''}")
+        identical = same_result(exhaustive_result, adaptive_result)
+        print(f"  top 3 {'identical' if identical else 'DIFFERENT'}")
+        if not identical:
+            different.append(f"{city} - {cause}")
+if total["adaptive"] > 0:
+    print(f"Total: exhaustive {total['exhaustive']:.1f} s, adaptive {total['adaptive']:.1f} s, "
+          f"speedup {total['exhaustive'] / total['adaptive']:.1f}x")
+if len(different) > 0:
+    print(f"[ERR] Top 3 of the adaptive search different from the exhaustive one: {', '.join(different)}")
+    sys.exit(1)
@@ -0,0 +1,94 @@
+""" Compares the single fit of HDBSCAN with the parameter sweeps of DBSCAN (cities) and
+OPTICS (states), as run by /clustering: Hopkins statistic, sweep and final fit. For every
+partition it reports the time of each engine, the quality indices of its result and the
+adjusted Rand index between the two labellings.
+
+Run it from the root of the project:
+    python benchmarks/benchmark_hdbscan.py --cities BRASILIA --states PR
+"""
+import os
+import sys
+import time
+import argparse
+import contextlib
+import io
+import warnings
+import numpy as np
+import pandas as pd
+from sklearn.metrics import adjusted_rand_score
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "application"))
+from ml.configloader import ConfigLoader
+from ml.hotspotDetector.datasetLoader import DatasetLoader
+from ml.hotspotDetector.preprocessing import Preprocessing
+from ml.hotspotDetector.partitionIndex import PartitionIndex
+from ml.hotspotDetector.clusteringService import ClusteringService
+
+parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+parser.add_argument("--config", default=os.path.join("application", "config.json"))
+parser.add_argument("--cities", nargs="+", default=["BRASILIA"])
+parser.add_argument("--states", nargs="+", default=["PR"])
+parser.add_argument("--cause", default=None, help="general cause of accident (default: the most frequent one of each partition)")
+args = parser.parse_args()
+
+configloader = ConfigLoader(args.config)
+datasetloader = DatasetLoader(full_dataset_path=configloader.getFullDataset(),
+                    clean_dataset_path=configloader.getCleanDataset())
+cleaned_df = datasetloader.loadDataset()
+if cleaned_df is None:
+    sys.exit(1)
+preprocessing = Preprocessing(cleaned_df)
+preprocessing.drop_columns(cols_to_keep=["latitude", "longitude", "cause_of_accident", "road_id", "km", "city", "state", "victims_condition"])
+preprocessing.map_general_causes()
+with contextlib.redirect_stdout(io.StringIO()):
+    preprocessing.compact_dataframe()
+df = preprocessing.getDataframe()
+partitionIndex = PartitionIndex(df)
+clusteringService = ClusteringService(configloader)
+# OPTICS warns about duplicated points with infinite reachability
+warnings.filterwarnings("ignore")
+
+def cluster(algorithm, granularity, name, cause):
+    """ Returns the elapsed time and the response of /clustering"""
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        response = clusteringService.cluster(df, partitionIndex, None, algorithm, name, cause, granularity)
+    return time.perf_counter() - start, response
+
+def labels_of(response, rows):
+    """ Returns the label of every accident of the partition, -1 for the outliers"""
+    labels = pd.Series(-1, index=df.index[rows])
+    if response["sts"] != -1:
+        labelled = pd.read_json(io.StringIO(response["dfLabelled"]))
+        labels[labelled.index] = labelled["label"]
+    return labels.to_numpy()
+
+def describe(elapsed, response):
+    if response["sts"] == -1:
+        return f"{elapsed:8.2f} s  no clusters"
+    best = pd.read_json(io.StringIO(response["clusteringPerf"])).iloc[0]
+    return (f"{elapsed:8.2f} s  {int(best['number_of_clusters']):4d} clusters, core/outlier {best['core_outlier_ratio']:.2f}, "
+            f"silhouette {best['silouette_coefficent']:.3f}, Davies-Bouldin {best['davies_bouldin_index']:.3f}")
+
+partitions = [("DBSCAN", "city", city) for city in args.cities] + [("OPTICS", "state", state) for state in args.states]
+for algorithm, granularity, name in partitions:
+    if granularity == "city":
+        causes = partitionIndex.getGeneralCausesCity(name)
+        rows_of = partitionIndex.getCityRows
+    else:
+        causes = partitionIndex.getGeneralCausesState(name)
+        rows_of = partitionIndex.getStateRows
+    if len(causes) == 0:
+        print(f"{name}: not found")
+        continue
+    cause = args.cause or max(causes, key=lambda c: len(rows_of(name, c)))
+    rows = rows_of(name, cause)
+
+    sweep_time, sweep_response = cluster(algorithm, granularity, name, cause)
+    hdbscan_time, hdbscan_response = cluster("HDBSCAN", granularity, name, cause)
+
+    print(f"{name} - {cause}: {len(rows)} accidents")
+    print(f"  {algorithm + ' sweep:':14s}{describe(sweep_time, sweep_response)}")
+    print(f"  {'HDBSCAN fit:':14s}{describe(hdbscan_time, hdbscan_response)}")
+    print(f"  speedup: {sweep_time / hdbscan_time:.1f}x, adjusted Rand index "
+          f"{adjusted_rand_score(labels_of(sweep_response, rows), labels_of(hdbscan_response, rows)):.3f}")
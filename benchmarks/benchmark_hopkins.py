@@ -0,0 +1,99 @@
+""" Compares the previous implementation of the Hopkins statistic (two BallTrees with
+leaf_size=2 per call, pandas sampling, unseeded) with Utility.hopkins (one tree with a
+larger leaf size, NumPy arrays, seeded) and with Utility.hopkins reusing the tree already
+built by the k-distance search.
+
+Run it from the root of the project:
+    python benchmarks/benchmark_hopkins.py --cities BRASILIA CURITIBA
+"""
+import os
+import sys
+import time
+import argparse
+import contextlib
+import io
+import numpy as np
+import pandas as pd
+from sklearn.neighbors import BallTree
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "application"))
+from ml.configloader import ConfigLoader
+from ml.hotspotDetector.datasetLoader import DatasetLoader
+from ml.hotspotDetector.preprocessing import Preprocessing
+from ml.hotspotDetector.partitionIndex import PartitionIndex
+from ml.hotspotDetector.cityClustering import CityClustering
+from utility import Utility
+
+parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+parser.add_argument("--config", default=os.path.join("application", "config.json"))
+parser.add_argument("--cities", nargs="+", default=["BRASILIA", "CURITIBA"])
+parser.add_argument("--cause", default=None, help="general cause of accident (default: the most frequent one of each city)")
+parser.add_argument("--repeat", type=int, default=20, help="number of calls timed for each implementation")
+args = parser.parse_args()
+
+def previous_hopkins(data_frame, sampling_size):
+    """ The previous implementation of Utility.hopkins"""
+    data_frame = np.radians(pd.DataFrame(data_frame))
+    data_frame_sample = data_frame.sample(n=sampling_size)
+    tree = BallTree(data_frame, leaf_size=2, metric='haversine')
+    dist, _ = tree.query(data_frame_sample, k=2)
+    x = sum(dist[:, 1])
+    max_data_frame = data_frame.max()
+    min_data_frame = data_frame.min()
+    uniformly_selected_observations = np.column_stack((
+        np.random.uniform(min_data_frame[0], max_data_frame[0], sampling_size),
+        np.random.uniform(min_data_frame[1], max_data_frame[1], sampling_size)))
+    tree = BallTree(data_frame, leaf_size=2, metric='haversine')
+    dist, _ = tree.query(pd.DataFrame(uniformly_selected_observations), k=1)
+    y = sum(dist)
+    return x / (x + y)[0]
+
+def timed(function, repeat):
+    """ Returns the mean time of a call and the results of the calls"""
+    start = time.perf_counter()
+    results = [function(i) for i in range(repeat)]
+    return (time.perf_counter() - start) / repeat, np.array(results)
+
+configloader = ConfigLoader(args.config)
+datasetloader = DatasetLoader(full_dataset_path=configloader.getFullDataset(),
+                    clean_dataset_path=configloader.getCleanDataset())
+cleaned_df = datasetloader.loadDataset()
+if cleaned_df is None:
+    sys.exit(1)
+preprocessing = Preprocessing(cleaned_df)
+preprocessing.drop_columns(cols_to_keep=["latitude", "longitude", "cause_of_accident", "road_id", "km", "city", "state", "victims_condition"])
+preprocessing.map_general_causes()
+with contextlib.redirect_stdout(io.StringIO()):
+    preprocessing.compact_dataframe()
+df = preprocessing.getDataframe()
+partitionIndex = PartitionIndex(df)
+
+for city in args.cities:
+    causes = partitionIndex.getGeneralCausesCity(city)
+    if len(causes) == 0:
+        print(f"{city}: not found")
+        continue
+    cause = args.cause or max(causes, key=lambda c: len(partitionIndex.getCityRows(city, c)))
+    cityClustering = CityClustering(df, city, cause,
+                        configloader.getKDistGraph(),
+                        configloader.get_dbscanMinEps(),
+                        configloader.get_dbscanStepEps(),
+                        configloader.get_dbscanMinPtsArr(),
+                        partitionIndex)
+    coords = cityClustering.get_dfCoordsGPS().to_numpy()
+    n_samples = min(50, len(coords))
+    # The k-distance search builds the tree that getHopkins reuses
+    cityClustering.knee_heurstic_search()
+    tree = cityClustering.get_spatialTree()
+
+    previous_time, previous = timed(lambda i: previous_hopkins(coords, n_samples), args.repeat)
+    new_time, new = timed(lambda i: Utility.hopkins(coords, n_samples, seed=i), args.repeat)
+    reuse_time, reuse = timed(lambda i: Utility.hopkins(cityClustering.get_arrRadians(), n_samples, seed=i,
+                                                        tree=tree, in_radians=True), args.repeat)
+    seeded = Utility.hopkins(coords, n_samples, seed=0) == Utility.hopkins(coords, n_samples, seed=0)
+
+    print(f"{city} - {cause}: {len(coords)} accidents, {n_samples} samples")
+    print(f"  previous:            {previous_time*1000:8.2f} ms  H = {previous.mean():.4f} +- {previous.std():.4f}")
+    print(f"  one tree:            {new_time*1000:8.2f} ms  H = {new.mean():.4f} +- {new.std():.4f}")
+    print(f"  k-distance tree:     {reuse_time*1000:8.2f} ms  H = {reuse.mean():.4f} +- {reuse.std():.4f}")
+    print(f"  same seed, same H:   {seeded}")
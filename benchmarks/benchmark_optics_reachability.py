@@ -0,0 +1,85 @@
+""" Compares the OPTICS parameter sweep of StateClustering when OPTICS is fitted for every
+(max_eps, minPts, xi) combination and when it's fitted once per minPts, deriving the other
+combinations from the stored reachability. For every combination it reports whether the
+labels are identical and, when they aren't, their adjusted Rand index.
+
+Run it from the root of the project:
+    python benchmarks/benchmark_optics_reachability.py --states DF PR
+"""
+import os
+import sys
+import time
+import argparse
+import contextlib
+import io
+import warnings
+import numpy as np
+from sklearn.metrics import adjusted_rand_score
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "application"))
+from ml.configloader import ConfigLoader
+from ml.hotspotDetector.datasetLoader import DatasetLoader
+from ml.hotspotDetector.preprocessing import Preprocessing
+from ml.hotspotDetector.partitionIndex import PartitionIndex
+from ml.hotspotDetector.stateClustering import StateClustering
+
+parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+parser.add_argument("--config", default=os.path.join("application", "config.json"))
+parser.add_argument("--states", nargs="+", default=["DF", "PR"])
+parser.add_argument("--cause", default=None, help="general cause of accident (default: the most frequent one of each state)")
+args = parser.parse_args()
+
+configloader = ConfigLoader(args.config)
+datasetloader = DatasetLoader(full_dataset_path=configloader.getFullDataset(),
+                    clean_dataset_path=configloader.getCleanDataset())
+cleaned_df = datasetloader.loadDataset()
+if cleaned_df is None:
+    sys.exit(1)
+preprocessing = Preprocessing(cleaned_df)
+preprocessing.drop_columns(cols_to_keep=["latitude", "longitude", "cause_of_accident", "road_id", "km", "city", "state", "victims_condition"])
+preprocessing.map_general_causes()
+with contextlib.redirect_stdout(io.StringIO()):
+    preprocessing.compact_dataframe()
+df = preprocessing.getDataframe()
+partitionIndex = PartitionIndex(df)
+# OPTICS warns about duplicated points with infinite reachability
+warnings.filterwarnings("ignore")
+
+def labels_of_grid(stateClustering, shared_reachability):
+    """ Returns the elapsed time and the labels of every combination of the grid"""
+    start = time.perf_counter()
+    if shared_reachability:
+        for minPts in stateClustering.minPtsArr:
+            stateClustering.fit_reachability(minPts, max(stateClustering.maxRadiusArr))
+    labels = {}
+    for max_eps in stateClustering.maxRadiusArr:
+        for minPts in stateClustering.minPtsArr:
+            for xi in stateClustering.xiArr:
+                stateClustering.run(max_eps, minPts, xi)
+                labels[(max_eps, minPts, xi)] = stateClustering.arr_Labels.copy()
+    return time.perf_counter() - start, labels
+
+for state in args.states:
+    causes = partitionIndex.getGeneralCausesState(state)
+    if len(causes) == 0:
+        print(f"{state}: not found")
+        continue
+    cause = args.cause or max(causes, key=lambda c: len(partitionIndex.getStateRows(state, c)))
+    stateClustering = StateClustering(df, state, cause,
+                        configloader.get_opticsMaxRadiusArr(),
+                        configloader.get_opticsMinPtsArr(),
+                        configloader.get_opticsXiArr(),
+                        partitionIndex)
+
+    refit_time, refit_labels = labels_of_grid(stateClustering, False)
+    shared_time, shared_labels = labels_of_grid(stateClustering, True)
+
+    print(f"{state} - {cause}: {len(partitionIndex.getStateRows(state, cause))} accidents, {len(refit_labels)} combinations")
+    print(f"  one fit per combination: {refit_time:.3f} s")
+    print(f"  one fit per minPts:      {shared_time:.3f} s")
+    print(f"  speedup:                 {refit_time / shared_time:.1f}x")
+    for params, labels in refit_labels.items():
+        if np.array_equal(labels, shared_labels[params]):
+            continue
+        print(f"  max_eps={params[0]}, minPts={params[1]}, xi={params[2]}: "
+              f"labels differ, adjusted Rand index {adjusted_rand_score(labels, shared_labels[params]):.4f}")
@@ -0,0 +1,108 @@
+""" Compares the projected mode of the clustering (azimuthal equidistant projection of
+the partition, Euclidean KD-tree) with the haversine distance, as run by /clustering:
+parameter sweep and final fit of DBSCAN (cities) and OPTICS (states). For every partition
+it reports the time of both modes, the bound of the error of the projection (or the
+fallback to haversine) and the adjusted Rand index between the two labellings.
+
+Run it from the root of the project:
+    python benchmarks/benchmark_projection.py --cities BRASILIA --states PR
+"""
+import os
+import sys
+import time
+import argparse
+import contextlib
+import io
+import warnings
+import numpy as np
+from sklearn.metrics import adjusted_rand_score
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "application"))
+from ml.configloader import ConfigLoader
+from ml.hotspotDetector.datasetLoader import DatasetLoader
+from ml.hotspotDetector.preprocessing import Preprocessing
+from ml.hotspotDetector.partitionIndex import PartitionIndex
+from ml.hotspotDetector.cityClustering import CityClustering
+from ml.hotspotDetector.stateClustering import StateClustering
+
+parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+parser.add_argument("--config", default=os.path.join("application", "config.json"))
+parser.add_argument("--cities", nargs="+", default=["BRASILIA"])
+parser.add_argument("--states", nargs="+", default=["PR"])
+parser.add_argument("--cause", default=None, help="general cause of accident (default: the most frequent one of each partition)")
+parser.add_argument("--max-error", type=float, default=None, help="allowed error of the projection in metres (default: the one of the config file)")
+args = parser.parse_args()
+
+configloader = ConfigLoader(args.config)
+max_error_m = args.max_error if args.max_error is not None else configloader.get_projectionMaxErrorM()
+datasetloader = DatasetLoader(full_dataset_path=configloader.getFullDataset(),
+                    clean_dataset_path=configloader.getCleanDataset())
+cleaned_df = datasetloader.loadDataset()
+if cleaned_df is None:
+    sys.exit(1)
+preprocessing = Preprocessing(cleaned_df)
+preprocessing.drop_columns(cols_to_keep=["latitude", "longitude", "cause_of_accident", "road_id", "km", "city", "state", "victims_condition"])
+preprocessing.map_general_causes()
+with contextlib.redirect_stdout(io.StringIO()):
+    preprocessing.compact_dataframe()
+df = preprocessing.getDataframe()
+partitionIndex = PartitionIndex(df)
+# OPTICS warns about duplicated points with infinite reachability
+warnings.filterwarnings("ignore")
+
+def cluster(granularity, name, cause, max_error):
+    """ Returns the elapsed time, the labels and the projection of the sweep and final fit"""
+    if granularity == "city":
+        clustering = CityClustering(df, name, cause, configloader.getKDistGraph(), configloader.get_dbscanMinEps(),
+                        configloader.get_dbscanStepEps(), configloader.get_dbscanMinPtsArr(), partitionIndex)
+    else:
+        clustering = StateClustering(df, name, cause, configloader.get_opticsMaxRadiusArr(),
+                        configloader.get_opticsMinPtsArr(), configloader.get_opticsXiArr(), partitionIndex)
+    clustering.set_projection(max_error)
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        if granularity == "city":
+            clustering.knee_heurstic_search()
+            sts, perf = clustering.clustering_tuning(1, configloader.get_tuningExecutor(),
+                                                     configloader.get_dbscanPrecomputedGraph(),
+                                                     configloader.get_dbscanGraphMaxEdges())
+            if sts != -1:
+                clustering.run(eps_km=perf.iloc[0, 0], minPts=perf.iloc[0, 1])
+        else:
+            sts, perf = clustering.clustering_tuning(1, configloader.get_tuningExecutor(),
+                                                     configloader.get_opticsSharedReachability())
+            if sts != -1:
+                clustering.run(minPts=perf.iloc[0, 0], max_eps=perf.iloc[0, 1], xi=perf.iloc[0, 2])
+    elapsed = time.perf_counter() - start
+    labels = clustering.arr_Labels if sts != -1 else None
+    return elapsed, labels, clustering.projection
+
+partitions = [("city", city) for city in args.cities] + [("state", state) for state in args.states]
+for granularity, name in partitions:
+    if granularity == "city":
+        causes = partitionIndex.getGeneralCausesCity(name)
+        rows_of = partitionIndex.getCityRows
+    else:
+        causes = partitionIndex.getGeneralCausesState(name)
+        rows_of = partitionIndex.getStateRows
+    if len(causes) == 0:
+        print(f"{name}: not found")
+        continue
+    cause = args.cause or max(causes, key=lambda c: len(rows_of(name, c)))
+
+    haversine_time, haversine_labels, _ = cluster(granularity, name, cause, None)
+    projected_time, projected_labels, projection = cluster(granularity, name, cause, max_error_m)
+
+    print(f"{name} - {cause}: {len(rows_of(name, cause))} accidents")
+    print(f"  haversine: {haversine_time:8.2f} s")
+    if projection is None:
+        print(f"  projected: {projected_time:8.2f} s  error above {max_error_m} m, fallback to haversine")
+        continue
+    print(f"  projected: {projected_time:8.2f} s  error up to {projection['error_m']:.3f} m")
+    if haversine_labels is None or projected_labels is None:
+        print(f"  speedup: {haversine_time / projected_time:.1f}x, no clusters found by "
+              f"{'both modes' if haversine_labels is None and projected_labels is None else 'one mode'}")
+    else:
+        print(f"  speedup: {haversine_time / projected_time:.1f}x, adjusted Rand index "
+              f"{adjusted_rand_score(haversine_labels, projected_labels):.5f}, "
+              f"{int(np.sum(haversine_labels != projected_labels))} labels differ")
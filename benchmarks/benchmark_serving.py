@@ -0,0 +1,107 @@
+""" Measures the throughput of a running backend under concurrent clients, to compare the
+serving modes (serving_mode "thread" or "prefork" in the config file). Every client sends
+/clustering requests on the partitions of the dataset and /classify requests with batches
+of the test set, in the given proportion, one after the other. At the end it reports the
+requests per second and the latency percentiles of each route.
+
+The clustering results must not be cached by the backend (result_cache_entries 0 and no
+result_cache_dir), otherwise only the first request of every partition is measured.
+
+Start the backend, then run it from the root of the project:
+    python benchmarks/benchmark_serving.py --url http://127.0.0.1:5000 --test-set test.csv --clients 4
+"""
+import time
+import random
+import argparse
+import threading
+import numpy as np
+import pandas as pd
+import requests
+
+parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+parser.add_argument("--url", default="http://127.0.0.1:5000")
+parser.add_argument("--clients", type=int, default=4, help="number of concurrent clients")
+parser.add_argument("--duration", type=float, default=60, help="seconds of the measure")
+parser.add_argument("--classify-ratio", type=float, default=0.5, help="fraction of /classify requests (0 to 1)")
+parser.add_argument("--test-set", default=None, help="CSV with the features of the model (no /classify requests if not given)")
+parser.add_argument("--batch", type=int, default=100, help="rows of the test set sent by every /classify request")
+parser.add_argument("--algorithm", default="DBSCAN", choices=["DBSCAN", "OPTICS", "HDBSCAN"])
+parser.add_argument("--max-partitions", type=int, default=20, help="partitions requested to /clustering")
+parser.add_argument("--seed", type=int, default=0)
+args = parser.parse_args()
+
+def get_partitions():
+    """ Returns the payloads of the /clustering requests: the (city or state, cause) partitions"""
+    granularity, route = ("state", "states") if args.algorithm == "OPTICS" else ("city", "cities")
+    names = requests.get(f"{args.url}/{route}", timeout=30).json()[f"{route}_list"]
+    payloads = []
+    for name in names:
+        causes = requests.get(f"{args.url}/general_cause_of_accident?{granularity}={name}", timeout=30).json()["causes_list"]
+        for cause in causes:
+            payload = {"algorithm": args.algorithm, "city": "", "state": "", "cause": cause}
+            payload[granularity] = name
+            payloads.append(payload)
+    random.Random(args.seed).shuffle(payloads)
+    return payloads[:args.max_partitions]
+
+def get_batches():
+    """ Returns the payloads of the /classify requests: batches of the test set, restricted
+    to the features selected by the model"""
+    if args.test_set is None or args.classify_ratio <= 0:
+        return []
+    features = requests.get(f"{args.url}/selected_features", timeout=30).json()["selected_features"]
+    test_df = pd.read_csv(args.test_set)[features]
+    return [{"X_test_fs": test_df.iloc[start:start + args.batch].to_json()}
+            for start in range(0, len(test_df), args.batch)]
+
+partitions = get_partitions()
+batches = get_batches()
+classify_ratio = args.classify_ratio if batches else 0.0
+if len(partitions) == 0 and classify_ratio < 1:
+    raise SystemExit("No partition found")
+
+# route -> list of (latency in seconds, success)
+samples = {"/clustering": [], "/classify": []}
+samples_lock = threading.Lock()
+deadline = time.monotonic() + args.duration
+
+def client(index):
+    rng = random.Random(args.seed + index)
+    session = requests.Session()
+    while time.monotonic() < deadline:
+        if rng.random() < classify_ratio:
+            route, payload = "/classify", rng.choice(batches)
+        else:
+            route, payload = "/clustering", rng.choice(partitions)
+        start = time.perf_counter()
+        try:
+            ok = session.post(args.url + route, json=payload, timeout=600).status_code == 200
+        except requests.exceptions.RequestException:
+            ok = False
+        latency = time.perf_counter() - start
+        with samples_lock:
+            samples[route].append((latency, ok))
+
+start = time.monotonic()
+clients = [threading.Thread(target=client, args=(index,)) for index in range(args.clients)]
+for thread in clients:
+    thread.start()
+for thread in clients:
+    thread.join()
+# The requests in progress at the deadline are completed: they're part of the measure
+elapsed = time.monotonic() - start
+
+print(f"{args.clients} clients, {elapsed:.1f} s, {len(partitions)} partitions, {len(batches)} batches of {args.batch} rows")
+total = 0
+for route, route_samples in samples.items():
+    if len(route_samples) == 0:
+        continue
+    latencies = np.array([latency for latency, ok in route_samples if ok])
+    errors = sum(1 for _, ok in route_samples if not ok)
+    total += len(latencies)
+    line = f"  {route:12} {len(latencies):5d} ok, {errors} errors, {len(latencies) / elapsed:7.2f} req/s"
+    if len(latencies) > 0:
+        p50, p90, p99 = np.percentile(latencies, [50, 90, 99])
+        line += f", latency p50 {p50:.3f} s, p90 {p90:.3f} s, p99 {p99:.3f} s, max {latencies.max():.3f} s"
+    print(line)
+print(f"  {'total':12} {total / elapsed:7.2f} req/s")
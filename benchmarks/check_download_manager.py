@@ -0,0 +1,138 @@
+""" Checks the DownloadManager of download_dataset.py against a local HTTP server standing in
+for the hosts of the .env file. The server supports Range requests, like the real hosts.
+The scenarios:
+    resume: an interrupted download (.part file holding the first half of the archive)
+    is resumed with a Range request, verified against its checksum and extracted
+    corrupt: an archive failing the CRC check is discarded after every attempt, and the
+    last failed attempt doesn't wait before giving up
+    checksum: an archive whose SHA-256 differs from the expected one isn't extracted
+It exits with status 1 if any scenario fails.
+
+Run it from the root of the project:
+    python benchmarks/check_download_manager.py
+"""
+import os
+import io
+import sys
+import json
+import time
+import hashlib
+import zipfile
+import tempfile
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+from download_dataset import DownloadManager
+
+FILES = {"acidentes2017.csv": b"id;data_inversa\n" + b"".join(f"{i};2017-01-01\n".encode() for i in range(20000)),
+         "acidentes2018.csv": b"id;data_inversa\n" + b"".join(f"{i};2018-01-01\n".encode() for i in range(20000))}
+
+def make_zip(files):
+    """ Returns the bytes of a zip archive of files, stored without compression"""
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, "w", zipfile.ZIP_STORED) as zip_ref:
+        for name, content in files.items():
+            zip_ref.writestr(name, content)
+    return buffer.getvalue()
+
+good = make_zip(FILES)
+# A byte of the data of the first file is changed: the archive is still readable,
+# but its CRC doesn't match
+corrupt = bytearray(good)
+corrupt[len(good) // 4] ^= 0xFF
+corrupt = bytes(corrupt)
+archives = {"/good.zip": good, "/corrupt.zip": corrupt}
+# path -> list of the Range headers received (None for a plain GET)
+requests_seen = {path: [] for path in archives}
+
+class Handler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        content = archives.get(self.path)
+        if content is None:
+            self.send_error(404)
+            return
+        range_header = self.headers.get("Range")
+        requests_seen[self.path].append(range_header)
+        start = 0
+        if range_header is not None:
+            start = int(range_header[len("bytes="):].split("-")[0])
+            if start >= len(content):
+                self.send_response(416)
+                self.send_header("Content-Range", f"bytes */{len(content)}")
+                self.end_headers()
+                return
+            self.send_response(206)
+            self.send_header("Content-Range", f"bytes {start}-{len(content) - 1}/{len(content)}")
+        else:
+            self.send_response(200)
+        self.send_header("Content-Length", str(len(content) - start))
+        self.end_headers()
+        self.wfile.write(content[start:])
+
+    def log_message(self, format, *args):
+        pass
+
+def check(name, condition):
+    print(f"[INFO] {name}: ok" if condition else f"[ERR] {name}: FAILED")
+    return condition
+
+server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+threading.Thread(target=server.serve_forever, daemon=True).start()
+url = f"http://127.0.0.1:{server.server_address[1]}"
+results = []
+
+with tempfile.TemporaryDirectory() as folder:
+    manifest_path = os.path.join(folder, "manifest.json")
+
+    # resume
+    zip_path = os.path.join(folder, "good", "good.zip")
+    os.makedirs(os.path.dirname(zip_path))
+    half = len(good) // 2
+    with open(zip_path + ".part", "wb") as file:
+        file.write(good[:half])
+    manager = DownloadManager(manifest_path, max_workers=2, retries=2)
+    manager.add("GOOD", url + "/good.zip", zip_path, os.path.join(folder, "good", "acidentes"),
+                hashlib.sha256(good).hexdigest())
+    ok = manager.run()
+    extracted = os.path.join(folder, "good", "acidentes")
+    results.append(check("resume: run succeeded", ok))
+    results.append(check("resume: resumed with a Range request", requests_seen["/good.zip"] == [f"bytes={half}-"]))
+    results.append(check("resume: files extracted", all(
+        os.path.exists(os.path.join(extracted, name)) and open(os.path.join(extracted, name), "rb").read() == content
+        for name, content in FILES.items())))
+    results.append(check("resume: archive and .part removed",
+                         not os.path.exists(zip_path) and not os.path.exists(zip_path + ".part")))
+
+    # A second run finds the archive already extracted and downloads nothing
+    manager = DownloadManager(manifest_path, max_workers=2, retries=2)
+    manager.add("GOOD", url + "/good.zip", zip_path, extracted, hashlib.sha256(good).hexdigest())
+    results.append(check("resume: second run skips the archive", manager.run() and len(requests_seen["/good.zip"]) == 1))
+
+    # corrupt
+    zip_path = os.path.join(folder, "corrupt", "corrupt.zip")
+    manager = DownloadManager(manifest_path, max_workers=2, retries=2)
+    manager.add("CORRUPT", url + "/corrupt.zip", zip_path, os.path.join(folder, "corrupt", "acidentes"))
+    start = time.monotonic()
+    ok = manager.run()
+    elapsed = time.monotonic() - start
+    with open(manifest_path, "r") as file:
+        manifest = json.load(file)
+    results.append(check("corrupt: run failed", not ok and manifest["CORRUPT"]["status"] == "failed"))
+    results.append(check("corrupt: downloaded from scratch at every attempt", requests_seen["/corrupt.zip"] == [None, None]))
+    results.append(check("corrupt: nothing left on disk", not os.path.exists(zip_path) and not os.path.exists(zip_path + ".part")
+                         and not os.path.exists(os.path.join(folder, "corrupt", "acidentes"))))
+    # A single wait of 1 s, between the two attempts
+    results.append(check(f"corrupt: no wait after the last attempt ({elapsed:.1f} s)", elapsed < 2))
+
+    # checksum
+    zip_path = os.path.join(folder, "checksum", "good.zip")
+    manager = DownloadManager(manifest_path, max_workers=2, retries=1)
+    manager.add("CHECKSUM", url + "/good.zip", zip_path, os.path.join(folder, "checksum", "acidentes"), "0" * 64)
+    ok = manager.run()
+    results.append(check("checksum: mismatch rejected", not ok and not os.path.exists(os.path.join(folder, "checksum", "acidentes"))))
+
+server.shutdown()
+if not all(results):
+    sys.exit(1)
+print("[INFO] All the checks passed")
@@ -1,81 +1,233 @@
+""" Downloads the datasets and the trained models listed in the .env file.
+
+The downloads run in parallel (with a bounded number of workers) and each archive
+is extracted as soon as it's downloaded, while the other downloads go on.
+The progress is recorded in a manifest: relaunching the script after a failure
+resumes from where it stopped, and a partially written archive is never mistaken
+for a complete one.
+
+Run it from the root of the project:
+    python download_dataset.py [--workers N]
+"""
 import os
+import json
+import time
 import zipfile
-import gdown
+import hashlib
+import argparse
+import threading
+from urllib.parse import urlparse
+from concurrent.futures import ThreadPoolExecutor
+import requests
 from dotenv import dotenv_values
 
+MANIFEST_PATH = "./dataset/download_manifest.json"
+
 def load_env():
     env = dotenv_values(".env")
     prefix_raw = "BRASIL_RAW_" # years from 2017 to 2013
     prefix_extra = "BRASIL_EXTRA_" # years 2007-2016, 2024, from 01/25 to 08/25
     prefix_aggr = "BRASIL_AGGR_"
-    
-    links_brasil_raw = [(k,v) for k, v in env.items() if k.startswith(prefix_raw)]
-    links_brasil_extra = [(k,v) for k, v in env.items() if k.startswith(prefix_extra)]
-
-    link_brasil_aggr = [(k,v) for k, v in env.items() if k.startswith(prefix_aggr)]
-
-    link_model = env.get("MODELS_")
-    
-    return links_brasil_raw, links_brasil_extra, link_brasil_aggr, link_model
-
-def unzip(from_folder, to_folder=None):
-    zip_names = [f for f in os.listdir(from_folder) if os.path.isfile(os.path.join(from_folder, f))
-                 and f.lower().endswith(".zip")]
-    to_folder = from_folder + "/" + to_folder
 
-    for zip in zip_names:
-        with zipfile.ZipFile(from_folder + "/" + zip, "r") as zip_ref:
-            zip_ref.extractall(to_folder)
-        os.remove(from_folder + "/" + zip)
+    # An optional <KEY>_SHA256 variable holds the expected checksum of the archive <KEY>
+    links_brasil_raw = [(k,v) for k, v in env.items() if k.startswith(prefix_raw) and not k.endswith("_SHA256")]
+    links_brasil_extra = [(k,v) for k, v in env.items() if k.startswith(prefix_extra) and not k.endswith("_SHA256")]
 
-def download(link_list, folder):
+    link_brasil_aggr = [(k,v) for k, v in env.items() if k.startswith(prefix_aggr) and not k.endswith("_SHA256")]
 
-    dir = "./dataset/" + folder
-    if not os.path.exists(dir):
-        os.makedirs(dir)
-
-    for link in link_list:
-        try:
-            url = link[1]
-            fileName = link[0].split(folder + "_")[1].lower() + ".zip"
-
-            save_path_zip = dir + "/" + fileName
+    link_model = env.get("MODELS_")
 
-            if not os.path.exists(save_path_zip):
-                gdown.download(url, save_path_zip, quiet=False, fuzzy=True)
-        except Exception as e:
-            print(f"[{folder}] Dataset download error. Relaunch the script.")
+    checksums = {k[:-len("_SHA256")]: v.lower() for k, v in env.items() if k.endswith("_SHA256") and v}
+
+    return links_brasil_raw, links_brasil_extra, link_brasil_aggr, link_model, checksums
+
+def sha256sum(path):
+    """ Returns the SHA-256 digest of a file"""
+    sha256 = hashlib.sha256()
+    with open(path, "rb") as file:
+        for block in iter(lambda: file.read(1 << 20), b""):
+            sha256.update(block)
+    return sha256.hexdigest()
+
+def http_fetch(url, dest):
+    """ Downloads url into dest with a plain HTTP GET. If dest already exists (an
+    interrupted download), the download is resumed with a Range request."""
+    offset = os.path.getsize(dest) if os.path.exists(dest) else 0
+    headers = {"Range": f"bytes={offset}-"} if offset > 0 else {}
+    with requests.get(url, headers=headers, stream=True, timeout=60) as response:
+        if response.status_code == 416:
+            # The file is already complete
+            return
+        response.raise_for_status()
+        # If the server ignores the Range header, the download restarts from scratch
+        mode = "ab" if response.status_code == 206 else "wb"
+        with open(dest, mode) as file:
+            for block in response.iter_content(chunk_size=1 << 20):
+                file.write(block)
+
+def gdrive_fetch(url, dest):
+    """ Downloads a Google Drive link into dest, resuming a previous partial download"""
+    import gdown
+    if gdown.download(url, dest, quiet=True, fuzzy=True, resume=True) is None:
+        raise Exception(f"gdown couldn't download {url}")
+
+def fetch(url, dest):
+    """ Chooses the downloader according to the host of the url"""
+    if urlparse(url).hostname in ("drive.google.com", "docs.google.com"):
+        gdrive_fetch(url, dest)
+    else:
+        http_fetch(url, dest)
+
+class DownloadManager:
+    """ Downloads and extracts a set of zip archives.
+    The state of each archive (downloaded, extracted) and its checksum are kept in
+    a JSON manifest, which is updated after every step."""
+
+    def __init__(self, manifest_path=MANIFEST_PATH, max_workers=4, retries=3, fetcher=fetch):
+        """ Creates a new instance of the class DownloadManager
+            Args:
+                manifest_path: The path of the JSON manifest
+                max_workers: The maximum number of simultaneous downloads
+                retries: How many times a download is attempted before giving up
+                fetcher: The function fetcher(url, dest) used to download a url
+        """
+        self.manifest_path = manifest_path
+        self.max_workers = max_workers
+        self.retries = retries
+        self.fetcher = fetcher
+        self.jobs = []
+        self.lock = threading.Lock()
+        self.manifest = {}
+        if os.path.exists(manifest_path):
+            with open(manifest_path, "r") as file:
+                self.manifest = json.load(file)
+
+    def add(self, name, url, zip_path, extract_to, sha256=None):
+        """ Schedules the download of an archive
+            Args:
+                name: The unique name of the archive (the key in the .env file)
+                url: The link to the archive
+                zip_path: Where the archive is saved
+                extract_to: The folder where the archive is extracted
+                sha256: Optional field. The expected SHA-256 digest of the archive
+        """
+        self.jobs.append({"name": name, "url": url, "zip_path": zip_path,
+                          "extract_to": extract_to, "sha256": sha256})
+
+    def update_manifest(self, name, **fields):
+        """ Updates the entry of an archive and writes the manifest on disk"""
+        with self.lock:
+            self.manifest.setdefault(name, {}).update(fields)
+            os.makedirs(os.path.dirname(self.manifest_path) or ".", exist_ok=True)
+            tmp_path = self.manifest_path + ".tmp"
+            with open(tmp_path, "w") as file:
+                json.dump(self.manifest, file, indent=2)
+            os.replace(tmp_path, self.manifest_path)
+
+    def verify(self, job, path):
+        """ Checks that the file is a complete zip archive with the expected checksum.
+        Returns the SHA-256 digest of the file, None if the verification fails"""
+        digest = sha256sum(path)
+        if job["sha256"] is not None and digest != job["sha256"]:
+            print(f"[ERR] [{job['name']}] Checksum mismatch")
+            return None
+        if not zipfile.is_zipfile(path):
+            print(f"[ERR] [{job['name']}] The downloaded file is not a valid zip archive")
+            return None
+        with zipfile.ZipFile(path) as zip_ref:
+            if zip_ref.testzip() is not None:
+                print(f"[ERR] [{job['name']}] The zip archive is corrupted")
+                return None
+        return digest
+
+    def download(self, job):
+        """ Downloads an archive, unless a verified copy of it is already on disk.
+        The data is written on a .part file which is renamed only once verified.
+        Returns True if the archive is ready to be extracted"""
+        name = job["name"]
+        entry = self.manifest.get(name, {})
+        if entry.get("status") == "extracted" and entry.get("url") == job["url"]:
             return False
-    return True
-
-def download_models(link):
-    dir = "."
-    if not os.path.exists(dir):
-        os.makedirs(dir)
-    
-    try:
-        url = link
-        filename = "models.zip"
-        save_path_zip = dir + "/" + filename
-
-        if not os.path.exists(save_path_zip):
-            gdown.download(url, save_path_zip, quiet=False, fuzzy=True)
-    except Exception as e:
-        print("Model download error. Relaunch the script")
+        if entry.get("status") == "downloaded" and os.path.exists(job["zip_path"]) \
+                and sha256sum(job["zip_path"]) == entry.get("sha256"):
+            return True
+
+        os.makedirs(os.path.dirname(job["zip_path"]) or ".", exist_ok=True)
+        part_path = job["zip_path"] + ".part"
+        for attempt in range(1, self.retries + 1):
+            try:
+                self.fetcher(job["url"], part_path)
+                digest = self.verify(job, part_path)
+                if digest is not None:
+                    os.replace(part_path, job["zip_path"])
+                    self.update_manifest(name, url=job["url"], status="downloaded", sha256=digest,
+                                         size=os.path.getsize(job["zip_path"]))
+                    print(f"[INFO] [{name}] Downloaded")
+                    return True
+                # A file failing the verification can't be resumed
+                os.remove(part_path)
+            except Exception as e:
+                print(f"[ERR] [{name}] Download attempt {attempt}/{self.retries} failed: {e}")
+            # No wait after the last attempt
+            if attempt < self.retries:
+                time.sleep(attempt)
+        self.update_manifest(name, url=job["url"], status="failed")
         return False
-    return True
-
-links_brasil_raw, links_brasil_extra, link_brasil_aggr, link_model = load_env()
-
-no_download_errors1 = download(links_brasil_raw, folder="BRASIL_RAW")
-no_download_errors2 = download(links_brasil_extra, folder="BRASIL_EXTRA")
-no_download_errors3 = download(link_brasil_aggr, folder="BRASIL_AGGR")
 
-if no_download_errors1 and no_download_errors2 and no_download_errors3:
-    unzip("./dataset/BRASIL_RAW", "acidentes")
-    unzip("./dataset/BRASIL_EXTRA", "acidentes")
-    unzip("./dataset/BRASIL_AGGR", ".")
-
-no_model_errors = download_models(link_model)
-if no_model_errors:
-    unzip(".", "./models")
\ No newline at end of file
+    def extract(self, job):
+        """ Extracts a downloaded archive and removes it"""
+        name = job["name"]
+        try:
+            with zipfile.ZipFile(job["zip_path"], "r") as zip_ref:
+                zip_ref.extractall(job["extract_to"])
+        except Exception as e:
+            print(f"[ERR] [{name}] Extraction failed: {e}")
+            self.update_manifest(name, status="failed")
+            return
+        os.remove(job["zip_path"])
+        self.update_manifest(name, status="extracted")
+        print(f"[INFO] [{name}] Extracted into {job['extract_to']}")
+
+    def run(self):
+        """ Downloads all the scheduled archives. Each archive is extracted by a
+        dedicated thread as soon as its download completes.
+        Returns True if all the archives have been downloaded and extracted"""
+        # A single extraction thread: extractions are disk bound and some archives
+        # are extracted into the same folder
+        with ThreadPoolExecutor(max_workers=1) as extractor, \
+                ThreadPoolExecutor(max_workers=self.max_workers) as downloader:
+            def download_then_extract(job):
+                if self.download(job):
+                    extractor.submit(self.extract, job)
+            futures = [downloader.submit(download_then_extract, job) for job in self.jobs]
+            for future in futures:
+                future.result()
+
+        failed = [job["name"] for job in self.jobs if self.manifest.get(job["name"], {}).get("status") != "extracted"]
+        if failed:
+            print(f"[ERR] Not completed: {', '.join(failed)}. Relaunch the script to resume.")
+        return len(failed) == 0
+
+def schedule(manager, link_list, folder, extract_to, checksums):
+    """ Schedules the archives of a dataset folder, with the naming used so far"""
+    dir = "./dataset/" + folder
+    for key, url in link_list:
+        fileName = key.split(folder + "_")[1].lower() + ".zip"
+        manager.add(key, url, dir + "/" + fileName, dir + "/" + extract_to, checksums.get(key))
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--workers", type=int, default=4, help="maximum number of simultaneous downloads")
+    args = parser.parse_args()
+
+    links_brasil_raw, links_brasil_extra, link_brasil_aggr, link_model, checksums = load_env()
+
+    manager = DownloadManager(max_workers=args.workers)
+    schedule(manager, links_brasil_raw, "BRASIL_RAW", "acidentes", checksums)
+    schedule(manager, links_brasil_extra, "BRASIL_EXTRA", "acidentes", checksums)
+    schedule(manager, link_brasil_aggr, "BRASIL_AGGR", ".", checksums)
+    if link_model is not None:
+        manager.add("MODELS_", link_model, "./models.zip", "./models", checksums.get("MODELS_"))
+
+    ok = manager.run()
+    raise SystemExit(0 if ok else 1)
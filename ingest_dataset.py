@@ -0,0 +1,734 @@
+""" Parallel ingestion of the yearly PRF accident files (acidentesYYYY.csv).
+
+It replaces the per-year loops of the dataIntegration and dataBalancing notebooks:
+each year is transcoded to UTF-8, translated to English and saved as a checkpoint
+by a pool of processes. The years whose inputs haven't changed since the last run
+are skipped, then the checkpoints are merged into the final csv files with a
+streaming pass.
+
+Run it from the root of the project, once the dataset has been downloaded:
+    python ingest_dataset.py [--groups raw extra_old extra_new] [--workers N] [--force]
+"""
+import os
+import json
+import time
+import shutil
+import hashlib
+import argparse
+import chardet
+import pandas as pd
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+DATASET_FOLDER = "./dataset"
+EDITED_DATASET_FOLDER = "./editedDataset"
+CHECKPOINT_FOLDER = EDITED_DATASET_FOLDER + "/ingestion"
+CLEAN_DATASET = EDITED_DATASET_FOLDER + "/CLEANED_brasilEnglishAggr.csv"
+# The cleaned aggregated dataset split by year, see split_clean_dataset
+CLEAN_SPLIT_FOLDER = CHECKPOINT_FOLDER + "/clean_by_year"
+
+# Bumped whenever the processing of a year changes, so that the old checkpoints are rebuilt
+INGESTION_VERSION = 1
+
+# Translations used for the years 2017-2023 (dataIntegration notebook)
+RAW_WITHOUT_PASSENGERS_MAP = {
+    'Não': 'No',
+    'Sim': 'Yes'
+}
+
+RAW_VEHICLE_TYPE_MAP = {
+    "Automóvel": "Car",
+    "Motocicleta": "Motorcycle",
+    "Semireboque": "Semi-trailer",
+    "Caminhonete": "Pickup truck",
+    "Caminhão-trator": "Tractor-trailer truck",
+    "Caminhão": "Truck",
+    "Ônibus": "Bus",
+    "Camioneta": "Van",
+    "Motoneta": "Scooter",
+    "Utilitário": "Utility vehicle",
+    "Bicicleta": "Bicycle",
+    "Micro-ônibus": "Minibus",
+    "Reboque": "Trailer",
+    "Outros": "Others",
+    "Ciclomotor": "Moped",
+    "Carroça-charrete": "Cart-wagon",
+    "Trator de rodas": "Wheeled tractor",
+    "Motor-casa": "Motorhome",
+    "Triciclo": "Tricycle",
+    "Trem-bonde": "Tram",
+    "Trator de esteira": "Crawler tractor",
+    "Trator misto": "Backhoe loader",
+    "Carro de mão": "Wheelbarrow",
+    "Chassi-plataforma": "Chassis platform",
+    "Quadriciclo": "Quadricycle"
+}
+
+RAW_PERSON_SEX_MAP = {
+    'Masculino': 'M',
+    'Feminino': 'F',
+    'Não Informado': pd.NA,
+    'Ignorado': pd.NA
+}
+
+RAW_PERSON_CONDITION_MAP = {
+    'Ileso': 'Unharmed',
+    'Lesões Leves': 'Slightly Injured',
+    'Lesões Graves': 'Severely Injured',
+    'Não Informado': pd.NA,
+    'Óbito': 'Dead'
+}
+
+# Translations shared by all the years of BRASIL_EXTRA (dataBalancing notebook)
+PERSON_KIND_MAP = {
+    'Condutor': 'Driver',
+    'Passageiro': 'Passenger',
+    'Pedestre': 'Pedestrian',
+    'Testemunha': 'Withness',
+    'Cavaleiro': 'Knight'
+}
+
+VEHICLE_TYPE_MAP = {
+    "Automóvel": "Car",
+    "Motocicleta": "Motorcycle",
+    "Motocicletas": "Motorcycle",
+    "Semireboque": "Semi-trailer",
+    "Caminhonete": "Pickup truck",
+    "Caminhão-trator": "Tractor-trailer truck",
+    "Caminhão-Trator": "Tractor-trailer truck",
+    "Caminhão": "Truck",
+    "Caminhão-Tanque": "Truck",
+    "Ônibus": "Bus",
+    "Bonde / Trem": "Tram / Train",
+    "Camioneta": "Van",
+    "Motoneta": "Scooter",
+    "Utilitário": "Utility vehicle",
+    "Bicicleta": "Bicycle",
+    "Micro-ônibus": "Minibus",
+    "Microônibus": "Minibus",
+    "Reboque": "Trailer",
+    "Outros": "Others",
+    "Ciclomotor": "Moped",
+    "Carroça-charrete": "Cart-wagon",
+    "Carroça": "Cart-wagon",
+    "Trator de rodas": "Wheeled tractor",
+    "Motor-casa": "Motorhome",
+    "Triciclo": "Tricycle",
+    "Trem-bonde": "Tram",
+    "Trator de esteira": "Crawler tractor",
+    "Trator de esteiras": "Crawler tractor",
+    "Trator misto": "Backhoe loader",
+    "Carro de mão": "Wheelbarrow",
+    "Carro-de-mao": "Wheelbarrow",
+    "Chassi-plataforma": "Chassis platform",
+    "Quadriciclo": "Quadricycle",
+    "Não identificado": pd.NA,
+    "(null)": pd.NA
+}
+
+WEEK_DAY_MAP = {
+    "Domingo": "sunday",
+    "Sábado": "saturday",
+    "Sexta": "friday",
+    "Quinta": "thursday",
+    "Quarta": "wednesday",
+    "Terça": "tuesday",
+    "Segunda": "monday",
+    'domingo': "sunday",
+    'sábado': 'saturday',
+    'sexta-feira': 'friday',
+    'segunda-feira': 'monday',
+    'quinta-feira': 'thursday',
+    'quarta-feira': 'wednesday',
+    'terça-feira': 'tuesday',
+}
+
+WEATHER_TIMESTAMP_MAP = {
+    "Pleno dia": "Day",
+    "Plena noite": "Night",
+    "Anoitecer": "Sunset",
+    "Amanhecer": "Sunrise",
+    "(null)": pd.NA
+}
+
+PERSON_SEX_MAP = {
+    'Masculino': 'M',
+    'Feminino': 'F',
+    'Inválido': pd.NA,
+    'Não Informado': pd.NA,
+    'Ignorado': pd.NA
+}
+
+# Translations used for the years 2007-2016
+OLD_TYPE_OF_ACCIDENT_MAP = {
+    "Colisão traseira": "Rear-end collision",
+    "Colisão lateral": "Broadside collision",
+    "Saída de Pista": "Run-off-road",
+    "Colisão Transversal": "Side impact collision",
+    "Colisão frontal": "Head-on collision",
+    "Capotamento": "Rollover",
+    "Colisão com objeto fixo": "Collision with fixed object",
+    "Atropelamento de pessoa": "Pedestrian collision",
+    "Tombamento": "Overturn",
+    "Colisão com bicicleta": "Collision with moving object",
+    "Atropelamento de animal": "Animal collision",
+    "Queda de motocicleta / bicicleta / veículo": "Fall of veichle occupant",
+    "Colisão com objeto móvel": "Collision with object",
+    "Danos Eventuais": "Minor incidental damage",
+    "Derramamento de Carga": "Cargo spill",
+    "Incêndio": "Veichle fire"
+}
+
+OLD_ROAD_DIRECTION_MAP = {
+    "Crescente": "Increasing",
+    "Decrescente": "Decreasing"
+}
+
+OLD_WEATHER_CONDITION_MAP = {
+    "Ceu Claro": "Clear sky",
+    "Nublado": "Cloudy",
+    "Chuva": "Rainy",
+    "Sol": "Sunny",
+    "Nevoeiro/neblina": "Fog",
+    "Vento": "Windy",
+    "Granizo": "Hail",
+    "Neve": "Snowy",
+    "Ignorada": "Ignored",
+    "(null)": "Ignored"
+}
+
+OLD_CAUSE_OF_ACCIDENT_MAP = {
+    "Falta de atenção": "Driver's lack of reaction",
+    "Outras": "Other",
+    "Não guardar distância de segurança": "Driver failed to keep distance from the vehicle in front",
+    "Velocidade incompatível": "Incompatible velocity",
+    "Defeito mecânico em veículo": "Mechanical loss/defect of vehicle",
+    "Desobediência à sinalização": "Driver broke the laws of transit",
+    "Ultrapassagem indevida":  "Driver changed the lane illegally",
+    "Ingestão de álcool":  "Alcohol ingestion by the driver",
+    "Animais na Pista":  "Animals on the road",
+    "Dormindo":  "Driver was sleeping",
+    "Defeito na via":  "Road's defect"
+}
+
+OLD_PERSON_CONDITION_MAP = {
+    "Ileso": "Unharmed",
+    'Ferido Leve': 'Slightly Injured',
+    'Ferido Grave': 'Severely Injured',
+    'Ignorado': pd.NA,
+    '(null)': pd.NA,
+    'Morto': 'Dead'
+}
+
+# Translations used for the years 2024 and 2025
+NEW_TYPE_OF_ACCIDENT_MAP = {
+    "Colisão traseira": "Rear-end collision",
+    "Colisão lateral": "Broadside collision",
+    "Saída de Pista": "Run-off-road",
+    "Colisão Transversal": "Side impact collision",
+    "Colisão transversal": "Side impact collision",
+    "Colisão lateral mesmo sentido": "Side collision (same direction)",
+    "Saída de leito carroçável": "Run-off-road",
+    "Colisão frontal": "Head-on collision",
+    "Capotamento": "Rollover",
+    "Colisão com objeto": "Collision with object",
+    "Colisão com objeto fixo": "Collision with fixed object",
+    "Colisão lateral sentido oposto": "Side collision (opposite direction)",
+    "Atropelamento de Pedestre": "Pedestrian collision",
+    "Atropelamento de pessoa": "Pedestrian collision",
+    "Engavetamento": "Chain reaction crash (pile-up)",
+    "Tombamento": "Overturn",
+    "Colisão com bicicleta": "Collision with moving object",
+    "Atropelamento de animal": "Animal collision",
+    "Atropelamento de Animal": "Animal collision",
+    "Queda de motocicleta / bicicleta / veículo": "Fall of veichle occupant",
+    "Queda de ocupante de veículo": "Fall of veichle occupant",
+    "Colisão com objeto móvel": "Collision with object",
+    "Danos Eventuais": "Minor incidental damage",
+    "Derramamento de Carga": "Cargo spill",
+    "Derramamento de carga": "Cargo spill",
+    "Incêndio": "Veichle fire",
+    "Eventos atípicos": "Unusual event",
+    "Sinistro pessoal de trânsito": "Personal traffic accident"
+}
+
+NEW_ROAD_DIRECTION_MAP = {
+    "Crescente": "Increasing",
+    "Decrescente": "Decreasing",
+    "Não Informado": pd.NA
+}
+
+NEW_WEATHER_CONDITION_MAP = {
+    "Ceu Claro": "Clear sky",
+    "Céu Claro": "Clear sky",
+    "Garoa/Chuvisco": "Drizzle",
+    "Nublado": "Cloudy",
+    "Chuva": "Rainy",
+    "Sol": "Sunny",
+    "Nevoeiro/neblina": "Fog",
+    "Nevoeiro/Neblina": "Fog",
+    "Vento": "Windy",
+    "Granizo": "Hail",
+    "Neve": "Snowy",
+    "Ignorada": "Ignored",
+    "Ignorado": "Ignored",
+    "(null)": "Ignored"
+}
+
+NEW_CAUSE_OF_ACCIDENT_MAP = {
+    "Reação tardia ou ineficiente do condutor": "Driver's lack of reaction",
+    "Falta de atenção": "Driver's lack of reaction",
+    "Acessar a via sem observar a presença dos outros veículos": "Acessing the road without seeing the presence of other vehicles",
+    "Condutor deixou de manter distância do veículo da frente": "Driver failed to keep distance from the vehicle in front",
+    "Manobra de mudança de faixa": "Driver changed the lane illegally",
+    "Velocidade Incompatível": "Incompatible velocity",
+    "Transitar na contramão": "Driver was in the opposite direction",
+    "Ingestão de álcool pelo condutor": "Alcohol ingestion by the driver",
+    "Demais falhas mecânicas ou elétricas": "Electrical or mechanical flaws",
+    "Ultrapassagem Indevida": "Driver changed the lane illegally",
+    "Conversão proibida": "Prohibited conversion",
+    "Avarias e/ou desgaste excessivo no pneu": "Excessive use of the car's tire",
+    "Condutor Dormindo": "Driver was sleeping",
+    "Desrespeitar a preferência no cruzamento": "Driver broke the laws of transit",
+    "Trafegar com motocicleta (ou similar) entre as faixas":"Traffic with a motorcycle (or similar) between lanes",
+    "Ausência de reação do condutor": "Driver's lack of reaction",
+    "Outras": "Other",
+    "Acesso irregular": "Irregular access",
+    "Entrada inopinada do pedestre": "Unexpected pedestrian entry",
+    "Pedestre andava na pista":"Pedestrian was walking in the road",
+    "Chuva": "Rain",
+    "Não guardar distância de segurança": "Driver failed to keep distance from the vehicle in front",
+    "Velocidade incompatível": "Incompatible velocity",
+    "Defeito mecânico em veículo": "Mechanical loss/defect of vehicle",
+    "Desobediência à sinalização": "Driver broke the laws of transit",
+    "Ultrapassagem indevida":  "Driver changed the lane illegally",
+    "Ingestão de álcool":  "Alcohol ingestion by the driver",
+    "Animais na Pista":  "Animals on the road",
+    "Dormindo":  "Driver was sleeping",
+    "Pista Escorregadia": "Slippery track",
+    "Pedestre cruzava a pista fora da faixa": "Pedestrian was crossing the road outside of the crosswalk",
+    "Defeito na via":  "Road's defect",
+    "Acumulo de água sobre o pavimento": "Accumulation of water on the road",
+    "Mal súbito do condutor": "Driver had a cardiac attack",
+    "Transitar no Acostamento": "Driving on the breakdown lane",
+    "Retorno proibido": "Prohibited conversion",
+    "Frear bruscamente": "Abrupt use of the car's brake",
+    "Objeto estático sobre o leito carroçável":"Static object on the drainage gate",
+    "Problema com o freio": "Car's brake problem",
+    "Condutor desrespeitou a iluminação vermelha do semáforo": "Driver disrespected the red traffic light",
+    "Carga excessiva e/ou mal acondicionada": "Excessive load/cargo",
+    "Estacionar ou parar em local proibido": "Stopping at a prohibited place",
+    "Ausência de sinalização": "Absence of sinalization",
+    "Suicídio (presumido)": "suicide (presumed)",
+    "Pista esburacada": "Unlevel track",
+    "Acumulo de óleo sobre o pavimento": "Oil accumulation on the road",
+    "Deficiência do Sistema de Iluminação/Sinalização":"Deficiency of vehicle's sinalization/ilumination system",
+    "Curva acentuada": "Curvy road",
+    "Acumulo de areia ou detritos sobre o pavimento": "Road had lots of sand/wreckage",
+    "Pedestre - Ingestão de álcool/ substâncias psicoativas": "Alcohol and/or drug ingestion by the pedestrian",
+    "Acostamento em desnível":"Stopping at a prohibited place",
+    "Afundamento ou ondulação no pavimento": "Sinking or ondulation in the pavement",
+    "Iluminação deficiente": "Poor ilumination (of the road)",
+    "Condutor usando celular": "Driver using cellphone",
+    "Neblina": "Fog",
+    "Demais Fenômenos da natureza": "Natural phenomena",
+    "Ingestão de substâncias psicoativas pelo condutor": "Driver was using drugs",
+    "Fumaça": "Road condition",
+    "Falta de acostamento": "Sinking or ondulation in the pavement",
+    "Área urbana sem a presença de local apropriado para a travessia de pedestres": "Urban area without appropriate pedestrian walking",
+    "Sinalização mal posicionada":"Inadequate sinalization of the road",
+    "Transtornos Mentais (exceto suicidio)":"mental disorder (except suicide)",
+    "Falta de elemento de contenção que evite a saída do leito carroçável": "Road defect",
+    "Problema na suspensão":"Car's suspension system with problems",
+    "Restrição de visibilidade em curvas horizontais": "Visibility restriction",
+    "Desvio temporário": "Road works (in maintenance)",
+    "Participar de racha": "Major traffic offense",
+    "Declive acentuado":"Unlevel track",
+    "Faixas de trânsito com largura insuficiente": "Road defect",
+    "Deixar de acionar o farol da motocicleta (ou similar)": "Minor traffic offense",
+    "Modificação proibida": "Veichle human fault",
+    "Restrição de visibilidade em curvas verticais": "Visibility restriction",
+    "Semáforo com defeito": "Road condition",
+    "Transitar na calçada": "Pedestrian involved",
+    "Faróis desregulados": "Veichle human fault",
+    "Sistema de drenagem ineficiente": "Accumulation of water on the road",
+    "Sinalização encoberta": "Road defect",
+    "Redutor de velocidade em desacordo": "High speed"
+}
+
+NEW_PERSON_CONDITION_MAP = {
+    "Ileso": "Unharmed",
+    'Ferido Leve': 'Slightly Injured',
+    'Ferido Grave': 'Severely Injured',
+    'Lesões Leves': 'Slightly Injured',
+    'Lesões Graves': 'Severely Injured',
+    'Não Informado': pd.NA,
+    'Óbito': 'Dead',
+    'Ignorado': pd.NA,
+    '(null)': pd.NA,
+    'Morto': 'Dead'
+}
+
+DEAD_OR_SEVERE = "person_condition == 'Dead' or person_condition == 'Severely Injured'"
+
+# For each group of years: where the raw files are, and how the per-year checkpoints
+# are merged. Each merge pass appends to the output the rows of a year satisfying
+# the query (all the rows if the query is None).
+GROUPS = {
+    "raw": {
+        "source_folder": f"{DATASET_FOLDER}/BRASIL_RAW/acidentes",
+        "years": list(range(2017, 2024)),
+        "output": f"{EDITED_DATASET_FOLDER}/INTEGRATION_brasilEnglishFull.csv",
+        "merge": [(y, None) for y in range(2017, 2024)]
+    },
+    "extra_old": {
+        "source_folder": f"{DATASET_FOLDER}/BRASIL_EXTRA/acidentes",
+        "years": list(range(2007, 2017)),
+        "output": f"{EDITED_DATASET_FOLDER}/BALANCING_2007_2016_brasilEnglishFull.csv",
+        "merge": [(y, DEAD_OR_SEVERE) for y in range(2007, 2017)]
+    },
+    "extra_new": {
+        "source_folder": f"{DATASET_FOLDER}/BRASIL_EXTRA/acidentes",
+        "years": [2024, 2025],
+        "output": f"{EDITED_DATASET_FOLDER}/BALANCING_2024_2025_brasilEnglishFull.csv",
+        # The slightly injured people of 2025 are kept too, to balance the classes
+        "merge": [(2024, DEAD_OR_SEVERE), (2025, DEAD_OR_SEVERE),
+                  (2025, "person_condition == 'Slightly Injured'")]
+    }
+}
+
+def file_fingerprint(path):
+    """ Returns a dictionary with the size, the modification time and the SHA-256 digest of a file"""
+    stat = os.stat(path)
+    sha256 = hashlib.sha256()
+    with open(path, "rb") as file:
+        for block in iter(lambda: file.read(1 << 20), b""):
+            sha256.update(block)
+    return {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns, "sha256": sha256.hexdigest()}
+
+def source_path(group, year):
+    return os.path.join(GROUPS[group]["source_folder"], f"acidentes{year}.csv")
+
+def checkpoint_path(group, year):
+    return os.path.join(CHECKPOINT_FOLDER, group, f"{year}.csv")
+
+def fix_file_names():
+    """ The file of 2016 is distributed as acidentes2016_atual.csv"""
+    folder = GROUPS["extra_old"]["source_folder"]
+    if os.path.exists(f"{folder}/acidentes2016_atual.csv"):
+        os.rename(f"{folder}/acidentes2016_atual.csv", f"{folder}/acidentes2016.csv")
+
+def transcode(src, year):
+    """ Converts the raw file into UTF-8 encoding, inside editedDataset/UTF_acidentes.
+    Returns the path of the converted file."""
+    with open(src, "rb") as f:
+        detected = chardet.detect(f.read(10000))["encoding"]
+    # The PRF files are ISO-8859-1 encoded: we trust chardet only when it recognizes
+    # UTF-8, because the first 10k bytes alone could look like plain ASCII
+    encoding = "utf-8" if detected and detected.lower() == "utf-8" else "iso-8859-1"
+
+    out_dir = f"{EDITED_DATASET_FOLDER}/UTF_acidentes"
+    os.makedirs(out_dir, exist_ok=True)
+    dst = os.path.join(out_dir, f"utf_acidentes{year}.csv")
+    with open(src, "r", encoding=encoding, errors="strict") as fin, \
+        open(dst, "w", encoding="utf-8", newline="") as fout:
+        for line in fin:
+            fout.write(line)
+    return dst
+
+def translate_raw(df_full, df):
+    """ Translates a year between 2017 and 2023 and joins it with the cleaned
+    aggregated dataset df (dataIntegration notebook)"""
+    en_attrNames_head = (df.loc[:,:'people'].columns).tolist()
+
+    df_full_columns = df_full.columns.tolist()
+    df_full_columns[2:17] = en_attrNames_head
+    df_full_columns[17:26] = ['without_passengers', 'veichle_id', 'veichle_type', 'veichle_brand', 'veichle_manufacturing_year', 'person_kind', 'person_condition', 'person_age', 'person_sex']
+    df_full_columns[26:30] = ['person_is_unharmed', 'person_is_slightly_injured', 'person_is_severely_injured', 'person_is_dead']
+    df_full_columns[32] = 'police_station'
+    df_full.columns = df_full_columns
+
+    df_full["without_passengers"] = df_full["without_passengers"].replace(RAW_WITHOUT_PASSENGERS_MAP)
+    df_full["veichle_type"] = df_full["veichle_type"].replace(RAW_VEHICLE_TYPE_MAP)
+    df_full['veichle_brand'] = df_full["veichle_brand"].replace({
+        "Não Informado/Não Informado": pd.NA,
+        "NA/NA": pd.NA
+    })
+    df_full['veichle_manufacturing_year'] = df_full["veichle_manufacturing_year"].replace(0,pd.NA)
+    df_full["person_kind"] = df_full["person_kind"].replace(PERSON_KIND_MAP)
+    df_full["person_sex"] = df_full["person_sex"].replace(RAW_PERSON_SEX_MAP)
+    df_full["person_condition"] = df_full["person_condition"].replace(RAW_PERSON_CONDITION_MAP)
+
+    # We need also to round to 5 digits in order to make the join operation successful
+    for attr in ["latitude", "longitude"]:
+        df_full[attr] = df_full[attr].astype(str).str.replace(",", ".").astype(float).round(5)
+
+    df_full.sort_values(by=['date', 'hour', 'city'], inplace=True)
+
+    # We drop all the head attributes exception made the ones useful for the join
+    indexes = {0,2}
+    en_attrNames_head = [x for i,x in enumerate(en_attrNames_head) if i not in indexes]
+    df_full = df_full.drop(columns=en_attrNames_head)
+
+    return pd.merge(df, df_full, on=['latitude', 'longitude', 'date', 'hour'])
+
+def translate_extra(df_full, type_of_accident_map, road_direction_map, weather_condition_map,
+                    cause_of_accident_map, person_condition_map):
+    """ Translates the values of the attributes shared by all the years of BRASIL_EXTRA
+    (dataBalancing notebook)"""
+    df_full["veichle_type"] = df_full["veichle_type"].replace(VEHICLE_TYPE_MAP)
+    df_full["week_day"] = df_full["week_day"].str.rstrip()
+    df_full["week_day"] = df_full["week_day"].replace(WEEK_DAY_MAP)
+    df_full["type_of_accident"] = df_full["type_of_accident"].replace(type_of_accident_map)
+    df_full["weather_timestamp"] = df_full["weather_timestamp"].replace(WEATHER_TIMESTAMP_MAP)
+    df_full["road_direction"] = df_full["road_direction"].str.rstrip()
+    df_full["road_direction"] = df_full["road_direction"].replace(road_direction_map)
+    df_full["weather_condition"] = df_full["weather_condition"].replace(weather_condition_map)
+    df_full["cause_of_accident"] = df_full["cause_of_accident"].replace(cause_of_accident_map)
+
+    df_full['veichle_brand'] = df_full["veichle_brand"].replace({
+        "Não Informado/Não Informado": pd.NA,
+        "NA/NA": pd.NA,
+        "(null)": pd.NA
+    })
+    df_full['veichle_manufacturing_year'] = df_full["veichle_manufacturing_year"].replace("    ",pd.NA)
+    df_full['veichle_manufacturing_year'] = df_full["veichle_manufacturing_year"].replace("(null)", pd.NA)
+
+    df_full.loc[df_full["person_age"] > 125.0, "person_age"] = pd.NA
+    df_full["person_age"] = df_full["person_age"].replace(-1.0, pd.NA)
+
+    df_full["person_kind"] = df_full["person_kind"].replace(PERSON_KIND_MAP)
+    df_full["person_sex"] = df_full["person_sex"].replace(PERSON_SEX_MAP)
+
+    # Removing trailing spaces
+    df_full["person_condition"] = df_full["person_condition"].str.rstrip()
+    df_full["person_condition"] = df_full["person_condition"].replace(person_condition_map)
+
+    # Handling mixed type warnings
+    df_full["road_id"] = df_full["road_id"].replace("(null)", pd.NA)
+    df_full["km"] = df_full["km"].replace("(null)", pd.NA)
+    df_full["veichle_id"] = df_full["veichle_id"].replace("(null)", pd.NA)
+    return df_full
+
+def translate_extra_old(df_full):
+    """ Translates a year between 2007 and 2016"""
+    df_full_columns = df_full.columns.tolist()
+    df_full_columns[2:28] = ['date', 'week_day', 'hour', 'state', 'road_id', 'km', 'city', 'cause_of_accident', 'type_of_accident', 'victims_condition', 'weather_timestamp', 'road_direction',
+                             'weather_condition', 'road_delineation', 'road_type', 'uso_solo', 'veichle_id', 'veichle_type', 'veichle_brand',
+                            'veichle_manufacturing_year', 'person_kind', 'person_condition', 'person_age', 'person_sex', 'nationality1', 'nationality2']
+    df_full.columns = df_full_columns
+
+    df_full = translate_extra(df_full, OLD_TYPE_OF_ACCIDENT_MAP, OLD_ROAD_DIRECTION_MAP,
+                              OLD_WEATHER_CONDITION_MAP, OLD_CAUSE_OF_ACCIDENT_MAP, OLD_PERSON_CONDITION_MAP)
+
+    df_full.sort_values(by=['date', 'hour', 'city'], inplace=True)
+    return df_full
+
+def translate_extra_new(df_full):
+    """ Translates the years 2024 and 2025"""
+    df_full_columns = df_full.columns.tolist()
+    df_full_columns[2:26] = ['date', 'week_day', 'hour', 'state', 'road_id', 'km', 'city', 'cause_of_accident', 'type_of_accident', 'victims_condition', 'weather_timestamp', 'road_direction',
+                             'weather_condition', 'road_delineation', 'road_type', 'uso_solo', 'veichle_id', 'veichle_type', 'veichle_brand',
+                            'veichle_manufacturing_year', 'person_kind', 'person_condition', 'person_age', 'person_sex']
+    df_full_columns[26:] = ['person_is_unharmed', 'person_is_slightly_injured', 'person_is_severely_injured', 'person_is_dead', 'latitude', 'longitude', 'regional', 'delegation', 'uop']
+    df_full.columns = df_full_columns
+
+    # In the newer files the missing manufacturing year is written as 0
+    df_full['veichle_manufacturing_year'] = df_full["veichle_manufacturing_year"].replace(0,pd.NA)
+    df_full = translate_extra(df_full, NEW_TYPE_OF_ACCIDENT_MAP, NEW_ROAD_DIRECTION_MAP,
+                              NEW_WEATHER_CONDITION_MAP, NEW_CAUSE_OF_ACCIDENT_MAP, NEW_PERSON_CONDITION_MAP)
+
+    # Dropping what is un-useful
+    df_full = df_full.drop(columns= ['person_is_unharmed', 'person_is_slightly_injured', 'person_is_severely_injured', 'person_is_dead', 'latitude', 'longitude', 'regional', 'delegation', 'uop'])
+    df_full.sort_values(by=['date', 'hour', 'city'], inplace=True)
+    return df_full
+
+def read_year(group, year, utf_path):
+    """ Reads the UTF-8 version of a year, with the separator and dtypes used by the notebooks"""
+    if group == "raw":
+        return pd.read_csv(utf_path, sep=";", dtype={22: "string", 23:"string", 25:"string"})
+    # Up to 2015 the files are comma separated
+    separator = "," if year <= 2015 else ";"
+    return pd.read_csv(utf_path, sep=separator, dtype={6: "string", 7:"string"})
+
+def split_clean_dataset(clean_fingerprint):
+    """ Reads the cleaned aggregated dataset once, for all the workers of the raw group, and
+    saves it split by the year of its dates: a worker loads only the years it can be joined
+    with (see load_clean_rows) instead of the whole dataset. The rows are rounded and sorted
+    (dataIntegration notebook) before the split. The split is kept until the dataset changes.
+        Args:
+            clean_fingerprint: The fingerprint of the cleaned aggregated dataset
+    """
+    fingerprint_path = os.path.join(CLEAN_SPLIT_FOLDER, "fingerprint.json")
+    if os.path.exists(fingerprint_path):
+        with open(fingerprint_path, "r") as file:
+            if json.load(file) == clean_fingerprint:
+                return
+    shutil.rmtree(CLEAN_SPLIT_FOLDER, ignore_errors=True)
+    os.makedirs(CLEAN_SPLIT_FOLDER)
+
+    df = pd.read_csv(CLEAN_DATASET)
+    df["latitude"] = df["latitude"].round(5)
+    df["longitude"] = df["longitude"].round(5)
+    df.sort_values(by=['date', 'hour', 'city'], inplace=True)
+    # The dates are yyyy-mm-dd strings, sorted before the missing ones
+    keys = df["date"].astype(str).str[:4].where(df["date"].notna(), "missing")
+    df.iloc[:0].to_pickle(os.path.join(CLEAN_SPLIT_FOLDER, "empty.pkl"))
+    for key, part in df.groupby(keys, sort=False):
+        part.to_pickle(os.path.join(CLEAN_SPLIT_FOLDER, f"{key}.pkl"))
+    # Written last: an interrupted split is redone
+    with open(fingerprint_path, "w") as file:
+        json.dump(clean_fingerprint, file)
+
+def load_clean_rows(dates):
+    """ Returns the rows of the cleaned aggregated dataset that may be joined with the
+    accidents of the given dates: the years of the dates and the rows without a date,
+    which pd.merge joins with the missing dates. The rows keep the order they have in
+    the whole sorted dataset, so the join gives the same result"""
+    keys = sorted(set(dates.dropna().astype(str).str[:4])) + ["missing"]
+    paths = [os.path.join(CLEAN_SPLIT_FOLDER, f"{key}.pkl") for key in keys]
+    parts = [pd.read_pickle(path) for path in paths if os.path.exists(path)]
+    if len(parts) == 0:
+        return pd.read_pickle(os.path.join(CLEAN_SPLIT_FOLDER, "empty.pkl"))
+    return pd.concat(parts)
+
+def process_year(group, year, clean_fingerprint, force=False):
+    """ Transcodes, translates and checkpoints a single year. It runs inside the worker processes.
+        Args:
+            group: The name of the group of years (a key of GROUPS)
+            year: The year to process
+            clean_fingerprint: The fingerprint of the cleaned aggregated dataset, which
+            is an input of the raw group only
+            force: If True, the year is processed even if its inputs haven't changed
+        Returns:
+            A tuple (group, year, status, elapsed seconds) where status is
+            "processed" or "skipped"
+    """
+    start = time.perf_counter()
+    src = source_path(group, year)
+    ckpt = checkpoint_path(group, year)
+    fingerprint = {
+        "version": INGESTION_VERSION,
+        "source": file_fingerprint(src),
+        "clean_dataset": clean_fingerprint if group == "raw" else None
+    }
+
+    ckpt_json = ckpt.replace(".csv", ".json")
+    if not force and os.path.exists(ckpt) and os.path.exists(ckpt_json):
+        with open(ckpt_json, "r") as file:
+            if json.load(file) == fingerprint:
+                return group, year, "skipped", time.perf_counter() - start
+
+    utf_path = transcode(src, year)
+    df_full = read_year(group, year, utf_path)
+    if group == "raw":
+        # The third column is the date (data_inversa), renamed by translate_raw
+        df = load_clean_rows(df_full.iloc[:, 2])
+        df_year = translate_raw(df_full, df)
+    elif group == "extra_old":
+        df_year = translate_extra_old(df_full)
+    else:
+        df_year = translate_extra_new(df_full)
+
+    # The checkpoint and its fingerprint are written only once the year is complete
+    os.makedirs(os.path.dirname(ckpt), exist_ok=True)
+    df_year.to_csv(ckpt + ".tmp", index=False, encoding="utf-8")
+    os.replace(ckpt + ".tmp", ckpt)
+    with open(ckpt_json, "w") as file:
+        json.dump(fingerprint, file)
+    return group, year, "processed", time.perf_counter() - start
+
+def merge_group(group, chunksize=100000):
+    """ Merges the checkpoints of a group into its output csv file. The checkpoints
+    are streamed in chunks, so the whole group is never loaded in memory."""
+    passes = GROUPS[group]["merge"]
+    output = GROUPS[group]["output"]
+
+    # Like pd.concat, the output has the union of the columns of the years in order of appearance
+    columns = []
+    for year, _ in passes:
+        for col in pd.read_csv(checkpoint_path(group, year), nrows=0).columns:
+            if col not in columns:
+                columns.append(col)
+
+    tmp_path = output + ".tmp"
+    header = True
+    for year, query in passes:
+        # Reading everything as text, the values are copied to the output exactly as they are
+        reader = pd.read_csv(checkpoint_path(group, year), chunksize=chunksize,
+                             dtype=str, keep_default_na=False)
+        for chunk in reader:
+            if query is not None:
+                chunk = chunk.query(query)
+            chunk = chunk.reindex(columns=columns, fill_value="")
+            chunk.to_csv(tmp_path, mode="w" if header else "a", header=header,
+                         index=False, encoding="utf-8")
+            header = False
+    os.replace(tmp_path, output)
+
+def ingest(groups, years=None, workers=None, force=False):
+    """ Processes the selected groups of years in a pool of processes and merges
+    the groups having at least one updated year (or a missing output).
+        Args:
+            groups: The names of the groups to process
+            years: Optional field. If specified, only these years are (re)processed
+            workers: Optional field. The size of the process pool (default: the number of CPUs)
+            force: If True, all the years are processed even if their inputs haven't changed
+        Returns:
+            True if all the years have been processed without errors
+    """
+    fix_file_names()
+    clean_fingerprint = None
+    if "raw" in groups:
+        if not os.path.exists(CLEAN_DATASET):
+            print(f"[ERR] {CLEAN_DATASET} not found. Start the application once to produce it.")
+            return False
+        clean_fingerprint = file_fingerprint(CLEAN_DATASET)
+        split_clean_dataset(clean_fingerprint)
+
+    tasks = [(group, year) for group in groups for year in GROUPS[group]["years"]
+             if years is None or year in years]
+    updated = set()
+    failed = set()
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = {executor.submit(process_year, group, year, clean_fingerprint, force): (group, year)
+                   for group, year in tasks}
+        for future in as_completed(futures):
+            group, year = futures[future]
+            try:
+                _, _, status, elapsed = future.result()
+            except Exception as e:
+                print(f"[ERR] [{group}] {year}: {e}")
+                failed.add(group)
+                continue
+            print(f"[INFO] [{group}] {year}: {status} in {elapsed:.1f} s")
+            if status == "processed":
+                updated.add(group)
+
+    for group in groups:
+        missing = [year for year, _ in GROUPS[group]["merge"] if not os.path.exists(checkpoint_path(group, year))]
+        if group in failed:
+            print(f"[ERR] [{group}] Not merged because of the errors above.")
+        elif missing:
+            print(f"[ERR] [{group}] Not merged: the years {sorted(set(missing))} have never been processed.")
+            failed.add(group)
+        elif group in updated or not os.path.exists(GROUPS[group]["output"]):
+            start = time.perf_counter()
+            merge_group(group)
+            print(f"[INFO] [{group}] {GROUPS[group]['output']} written in {time.perf_counter() - start:.1f} s")
+        else:
+            print(f"[INFO] [{group}] Up to date.")
+    return len(failed) == 0
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--groups", nargs="+", choices=list(GROUPS), default=list(GROUPS),
+                        help="groups of years to ingest (default: all)")
+    parser.add_argument("--years", nargs="+", type=int,
+                        help="process only these years (default: all the years of the groups)")
+    parser.add_argument("--workers", type=int, default=None,
+                        help="size of the process pool (default: number of CPUs)")
+    parser.add_argument("--force", action="store_true",
+                        help="process the years even if their inputs haven't changed")
+    args = parser.parse_args()
+    ok = ingest(args.groups, years=args.years, workers=args.workers, force=args.force)
+    raise SystemExit(0 if ok else 1)
@@ -0,0 +1,197 @@
+""" Offline precomputation of the hotspots of every (city, general cause) partition with
+DBSCAN and of every (state, general cause) partition with OPTICS (and of both with
+HDBSCAN, if requested).
+
+The partitions are clustered by a pool of processes with the same parameters of the
+/clustering route, the largest ones first. Every result is written to the on-disk tier of
+the result cache of the backend (result_cache_dir in application/config.json), under the
+same key of /clustering: once the backend is restarted on the same dataset, it serves them
+directly. The partitions already in the cache are skipped, so an interrupted run resumes
+from where it stopped. The timing of every partition is printed and saved in
+precompute_report.json inside the cache directory.
+
+Run it from the root of the project, e.g. every night after the data refresh:
+    python precompute_hotspots.py [--algorithms DBSCAN OPTICS] [--workers N] [--min-size N] [--force]
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import contextlib
+import io
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "application"))
+from ml.configloader import ConfigLoader
+from ml.hotspotDetector.datasetLoader import DatasetLoader
+from ml.hotspotDetector.preprocessing import Preprocessing
+from ml.hotspotDetector.partitionIndex import PartitionIndex
+from ml.hotspotDetector.coordinateStore import CoordinateStore
+from ml.hotspotDetector.catalog import Catalog
+from ml.hotspotDetector.clusteringService import ClusteringService
+from ml.hotspotDetector.resultCache import ResultCache
+
+CONFIG_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "application", "config.json")
+
+# The dataset of a worker process: inherited from the parent with fork, loaded by
+# the worker itself otherwise
+_data = None
+
+def load_data(configloader):
+    """ Loads and indexes the dataset as the backend does
+    Returns:
+        A dictionary with the preprocessed dataframe, its PartitionIndex and CoordinateStore
+        and the fingerprint of the dataset
+    """
+    datasetloader = DatasetLoader(full_dataset_path=configloader.getFullDataset(),
+                        clean_dataset_path=configloader.getCleanDataset())
+    cleaned_df = datasetloader.loadDataset()
+    if cleaned_df is None:
+        raise Exception("No dataset available")
+    preprocessing = Preprocessing(cleaned_df)
+    preprocessing.drop_columns(cols_to_keep=["latitude",
+                "longitude", "cause_of_accident", "victims_conditions", "road_id", "km", "city", "state", "victims_condition"])
+    preprocessing.map_general_causes()
+    with contextlib.redirect_stdout(io.StringIO()):
+        preprocessing.compact_dataframe()
+    df = preprocessing.getDataframe()
+    partitionIndex = PartitionIndex(df)
+    store_dir = os.path.splitext(configloader.getCleanDataset())[0] + "_coordinates"
+    coordinateStore = CoordinateStore(store_dir)
+    coordinateStore.load_or_build(df, datasetloader.getFingerprint())
+    return {
+        "df": df,
+        "partitionIndex": partitionIndex,
+        "coordinateStore": coordinateStore,
+        "fingerprint": datasetloader.getFingerprint()
+    }
+
+def list_partitions(data, algorithms, min_size):
+    """ Returns the partitions to cluster as (algorithm, granularity, name, cause, number of
+    accidents), the largest first: the long partitions start immediately, and the short ones
+    fill the workers at the end of the run. HDBSCAN clusters both the cities and the states"""
+    catalog = Catalog(data["df"], data["partitionIndex"])
+    partitions = []
+    for algorithm in algorithms:
+        if algorithm in ("DBSCAN", "HDBSCAN"):
+            for city in catalog.getCities():
+                partitions += [(algorithm, "city", city, cause, size) for cause, size in catalog.getCausesCity(city).items()]
+        if algorithm in ("OPTICS", "HDBSCAN"):
+            for state in catalog.getStates():
+                partitions += [(algorithm, "state", state, cause, size) for cause, size in catalog.getCausesState(state).items()]
+    partitions = [partition for partition in partitions if partition[4] >= min_size]
+    return sorted(partitions, key=lambda partition: partition[4], reverse=True)
+
+def init_worker(config_path):
+    global _data
+    if _data is None:
+        _data = load_data(ConfigLoader(config_path))
+
+def cluster_partition(config_path, algorithm, granularity, name, cause):
+    """ Clusters a partition in a worker process and writes the result to the cache
+    Returns:
+        The status of the tuning and the elapsed time
+    """
+    configloader = ConfigLoader(config_path)
+    # The partitions are already run in parallel: the sweep of each one is serial
+    clusteringService = ClusteringService(configloader, tuning_workers=1)
+    resultCache = ResultCache(max_entries=1, disk_dir=configloader.get_resultCacheDir())
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        response = clusteringService.cluster(_data["df"], _data["partitionIndex"], _data["coordinateStore"],
+                                             algorithm, name, cause, granularity)
+    key = clusteringService.cache_key(resultCache, algorithm, name, cause,
+                                      _data["partitionIndex"], _data["fingerprint"], granularity)
+    resultCache.put(key, response)
+    return response["sts"], time.perf_counter() - start
+
+def precompute(algorithms, workers=None, min_size=None, force=False, config_path=CONFIG_PATH):
+    """ Clusters in a pool of processes the partitions whose result isn't cached yet
+        Args:
+            algorithms: The algorithms to run, "DBSCAN" (cities) and/or "OPTICS" (states)
+            workers: Optional field. The size of the process pool (default: the number of CPUs)
+            min_size: Optional field. The partitions with fewer accidents are skipped
+            (default: min_partition_size of the config file, the threshold of the frontend)
+            force: If True, the partitions are clustered even if their result is cached
+            config_path: Optional field. The config file (default: the one of the backend)
+        Returns:
+            True if all the partitions have been clustered without errors
+    """
+    global _data
+    configloader = ConfigLoader(config_path)
+    if configloader.get_resultCacheDir() is None:
+        print("[ERR] result_cache_dir is not set in the config file: the results would be lost.")
+        return False
+    if min_size is None:
+        min_size = configloader.get_minPartitionSize()
+    _data = load_data(configloader)
+    fingerprint = _data["fingerprint"]
+    clusteringService = ClusteringService(configloader)
+    resultCache = ResultCache(max_entries=1, disk_dir=configloader.get_resultCacheDir())
+
+    partitions = list_partitions(_data, algorithms, min_size)
+    report = []
+    tasks = []
+    for algorithm, granularity, name, cause, size in partitions:
+        key = clusteringService.cache_key(resultCache, algorithm, name, cause,
+                                          _data["partitionIndex"], fingerprint, granularity)
+        if not force and resultCache.contains(key):
+            report.append({"algorithm": algorithm, "name": name, "cause": cause, "accidents": size,
+                           "status": "cached", "seconds": None})
+        else:
+            tasks.append((algorithm, granularity, name, cause, size))
+    print(f"[INFO] {len(partitions)} partitions, {len(partitions) - len(tasks)} already cached, {len(tasks)} to cluster")
+
+    # With fork the workers inherit the dataset instead of loading it again
+    if "fork" in multiprocessing.get_all_start_methods():
+        context = multiprocessing.get_context("fork")
+    else:
+        context = multiprocessing.get_context("spawn")
+        _data = None
+    failed = 0
+    start = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=workers, mp_context=context,
+                             initializer=init_worker, initargs=(config_path,)) as executor:
+        futures = {executor.submit(cluster_partition, config_path, algorithm, granularity, name, cause):
+                   (algorithm, name, cause, size) for algorithm, granularity, name, cause, size in tasks}
+        for done, future in enumerate(as_completed(futures), start=1):
+            algorithm, name, cause, size = futures[future]
+            entry = {"algorithm": algorithm, "name": name, "cause": cause, "accidents": size}
+            try:
+                sts, elapsed = future.result()
+            except Exception as e:
+                print(f"[ERR] [{done}/{len(tasks)}] {algorithm} {name} - {cause}: {e}")
+                entry.update({"status": "failed", "seconds": None, "error": str(e)})
+                failed += 1
+            else:
+                status = "no clusters" if sts == -1 else "clustered"
+                print(f"[INFO] [{done}/{len(tasks)}] {algorithm} {name} - {cause}: {size} accidents, {status} in {elapsed:.1f} s")
+                entry.update({"status": status, "seconds": elapsed})
+            report.append(entry)
+
+    report_path = os.path.join(configloader.get_resultCacheDir(), "precompute_report.json")
+    with open(report_path, "w") as file:
+        json.dump({"fingerprint": fingerprint,
+                   "seconds": time.perf_counter() - start, "partitions": report}, file, indent=2)
+    print(f"[INFO] Done in {time.perf_counter() - start:.1f} s, {failed} failed. Report written to {report_path}")
+    return failed == 0
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--algorithms", nargs="+", choices=list(ClusteringService.ALGORITHMS),
+                        default=["DBSCAN", "OPTICS"],
+                        help="DBSCAN for the cities, OPTICS for the states, HDBSCAN for both (default: DBSCAN OPTICS)")
+    parser.add_argument("--workers", type=int, default=None,
+                        help="size of the process pool (default: number of CPUs)")
+    parser.add_argument("--min-size", type=int, default=None,
+                        help="skip the partitions with fewer accidents (default: min_partition_size of the config file)")
+    parser.add_argument("--force", action="store_true",
+                        help="cluster the partitions even if their result is already cached")
+    parser.add_argument("--config", default=CONFIG_PATH,
+                        help="config file (default: the one of the backend, whose cache is filled)")
+    args = parser.parse_args()
+    ok = precompute(args.algorithms, workers=args.workers, min_size=args.min_size, force=args.force,
+                    config_path=args.config)
+    raise SystemExit(0 if ok else 1)